@@ -28,7 +28,7 @@ class VehiclesAdmin(ImportExportModelAdmin):
     list_display = ('serial_number', 'citizen', 'model', 'year', 'manufacturer', 'vehicle_type', 'plate_number', 'picture', 'is_under_transfer')
 
 class NotificationsAdmin(admin.ModelAdmin):
-    list_display = ('citizen', 'message')
+    list_display = ('citizen', 'message', 'created_at', 'is_read')
 
 class RenewalRequestsAdmin(admin.ModelAdmin):
     list_display = ('citizen', 'request_type', 'reason', 'proof_document', 'status', 'picture', 'submitted_at', 'reviewed_at', 'rejection_reason')
@@ -40,7 +40,11 @@ class ForumsAdmin(admin.ModelAdmin):
     list_display = ('region', 'title')
 
 class PostsAdmin(admin.ModelAdmin):
-    list_display = ('forum', 'author', 'title', 'content', 'timestamp', 'likes_count')
+    list_display = ('forum', 'author', 'title', 'content', 'timestamp', 'likes_count', 'is_deleted')
+
+    # list the soft deleted posts too, the default manager hides them
+    def get_queryset(self, request):
+        return Posts.all_objects.all()
 
 class CommentsAdmin(admin.ModelAdmin):
     list_display = ('post', 'author', 'content', 'timestamp')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DigitalsocietyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "digitalSociety"
+
+    def ready(self):
+        # connect the signal receivers
+        from . import signals
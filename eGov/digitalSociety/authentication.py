@@ -0,0 +1,107 @@
+from django.contrib.auth.models import Group
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .models import *
+
+'''
+In this file, a stateless JWT authentication is defined. The tokens carry the user's username, national id,
+active state and group names as signed claims, so the views that opt in can authenticate a request without loading the user.
+The claims are read again every time the access token is refreshed, so they are at most one access token
+lifetime (SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']) behind the database.
+'''
+
+'''This function adds the claims used by the stateless authentication to a token'''
+def add_user_claims(token, user):
+    token['username'] = user.username
+    token['is_active'] = user.is_active
+    token['national_id'] = Citizens.objects.filter(user=user).values_list('national_id', flat=True).first()
+    token['groups'] = list(user.groups.values_list('name', flat=True))
+    return token
+
+'''
+This class is the user of the requests authenticated from the claims. The claims are read without touching the
+database and the citizen is loaded by its national id when a view asks for it. The attributes that aren't in the
+claims raise an AttributeError instead of loading the user, a view that needs them, like the email, reads them
+from the user property so the query is explicit.
+'''
+class ClaimsUser(TokenUser):
+    @cached_property
+    def national_id(self):
+        return self.token.get('national_id')
+
+    @cached_property
+    def group_names(self):
+        return tuple(self.token.get('groups', ()))
+
+    @property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+    # the user's groups as a query on the names in the claims, for the permission checks that read user.groups
+    @property
+    def groups(self):
+        return Group.objects.filter(name__in=self.group_names)
+
+    @cached_property
+    def citizen(self):
+        if self.national_id is None:
+            raise Citizens.DoesNotExist('User not associated with a citizen profile')
+        return Citizens.objects.get(national_id=self.national_id, user_id=self.pk)
+
+    @cached_property
+    def user(self):
+        return User.objects.get(pk=self.pk)
+
+    # the writes go through the full user
+    def save(self, *args, **kwargs):
+        return self.user.save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.user.delete(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        return self.user.set_password(raw_password)
+
+    def check_password(self, raw_password):
+        return self.user.check_password(raw_password)
+
+    def __getattr__(self, attr):
+        # never read the token for the private attributes, this also avoids a recursion before the token is set
+        if not attr.startswith('_') and attr != 'token' and attr in self.token:
+            return self.token[attr]
+        raise AttributeError(f"'{type(self).__name__}' has no claim '{attr}', read it from the user property")
+
+'''
+This authentication class returns a ClaimsUser instead of loading the user when the token carries the claims.
+The tokens that were issued before the claims were added still work, their user is loaded from the database.
+'''
+class StatelessJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in ('groups', 'is_active', api_settings.USER_ID_CLAIM)):
+            return super().get_user(validated_token)
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
+
+'''This serializer adds the claims to the tokens issued when the user logs in'''
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # the access token copies the claims of the refresh token
+        return add_user_claims(super().get_token(user), user)
+
+'''This serializer reads the claims again when the access token is refreshed, so the changes to the groups are picked up'''
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        data = super().validate(attrs)
+        user = User.objects.filter(pk=refresh[api_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed('User not found or inactive', code='user_inactive')
+        data['access'] = str(add_user_claims(refresh.access_token, user))
+        return data
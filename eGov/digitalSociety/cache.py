@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+'''
+This class is a small thread safe LRU cache whose entries expire after a time to live. Each process has its
+own instances, so they are used for data that is read on almost every request and rarely changes. The hit and
+miss counters are kept so that the cache's effectiveness can be checked.
+'''
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    '''This function returns whether the key was found and its value, counting the lookup as a hit or a miss'''
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                # move the key to the end so that it is the last one to be evicted
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                # the entry has expired
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            # evict the least recently used entries
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    '''This function returns the cached value of the key, or loads it and caches it on a miss'''
+    def get_or_set(self, key, load):
+        found, value = self.lookup(key)
+        if not found:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+'''
+The names of the groups of each user, keyed by the user's id. The entries are removed by the signal receivers
+in signals.py whenever a user's groups change, the time to live only bounds how long a missed change can last.
+'''
+user_groups_cache = TTLCache(maxsize=settings.GROUP_CACHE_MAXSIZE, ttl=settings.GROUP_CACHE_TTL)
+
+'''This function returns the names of the user's groups from the token's claims or from the cache'''
+def get_user_groups(user):
+    # the users authenticated from the token's claims already carry their groups
+    group_names = getattr(user, 'group_names', None)
+    if group_names is not None:
+        return group_names
+    return user_groups_cache.get_or_set(user.pk, lambda: tuple(user.groups.values_list('name', flat=True)))
+
+'''This function checks if the user is in the group without querying the database when the user's groups are cached'''
+def user_in_group(user, group_name):
+    return user.is_authenticated and group_name in get_user_groups(user)
@@ -0,0 +1,312 @@
+import atexit
+import threading
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Log
+from .models import *
+from .search import get_search_backend
+from .tasks import run_in_background
+
+'''
+In this file, the write paths of the forums are defined. They change the rows with set based queries
+instead of loading the related objects, so their cost doesn't depend on how popular a post is.
+'''
+
+'''
+This class buffers the changes to the likes counts in the process and writes them in batches. During a live event
+thousands of likes land on the same post, and instead of updating its row for every one of them the changes are
+added up and written with one update per model every flush. The flush runs on a background thread started by the
+first change, and once more when the process exits.
+'''
+class LikeCounterBuffer:
+    def __init__(self):
+        self.changes = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def add(self, model, pk, change):
+        with self.lock:
+            key = (model, pk)
+            self.changes[key] = self.changes.get(key, 0) + change
+        self.start()
+
+    '''This function returns the change that is waiting to be written for the object'''
+    def pending(self, model, pk):
+        with self.lock:
+            return self.changes.get((model, pk), 0)
+
+    def start(self):
+        interval = settings.LIKES_FLUSH_INTERVAL
+        if not interval or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=[interval], daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def run(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.flush()
+            finally:
+                # the thread's connection is only used for the flush, so don't keep it open between them
+                connection.close()
+
+    '''This function writes the buffered changes, with one update per model, and returns the number of updated rows'''
+    def flush(self):
+        with self.lock:
+            changes, self.changes = self.changes, {}
+        by_model = {}
+        for (model, pk), change in changes.items():
+            if change:
+                by_model.setdefault(model, {})[pk] = change
+        updated = 0
+        for model, model_changes in by_model.items():
+            change = Case(*[When(pk=pk, then=Value(change)) for pk, change in model_changes.items()], output_field=IntegerField())
+            updated += model.objects.filter(pk__in=model_changes).update(likes_count=Greatest(F('likes_count') + change, 0))
+        if Posts in by_model:
+            # rank the liked posts again with their new counts
+            refresh_hot_scores(Posts.objects.filter(pk__in=by_model[Posts]))
+        return updated
+
+like_counter_buffer = LikeCounterBuffer()
+
+'''
+This function toggles the citizen's like on a post or a comment and returns whether it is now liked and the new
+likes count. Deleting the citizen's row from the likes table is the existence probe: it goes through the table's
+unique (object, citizen) index and tells if the like was there in the same statement that removes it, so two
+requests can't both see it missing. The count is changed with an F() expression in the same transaction, so
+concurrent likes from different citizens are all counted instead of overwriting each other. In the write behind
+mode the change is buffered once the transaction commits, and the count returned includes the buffered changes.
+'''
+def toggle_like(obj, citizen_id):
+    model = type(obj)
+    likes = model._meta.get_field('likes')
+    through = likes.remote_field.through
+    # the row of the likes table that links the object to the citizen
+    row = {likes.m2m_column_name(): obj.pk, likes.m2m_reverse_name(): citizen_id}
+    with transaction.atomic():
+        removed, _ = through.objects.filter(**row).delete()
+        if removed:
+            liked, change = False, -1
+        else:
+            try:
+                # the savepoint keeps the transaction usable if the insert fails
+                with transaction.atomic():
+                    through.objects.create(**row)
+                liked, change = True, 1
+            except IntegrityError:
+                # another request of the same citizen added the like first, so it was already counted
+                liked, change = True, 0
+        if change and settings.LIKES_WRITE_BEHIND:
+            transaction.on_commit(lambda: like_counter_buffer.add(model, obj.pk, change))
+        elif change:
+            model.objects.filter(pk=obj.pk).update(likes_count=Greatest(F('likes_count') + change, 0))
+            if model is Posts:
+                update_hot_score(obj)
+        likes_count = model.objects.filter(pk=obj.pk).values_list('likes_count', flat=True).get()
+        if settings.LIKES_WRITE_BEHIND:
+            # add the buffered changes, this one is only buffered when the transaction commits
+            likes_count = max(likes_count + like_counter_buffer.pending(model, obj.pk) + change, 0)
+    return liked, likes_count
+
+# the hot sort ranks the posts by the sum of these, the time is counted from a fixed date so the scores never need to be shifted
+HOT_SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+'''
+This function returns the part of the hot score that comes from the post's creation time. Every HOT_SCORE_DECAY seconds
+adds 1 to the score of the new posts, which is worth as much as 10 times more likes and comments on an older post.
+Since the older posts don't lose points but the newer ones start higher, the scores only change when a post gets
+liked or commented on, and the posts don't need to be ranked again just because time passed.
+'''
+def hot_time_score(timestamp):
+    return (timestamp - HOT_SCORE_EPOCH).total_seconds() / settings.HOT_SCORE_DECAY
+
+'''
+This function returns the expression of the hot score of each post: log10 of one plus its likes and comments, plus the
+time score. The comments are read from the post's comments counter, so the score costs the same however many comments it has.
+'''
+def hot_score(time_score):
+    engagement = F('likes_count') + F('comments_count')
+    return Log(10, Greatest(engagement, 0) + 1, output_field=FloatField()) + time_score
+
+'''This function updates the hot score of a post after it was liked or commented on, with one query'''
+def update_hot_score(post):
+    Posts.objects.filter(pk=post.pk).update(hot_score=hot_score(Value(hot_time_score(post.timestamp))))
+
+'''
+This function computes the hot scores of the posts again in batches, with one update per batch. It is run by
+the refresh_hot_scores command to fix the scores of the posts that were changed without going through the forum's
+write paths, like the ones created in bulk, and returns the number of updated posts.
+'''
+def refresh_hot_scores(posts=None, batch_size=1000):
+    posts = Posts.objects.all() if posts is None else posts
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'timestamp')[:batch_size])
+        if not batch:
+            return updated
+        time_score = Case(*[When(pk=pk, then=Value(hot_time_score(timestamp))) for pk, timestamp in batch], output_field=FloatField())
+        updated += Posts.objects.filter(pk__in=[pk for pk, _ in batch]).update(hot_score=hot_score(time_score))
+        if len(batch) < batch_size:
+            return updated
+        last_pk = batch[-1][0]
+
+# the denormalized counters that are reconciled with the rows they count: (model, counter field, relation, filters of the counted rows)
+COUNTERS = [
+    (Posts, 'likes_count', 'likes', {}),
+    (Comments, 'likes_count', 'likes', {}),
+    (Posts, 'comments_count', 'comments', {}),
+    (Forums, 'posts_count', 'posts', {}),
+    (Citizens, 'unread_notifications_count', 'notifications', {'is_read': False}),
+]
+
+'''This function returns an expression that counts the rows of the many to many or reverse foreign key relation of each object that match the filters'''
+def count_related(model, relation, filters=None):
+    field = model._meta.get_field(relation)
+    if field.many_to_many:
+        rows, column = field.remote_field.through, field.m2m_field_name()
+    else:
+        # the rows pointing to the object with a foreign key
+        rows, column = field.related_model, field.field.name
+    counts = rows.objects.filter(**{column: OuterRef('pk')}, **(filters or {})).order_by().values(column).annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+'''
+This function sets every counter that drifted from the rows it counts back to their number, for example the likes
+counts that lost the buffered changes of a process that was killed. It returns the number of fixed rows per counter.
+'''
+def reconcile_counters():
+    fixed = {}
+    for model, field, relation, filters in COUNTERS:
+        # every row is fixed, with the soft deleted posts, while the counted rows leave them out like their counters do
+        rows = model._base_manager.all()
+        actual = count_related(model, relation, filters)
+        drifted = rows.annotate(actual=actual).exclude(**{field: F('actual')}).values('pk')
+        fixed[f'{model.__name__}.{field}'] = rows.filter(pk__in=drifted).update(**{field: actual})
+    return fixed
+
+'''
+This function returns the author's display fields that are copied to the posts and comments. The snapshot is taken
+when a post or comment is created and refreshed in the background when the author changes their username or picture.
+'''
+def author_snapshot(citizen):
+    return {'author_username': citizen.user.username, 'author_picture': citizen.picture.name}
+
+# the expressions that read the current author's display fields of each post or comment
+def author_snapshot_fields():
+    authors = Citizens.objects.filter(pk=OuterRef('author_id'))
+    return {
+        'author_username': Subquery(authors.values('user__username')[:1]),
+        'author_picture': Subquery(authors.values('picture')[:1]),
+    }
+
+'''
+This function copies the authors' display fields to their posts and comments again, in batches with one update per
+batch, and returns the number of updated rows per model. Without citizen ids, it refreshes all the posts and comments.
+'''
+def refresh_author_snapshots(citizen_ids=None, batch_size=1000):
+    updated = {}
+    for model in (Posts, Comments):
+        rows = model.objects.all() if citizen_ids is None else model.objects.filter(author_id__in=citizen_ids)
+        updated[model.__name__] = 0
+        last_pk = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if batch:
+                updated[model.__name__] += model.objects.filter(pk__in=batch).update(**author_snapshot_fields())
+            if len(batch) < batch_size:
+                break
+            last_pk = batch[-1]
+    return updated
+
+'''This function returns the posts or comments whose snapshot doesn't match their author anymore'''
+def stale_author_snapshots(model):
+    return model.objects.filter(~Q(author_username=F('author__user__username')) | ~Q(author_picture=F('author__picture')))
+
+'''
+This function deletes the rows of the queryset in chunks of chunk_size rows, each with one DELETE statement in its
+own transaction, and returns the number of deleted rows. The rows are deleted without loading them and without
+sending the delete signals, so the caller is responsible for what the signals would have done.
+'''
+def delete_in_chunks(queryset, chunk_size):
+    meta = queryset.model._meta
+    table, pk = connection.ops.quote_name(meta.db_table), connection.ops.quote_name(meta.pk.column)
+    # the primary keys of the next chunk, the deleted rows no longer match so the same select gives the next ones
+    select, params = queryset.order_by().values('pk')[:chunk_size].query.sql_with_params()
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({select})", params)
+            count = cursor.rowcount
+        deleted += count
+        if count < chunk_size:
+            return deleted
+
+'''
+This function hides a post: it stops being listed, counted in its forum and found by the search. The post's row is
+locked while it is hidden, so two deletes can't both take it off its forum's counter. It returns False when the
+post doesn't exist or was already hidden.
+'''
+def hide_post(post_id):
+    with transaction.atomic():
+        post = Posts.all_objects.select_for_update().filter(pk=post_id).values('forum_id', 'is_deleted').first()
+        if post is None or post['is_deleted']:
+            return False
+        Posts.all_objects.filter(pk=post_id).update(is_deleted=True)
+        Forums.objects.filter(pk=post['forum_id'], posts_count__gt=0).update(posts_count=F('posts_count') - 1)
+        backend = get_search_backend()
+        if backend is not None:
+            backend.remove_post(post_id)
+    return True
+
+'''This function returns the rows that hang from a post, the likes of its comments, its comments and its likes, in the order they are deleted'''
+def post_rows(post_id):
+    comment_likes = Comments._meta.get_field('likes')
+    post_likes = Posts._meta.get_field('likes')
+    return [
+        ('comment likes', comment_likes.remote_field.through.objects.filter(**{f'{comment_likes.m2m_field_name()}__post_id': post_id})),
+        ('comments', Comments.objects.filter(post_id=post_id)),
+        ('post likes', post_likes.remote_field.through.objects.filter(**{post_likes.m2m_field_name(): post_id})),
+    ]
+
+'''
+This function deletes a post with its comments and all their likes with set based deletes in bounded chunks, so a
+post with many comments and likes doesn't hold the locks for long or load its rows like post.delete() does. The
+post is hidden first, which does what the delete signals of the post would do and stops the views from liking or
+commenting on it, then its likes go, then the comments and the post. A like or a comment that was added while the
+chunks were deleted, by a request that found the post before it was hidden, is deleted with the post in the same
+transaction, and after that its foreign key refuses them. It returns the number of deleted rows of each table.
+'''
+def purge_post(post_id, chunk_size=None):
+    chunk_size = chunk_size or settings.POST_DELETE_CHUNK_SIZE
+    # a post that was hidden before, by soft_delete_post, is purged too
+    if not hide_post(post_id) and not Posts.all_objects.filter(pk=post_id, is_deleted=True).exists():
+        return {}
+    deleted = {name: delete_in_chunks(rows, chunk_size) for name, rows in post_rows(post_id)}
+    with transaction.atomic():
+        for name, rows in post_rows(post_id):
+            deleted[name] += delete_in_chunks(rows, chunk_size)
+        deleted['posts'] = delete_in_chunks(Posts.all_objects.filter(pk=post_id), chunk_size)
+    return deleted
+
+'''
+This function hides a post right away and purges it in the background. The post stops being listed, counted in its
+forum and found by the search in the same transaction, so the request returns before the comments and likes are deleted.
+'''
+def soft_delete_post(post):
+    with transaction.atomic():
+        if hide_post(post.pk):
+            run_in_background(purge_post, post.pk)
+
+'''This function purges the posts that were soft deleted but not purged, like the ones of a process that stopped, and returns their number'''
+def purge_deleted_posts(chunk_size=None):
+    post_ids = list(Posts.all_objects.filter(is_deleted=True).values_list('pk', flat=True))
+    for post_id in post_ids:
+        purge_post(post_id, chunk_size)
+    return len(post_ids)
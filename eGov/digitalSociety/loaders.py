@@ -0,0 +1,130 @@
+from django.db.models import Prefetch
+from .models import *
+
+'''
+In this file, batch loaders are defined. A loader receives a whole page of objects and fetches their related
+data with one query per related table, so the serializers can read it instead of running a query for every row.
+'''
+
+'''This loader fetches the pending document of every registration request in the page'''
+class RegistrationDocumentsLoader:
+    # the placeholder document that waits for the inspector for each request type
+    DOCUMENT_QUERIES = {
+        'Address Registration': (Addresses, {'state': 'Pending Request'}),
+        'Property Registration': (Properties, {'is_under_transfer': True}),
+        'Vehicle Registration': (Vehicles, {'is_under_transfer': True}),
+    }
+
+    def __init__(self, registration_requests):
+        # group the citizens by request type so only the document types that are listed get fetched
+        citizens_by_type = {}
+        for registration_request in registration_requests:
+            citizens_by_type.setdefault(registration_request.request_type, set()).add(registration_request.citizen_id)
+
+        self.documents = {}
+        for request_type, citizen_ids in citizens_by_type.items():
+            if request_type not in self.DOCUMENT_QUERIES:
+                continue
+            model, filters = self.DOCUMENT_QUERIES[request_type]
+            documents = {}
+            for document in model.objects.filter(citizen_id__in=citizen_ids, **filters).order_by('id'):
+                # keep the first pending document of each citizen
+                documents.setdefault(document.citizen_id, document)
+            self.documents[request_type] = documents
+
+    def get(self, request_type, citizen_id):
+        return self.documents.get(request_type, {}).get(citizen_id)
+
+'''
+This function adds the relations that the posts and comments serializers read to a queryset. The authors are
+read from the rows' snapshot so they aren't joined, and the likes of the whole page are fetched in one more query.
+'''
+def with_listing_relations(queryset):
+    return queryset.prefetch_related(
+        Prefetch('likes', queryset=Citizens.objects.only('national_id'))
+    )
+
+'''
+This function returns the ids of the posts or comments in the page that the user liked. It is one query on the likes
+table through its (object, citizen) index. The citizen's id is taken from the token's claims when it's there, otherwise
+the likes are joined to the citizens to match the user.
+'''
+def liked_ids(model, objects, user):
+    ids = [obj.pk for obj in objects]
+    if not ids or not user.is_authenticated:
+        return set()
+    likes = model._meta.get_field('likes')
+    column = likes.m2m_column_name()
+    national_id = getattr(user, 'national_id', None)
+    if national_id is not None:
+        citizen_filter = {likes.m2m_reverse_name(): national_id}
+    else:
+        citizen_filter = {f'{likes.m2m_reverse_field_name()}__user_id': user.pk}
+    liked = likes.remote_field.through.objects.filter(**{f'{column}__in': ids}, **citizen_filter)
+    return set(liked.values_list(column, flat=True))
+
+'''
+This loader fetches everything shown on the citizen's documents page in three queries. A citizen has at most one
+passport and one license and only a few addresses, so they are joined to the citizen in the first query and the
+rows are split back into model instances. The properties and vehicles are fetched with one query each.
+'''
+class CitizenDocumentsLoader:
+    # the documents joined to the citizen, mapped to the reverse relation used in the join
+    JOINED_DOCUMENTS = {
+        'passports': Passports,
+        'drivinglicenses': DrivingLicenses,
+        'addresses': Addresses,
+    }
+
+    def __init__(self, user):
+        # build the list of columns to select: the citizen's own fields and the fields of every joined document
+        lookups = [field.attname for field in Citizens._meta.concrete_fields]
+        for relation, model in self.JOINED_DOCUMENTS.items():
+            lookups += [f'{relation}__{field.name}' for field in model._meta.concrete_fields]
+        queryset = Citizens.objects.filter(user_id=user.pk).order_by('passports__pk', 'drivinglicenses__pk', 'addresses__pk')
+        self.db = queryset.db
+        rows = list(queryset.values_list(*lookups))
+        if not rows:
+            raise Citizens.DoesNotExist('User not associated with a citizen profile')
+
+        # the citizen's fields are the same on every row
+        citizen_width = len(Citizens._meta.concrete_fields)
+        self.citizen = self.build(Citizens, rows[0][:citizen_width])
+        if isinstance(user, User):
+            # the user was already loaded by the authentication, so reuse it for the username
+            self.citizen.user = user
+        else:
+            # the user was authenticated from the token's claims, which carry the username
+            self.citizen.user = User(pk=user.pk, username=user.username)
+
+        # split the remaining columns of every row into the joined documents, dropping the repeated ones
+        self.documents = {relation: {} for relation in self.JOINED_DOCUMENTS}
+        for row in rows:
+            start = citizen_width
+            for relation, model in self.JOINED_DOCUMENTS.items():
+                end = start + len(model._meta.concrete_fields)
+                values = row[start:end]
+                start = end
+                # the primary key is None when the citizen doesn't have a document of this type
+                pk = values[model._meta.concrete_fields.index(model._meta.pk)]
+                if pk is not None and pk not in self.documents[relation]:
+                    self.documents[relation][pk] = self.build(model, values)
+
+        self.properties = list(Properties.objects.filter(citizen_id=self.citizen.pk).order_by('pk'))
+        self.vehicles = list(Vehicles.objects.filter(citizen_id=self.citizen.pk).order_by('pk'))
+
+    # create a model instance from the selected values the same way the ORM does when it reads a row
+    def build(self, model, values):
+        return model.from_db(self.db, [field.attname for field in model._meta.concrete_fields], values)
+
+    @property
+    def passport(self):
+        return next(iter(self.documents['passports'].values()), None)
+
+    @property
+    def license(self):
+        return next(iter(self.documents['drivinglicenses'].values()), None)
+
+    @property
+    def addresses(self):
+        return list(self.documents['addresses'].values())
@@ -0,0 +1,203 @@
+import io
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image, ImageDraw
+from botocore.stub import Stubber
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from ..models import *
+from ..modelFactory import create_citizens_in_bulk
+from ..forum import author_snapshot
+from .. import views
+from ..services import RekognitionFaceDetector, LocalFaceDetector, UploadedPhoto, validate_uploaded_photo, background_uniformity
+
+'''
+In this file, benchmarks for the hot paths of the API are defined. Each benchmark seeds its own data
+inside a transaction that is rolled back at the end, so they can be run against any database
+with the run_benchmarks management command. A benchmark returns a list of rows for the report table.
+'''
+BENCHMARKS = {}
+
+'''This decorator registers a benchmark under the given name'''
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+'''This function runs a benchmark and rolls back all the data it created'''
+def run_benchmark(name):
+    with transaction.atomic():
+        rows = BENCHMARKS[name]()
+        transaction.set_rollback(True)
+    return rows
+
+'''This function calls a function several times and returns the best wall time in ms and the number of queries of one call'''
+def measure(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return min(timings), len(queries)
+
+'''This function formats the rows returned by a benchmark into a plain text table'''
+def format_table(rows):
+    if not rows:
+        return ''
+    headers = list(rows[0].keys())
+    cells = [[str(row[header]) for header in headers] for row in rows]
+    widths = [max(len(header), *(len(cell[i]) for cell in cells)) for i, header in enumerate(headers)]
+    lines = ['  '.join(header.ljust(width) for header, width in zip(headers, widths))]
+    lines.append('  '.join('-' * width for width in widths))
+    for cell in cells:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(cell, widths)))
+    return '\n'.join(lines)
+
+'''This function calls an API view as the given user, the same way the test client does but without the URL routing'''
+def call_view(view, user, path='/', **kwargs):
+    request = APIRequestFactory().get(path)
+    force_authenticate(request, user=user)
+    return view(request, **kwargs)
+
+'''
+This benchmark shows that listing a page of posts and a page of comments costs the same whether
+the page was written by one citizen or by a different citizen on every row.
+'''
+@benchmark('forum_listing')
+def forum_listing_benchmark(page_size=100):
+    rows = []
+    for distinct_authors in [1, 10, 100]:
+        authors = create_citizens_in_bulk(distinct_authors)
+        forum = Forums.objects.create(title='benchmark', region='nation')
+        posts = Posts.objects.bulk_create([
+            Posts(forum=forum, author=authors[i % distinct_authors], title=f'post {i}', content='benchmark', **author_snapshot(authors[i % distinct_authors]))
+            for i in range(page_size)
+        ])
+        Comments.objects.bulk_create([
+            Comments(post=posts[0], author=authors[i % distinct_authors], content='benchmark', **author_snapshot(authors[i % distinct_authors]))
+            for i in range(page_size)
+        ])
+        user = authors[0].user
+        for endpoint, view, kwargs in [('get_posts', views.get_posts, {'forum_id': forum.id}), ('get_comments', views.get_comments, {'post_id': posts[0].id})]:
+            ms, queries = measure(lambda: call_view(view, user, **kwargs))
+            rows.append({'endpoint': endpoint, 'rows': page_size, 'distinct authors': distinct_authors, 'queries': queries, 'ms': f'{ms:.1f}'})
+    return rows
+
+'''This function returns the bytes of a JPEG photo of a dark oval centered on a white background'''
+def sample_photo(size=800, height=None):
+    width, height = size, height or size
+    img = Image.new('RGB', (width, height), 'white')
+    ImageDraw.Draw(img).ellipse([width * 0.3, height * 0.25, width * 0.7, height * 0.75], fill=(90, 70, 60))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+'''
+This benchmark compares the cost of a face detection with a new Rekognition client per call, like the validation
+used to do, with the shared client of RekognitionFaceDetector and with the local detector. The Rekognition calls
+are answered by botocore's Stubber, so the timings are the client's own overhead without the network, and the TLS
+handshakes the shared client saves come on top of the difference.
+'''
+@benchmark('face_detection')
+def face_detection_benchmark(calls=20):
+    image = sample_photo()
+    response = {'FaceDetails': LocalFaceDetector().detect_faces(image)}
+
+    def stubbed(detector, responses):
+        stubber = Stubber(detector.client)
+        for _ in range(responses):
+            stubber.add_response('detect_faces', response)
+        stubber.activate()
+        return detector
+
+    def new_client_per_call():
+        for _ in range(calls):
+            stubbed(RekognitionFaceDetector(access_key='benchmark', secret_key='benchmark'), 1).detect_faces(image)
+
+    # the shared client answers the calls of every repeat
+    shared = stubbed(RekognitionFaceDetector(access_key='benchmark', secret_key='benchmark'), calls * 3)
+    def shared_client():
+        for _ in range(calls):
+            shared.detect_faces(image)
+
+    local = LocalFaceDetector()
+    def local_detector():
+        for _ in range(calls):
+            local.detect_faces(image)
+
+    rows = []
+    for detector, func in [('rekognition, new client per call', new_client_per_call), ('rekognition, shared client', shared_client), ('local', local_detector)]:
+        ms, queries = measure(func, repeat=3)
+        rows.append({'detector': detector, 'calls': calls, 'ms per call': f'{ms / calls:.2f}'})
+    return rows
+
+'''
+This benchmark compares the photo validation at the original resolution, the way it decoded the photos before,
+with the validation that decodes them once at a bounded resolution. The peak is the memory traced by Python and
+numpy during a validation, the decoded pixels are the size of the image the checks read, which is also what
+Pillow holds while decoding, and the payload is what the face detector receives. The full resolution pipeline
+only decodes and detects, the bounded one also runs the resolution and background checks.
+'''
+@benchmark('photo_validation_memory')
+def photo_validation_memory_benchmark():
+    detector = LocalFaceDetector()
+
+    # decode the whole file to a numpy array and send the original file to the detector
+    def full_resolution(data):
+        np.array(Image.open(io.BytesIO(data)))
+        detector.detect_faces(data)
+
+    def bounded_resolution(data):
+        validate_uploaded_photo(io.BytesIO(data), detector)
+
+    rows = []
+    for width, height in [(4000, 3000), (1600, 1200)]:
+        data = sample_photo(width, height)
+        photo = UploadedPhoto(io.BytesIO(data), detector)
+        sizes = {full_resolution: (width * height * 3, len(data)), bounded_resolution: (photo.decoded.width * photo.decoded.height * 3, len(photo.payload))}
+        for pipeline, func in [('full resolution', full_resolution), ('decoded once, bounded', bounded_resolution)]:
+            ms = measure(lambda: func(data), repeat=3)[0]
+            tracemalloc.start()
+            func(data)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            decoded, payload = sizes[func]
+            rows.append({
+                'photo': f'{width}x{height}', 'pipeline': pipeline, 'ms': f'{ms:.1f}', 'peak MB': f'{peak / 2**20:.1f}',
+                'decoded pixels MB': f'{decoded / 2**20:.1f}', 'payload KB': f'{payload / 1024:.0f}',
+            })
+    return rows
+
+'''
+This benchmark compares the background check that copied the whole image into an array to look at four patches,
+the way it was done before, with the score of the same patches cropped before they are converted, on decoded images
+of increasing size.
+'''
+@benchmark('background_check')
+def background_check_benchmark():
+    # the whole image as an array, then the two top corners and the middle of both sides, one by one
+    def corner_patches(image, margin=50, white_threshold=180):
+        img_array = np.array(image)
+        middle = img_array.shape[0] // 2
+        corners = [
+            img_array[:margin, :margin], img_array[:margin, -margin:],
+            img_array[middle - margin // 2:middle + margin // 2, :margin], img_array[middle - margin // 2:middle + margin // 2, -margin:],
+        ]
+        return all(not np.any(corner < white_threshold) for corner in corners)
+
+    rows = []
+    for width, height in [(1024, 768), (4000, 3000), (8000, 6000)]:
+        image = Image.open(io.BytesIO(sample_photo(width, height)))
+        image.load()
+        for check, func in [('corner patches', corner_patches), ('cropped patches', lambda image: background_uniformity(image, 50))]:
+            ms = measure(lambda: func(image), repeat=5)[0]
+            tracemalloc.start()
+            func(image)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append({'image': f'{width}x{height}', 'check': check, 'ms': f'{ms:.2f}', 'peak KB': f'{peak / 1024:.0f}'})
+    return rows
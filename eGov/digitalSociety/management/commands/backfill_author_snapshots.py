@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from digitalSociety.forum import refresh_author_snapshots
+
+'''This command copies the authors' usernames and pictures to all their posts and comments again'''
+class Command(BaseCommand):
+    help = "Copy the authors' usernames and pictures to their posts and comments in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="The number of rows updated by each query.")
+
+    def handle(self, *args, **options):
+        for model, updated in refresh_author_snapshots(batch_size=options['batch_size']).items():
+            self.stdout.write(f"{model}: {updated} updated")
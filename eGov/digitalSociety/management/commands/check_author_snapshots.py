@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from digitalSociety.forum import author_snapshot_fields, stale_author_snapshots
+from digitalSociety.models import Posts, Comments
+
+'''This command finds the posts and comments whose author snapshot doesn't match their author, and fixes them with --fix'''
+class Command(BaseCommand):
+    help = "Check that the authors' usernames and pictures copied to the posts and comments are up to date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Copy the current usernames and pictures to the stale rows.")
+
+    def handle(self, *args, **options):
+        stale = 0
+        for model in (Posts, Comments):
+            count = stale_author_snapshots(model).count()
+            stale += count
+            self.stdout.write(f"{model.__name__}: {count} stale")
+            if options['fix'] and count:
+                model.objects.filter(pk__in=stale_author_snapshots(model).values('pk')).update(**author_snapshot_fields())
+        if stale and not options['fix']:
+            raise CommandError("Some author snapshots are stale, run the command with --fix to refresh them.")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from digitalSociety.forum import purge_deleted_posts
+
+'''This command purges the soft deleted posts whose background purge didn't run, like after a restart'''
+class Command(BaseCommand):
+    help = "Delete the rows of the soft deleted posts with their comments and likes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help="The number of rows deleted by each statement.")
+
+    def handle(self, *args, **options):
+        purged = purge_deleted_posts(options['chunk_size'])
+        self.stdout.write(f"{purged} posts purged")
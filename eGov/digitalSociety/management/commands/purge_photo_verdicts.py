@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from digitalSociety.services import photo_verdicts
+
+'''This command deletes the expired verdicts of the photo validation and the oldest ones above PHOTO_VERDICT_MAX_ROWS'''
+class Command(BaseCommand):
+    help = "Delete the expired and the oldest cached verdicts of the photo validation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-rows', type=int, default=None, help="The number of verdicts to keep, PHOTO_VERDICT_MAX_ROWS by default.")
+
+    def handle(self, *args, **options):
+        deleted = photo_verdicts.purge(options['max_rows'])
+        self.stdout.write(f"{deleted} verdicts deleted")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from digitalSociety.search import get_search_backend
+
+'''This command indexes all the posts and comments again, for the backfills and when the index was changed by hand'''
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of the forum posts and comments."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError("The database has no full text search backend.")
+        indexed = backend.rebuild()
+        self.stdout.write(f"{indexed['posts']} posts and {indexed['comments']} comments indexed")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from digitalSociety.forum import reconcile_counters
+
+'''This command fixes the denormalized counters that drifted from the rows they count'''
+class Command(BaseCommand):
+    help = "Set the counters, like the likes counts, back to the number of rows they count."
+
+    def handle(self, *args, **options):
+        for counter, fixed in reconcile_counters().items():
+            self.stdout.write(f"{counter}: {fixed} fixed")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from digitalSociety.forum import refresh_hot_scores
+
+'''This command computes the hot scores of all the posts again, it is meant to be run periodically'''
+class Command(BaseCommand):
+    help = "Compute the hot scores of the forum posts again in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="The number of posts updated by each query.")
+
+    def handle(self, *args, **options):
+        updated = refresh_hot_scores(batch_size=options['batch_size'])
+        self.stdout.write(f"{updated} posts updated")
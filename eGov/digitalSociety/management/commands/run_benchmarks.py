@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from digitalSociety.management.benchmarks import BENCHMARKS, run_benchmark, format_table
+from digitalSociety.management import querybudgets # registers the query budgets benchmark
+
+'''This command runs the benchmarks defined in benchmarks.py and prints a table for each of them'''
+class Command(BaseCommand):
+    help = "Run the API benchmarks. The data they create is rolled back when they finish."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="The benchmarks to run, all of them are run if none are given.")
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError(f"Unknown benchmark '{name}'. Available benchmarks: {', '.join(BENCHMARKS)}")
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(format_table(run_benchmark(name)) + '\n')
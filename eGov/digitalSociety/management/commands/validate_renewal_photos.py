@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from digitalSociety.models import RenewalRequests
+from digitalSociety.services import validate_renewal_request
+
+'''This command validates the photos of the renewal requests still Validating, whose background validation didn't run, like after a restart'''
+class Command(BaseCommand):
+    help = "Validate the photos of the renewal requests that are still being validated."
+
+    def handle(self, *args, **options):
+        request_ids = list(RenewalRequests.objects.filter(status='Validating').values_list('pk', flat=True))
+        for request_id in request_ids:
+            validate_renewal_request(request_id)
+        self.stdout.write(f"{len(request_ids)} requests validated")
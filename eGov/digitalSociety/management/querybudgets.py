@@ -0,0 +1,397 @@
+import io
+import re
+import shutil
+import tempfile
+import time
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from ..models import *
+from ..modelFactory import *
+from ..authentication import ClaimsTokenObtainPairSerializer
+from ..cache import user_groups_cache
+from ..services import photo_verdicts
+from .benchmarks import benchmark, sample_photo
+from ..forum import author_snapshot
+
+'''
+In this file, the query budget of every API endpoint is defined. Each budget seeds the data of one endpoint
+with the factories at a given size, the size being the number of rows the endpoint could have to go through,
+and sets the most queries the endpoint may run. A budget that holds at every size means the number of queries
+doesn't grow with the data. The budgets are checked by QueryBudgetTest and reported by the run_benchmarks command.
+'''
+QUERY_BUDGETS = {}
+
+# the endpoints that aren't measured, mapped to the reason
+EXCLUDED_ENDPOINTS = {
+    'index': "renders the frontend's template and doesn't query the database",
+}
+
+# the sizes every endpoint is measured at
+BUDGET_SIZES = (1, 10, 50)
+
+# the statements of the nested transactions, which aren't counted
+SAVEPOINT_STATEMENT = re.compile(r'(RELEASE |ROLLBACK TO )?SAVEPOINT ')
+
+'''This decorator registers the seed function of an endpoint under its URL name with its query budget'''
+def query_budget(name, queries, method='get'):
+    def decorator(seed):
+        QUERY_BUDGETS[name] = {'seed': seed, 'queries': queries, 'method': method}
+        return seed
+    return decorator
+
+'''
+This function seeds an endpoint, calls it once through the URL with a JWT token like the frontend does and
+returns a row with the number of queries and the wall time of the call. The group cache and the photo verdicts
+are cleared before the call so the number of queries is the one of a cold cache, the uploaded files are written to
+a temporary folder and the photos are validated by the local face detector, without the network.
+'''
+def run_query_budget(name, size):
+    budget = QUERY_BUDGETS[name]
+    media_root = tempfile.mkdtemp()
+    try:
+        # the test client's host is only allowed by the test runner, so allow it when running the benchmark
+        with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], FACE_DETECTOR='local'):
+            call = budget['seed'](size)
+            client = APIClient()
+            if call.get('user') is not None:
+                token = ClaimsTokenObtainPairSerializer.get_token(call['user']).access_token
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            url = reverse(name, kwargs=call.get('kwargs'))
+            request = getattr(client, budget['method'])
+            user_groups_cache.clear()
+            photo_verdicts.clear()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = request(url, call.get('data'), format=call.get('format'))
+                ms = (time.perf_counter() - start) * 1000
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    # the savepoints are left out, they are only there because the call runs in the transaction that is rolled back
+    statements = [query for query in queries.captured_queries if not SAVEPOINT_STATEMENT.match(query['sql'])]
+    return {'endpoint': name, 'size': size, 'status': response.status_code, 'queries': len(statements), 'budget': budget['queries'], 'ms': f'{ms:.1f}'}
+
+'''This benchmark reports the queries and the wall time of every endpoint at every size, each seeded from scratch and rolled back'''
+@benchmark('query_budgets')
+def query_budgets_benchmark():
+    rows = []
+    for name in QUERY_BUDGETS:
+        for size in BUDGET_SIZES:
+            with transaction.atomic():
+                rows.append(run_query_budget(name, size))
+                transaction.set_rollback(True)
+    return rows
+
+# the helpers used by the seed functions
+
+'''This function creates a user with a citizen profile in the given groups'''
+def budget_citizen(*groups):
+    citizen = CitizensFactory()
+    for group in groups:
+        citizen.user.groups.add(Group.objects.get_or_create(name=group)[0])
+    return citizen
+
+'''This function creates an uploaded image that the image fields accept'''
+def budget_image(name='picture.png'):
+    content = io.BytesIO()
+    Image.new('RGB', (10, 10), 'white').save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+def budget_document(name='proof.pdf'):
+    return SimpleUploadedFile(name, b'proof', content_type='application/pdf')
+
+'''This function creates a forum with a post and a comment, both liked by the given number of citizens'''
+def budget_thread(size):
+    likers = create_citizens_in_bulk(size)
+    forum = Forums.objects.create(title='budget', region='nation')
+    post = Posts.objects.create(forum=forum, author=likers[0], title='budget', content='budget', likes_count=size)
+    post.likes.add(*likers)
+    comment = Comments.objects.create(post=post, author=likers[0], content='budget', likes_count=size)
+    comment.likes.add(*likers)
+    return forum, post, comment
+
+# the citizens' documents and validation
+
+@query_budget('citizen_info_validation', queries=3, method='post')
+def seed_citizen_info_validation(size):
+    create_citizens_in_bulk(size)
+    citizen = budget_citizen('Citizens')
+    data = {field: str(getattr(citizen, field)) for field in ['national_id', 'first_name', 'last_name', 'date_of_birth', 'sex', 'blood_type']}
+    return {'user': citizen.user, 'data': data}
+
+@query_budget('address_info_validation', queries=4, method='post')
+def seed_address_info_validation(size):
+    citizen = budget_citizen('Citizens')
+    addresses = [AddressesFactory(citizen=citizen, country='Country', city=f'City {i}', street='Street', state='Active') for i in range(size)]
+    data = {field: getattr(addresses[-1], field) for field in ['country', 'city', 'street', 'building_number', 'floor_number', 'apartment_number']}
+    return {'user': citizen.user, 'data': data}
+
+@query_budget('register_address', queries=9, method='post')
+def seed_register_address(size):
+    citizen = budget_citizen('Citizens')
+    for i in range(size):
+        AddressesFactory(citizen=citizen, country='Country', city=f'City {i}', street='Street', state='Active')
+    data = {'country': 'Country', 'city': 'New City', 'street': 'Street', 'building_number': 1, 'floor_number': 1, 'apartment_number': 1, 'proof_document': budget_document()}
+    return {'user': citizen.user, 'data': data, 'format': 'multipart'}
+
+@query_budget('register_property', queries=9, method='post')
+def seed_register_property(size):
+    citizen = budget_citizen('Citizens')
+    for i in range(size):
+        PropertiesFactory(citizen=citizen, property_id=f'P{i}', picture='picture.png', is_under_transfer=False)
+    data = {
+        'property_id': f'NEW{size}', 'location': 'Location', 'property_type': 'Land', 'description': 'budget', 'size': '100',
+        'picture': budget_image(), 'previous_owner_id': 'X', 'proof_document': budget_document(),
+    }
+    return {'user': citizen.user, 'data': data, 'format': 'multipart'}
+
+@query_budget('register_vehicle', queries=9, method='post')
+def seed_register_vehicle(size):
+    citizen = budget_citizen('Citizens')
+    for i in range(size):
+        VehiclesFactory(citizen=citizen, picture='picture.png', is_under_transfer=False)
+    data = {
+        'serial_number': size, 'model': 'Model', 'manufacturer': 'Manufacturer', 'year': 2020, 'vehicle_type': 'Van',
+        'picture': budget_image(), 'plate_number': f'PLATE{size}', 'proof_document': budget_document(), 'previous_owner_id': 'X',
+    }
+    return {'user': citizen.user, 'data': data, 'format': 'multipart'}
+
+'''This function creates a photo that passes the validation'''
+def budget_photo():
+    return SimpleUploadedFile('photo.jpg', sample_photo(), content_type='image/jpeg')
+
+'''This function creates a citizen with the given number of reviewed renewal requests of the type'''
+def budget_renewal_citizen(request_type, size):
+    citizen = budget_citizen('Citizens')
+    for _ in range(size):
+        RenewalRequestsFactory(citizen=citizen, request_type=request_type, status='Approved', picture='picture.png', proof_document='proof.pdf')
+    return citizen
+
+@query_budget('passport_info_validation', queries=12, method='post')
+def seed_passport_info_validation(size):
+    citizen = budget_renewal_citizen('Passport', size)
+    passport = PassportsFactory(citizen=citizen, passport_number=f'P{size:07d}', picture='picture.png', issue_date='2015-01-01', expiry_date='2025-01-01')
+    data = {'passport_number': passport.passport_number, 'issue_date': '2015-01-01', 'expiry_date': '2025-01-01', 'picture': budget_photo()}
+    return {'user': citizen.user, 'data': data, 'format': 'multipart'}
+
+@query_budget('license_info_validation', queries=13, method='post')
+def seed_license_info_validation(size):
+    citizen = budget_renewal_citizen("Driver's License", size)
+    license = DrivingLicensesFactory(citizen=citizen, nationality='Egyptian', emergency_contact='01012345678', picture='picture.png', issue_date='2015-01-01', expiry_date='2025-01-01')
+    data = {
+        'license_number': license.license_number, 'issue_date': '2015-01-01', 'expiry_date': '2025-01-01', 'nationality': license.nationality,
+        'license_class': license.license_class, 'emergency_contact': license.emergency_contact, 'picture': budget_photo(),
+    }
+    return {'user': citizen.user, 'data': data, 'format': 'multipart'}
+
+@query_budget('user_documents', queries=3)
+def seed_user_documents(size):
+    citizen = budget_citizen('Citizens')
+    PassportsFactory(citizen=citizen, picture='picture.png')
+    DrivingLicensesFactory(citizen=citizen, picture='picture.png')
+    for i in range(size):
+        AddressesFactory(citizen=citizen, country='Country', city=f'City {i}', street='Street')
+        PropertiesFactory(citizen=citizen, picture='picture.png')
+        VehiclesFactory(citizen=citizen, picture='picture.png')
+    return {'user': citizen.user}
+
+# the inspectors' requests
+
+'''This function creates pending renewal requests of citizens that have a passport and a driver's license'''
+def budget_renewal_requests(size):
+    requests = []
+    for citizen in create_citizens_in_bulk(size):
+        PassportsFactory(citizen=citizen, picture='picture.png')
+        DrivingLicensesFactory(citizen=citizen, picture='picture.png')
+        requests.append(RenewalRequestsFactory(citizen=citizen, request_type='Passport', status='Pending', picture='picture.png', proof_document='proof.pdf'))
+    return requests
+
+'''This function creates pending registration requests of every type with their placeholder documents'''
+def budget_registration_requests(size):
+    requests = []
+    for i, citizen in enumerate(create_citizens_in_bulk(size)):
+        request_type = RegistrationRequests.REQUEST_TYPES[i % 3][0]
+        if request_type == 'Address Registration':
+            AddressesFactory(citizen=citizen, country='Country', city='City', street='Street', state='Pending Request')
+        elif request_type == 'Property Registration':
+            PropertiesFactory(citizen=citizen, picture='picture.png', is_under_transfer=True)
+        else:
+            VehiclesFactory(citizen=citizen, picture='picture.png', is_under_transfer=True)
+        requests.append(RegistrationRequestsFactory(citizen=citizen, request_type=request_type, status='Pending', proof_document='proof.pdf'))
+    return requests
+
+@query_budget('renewal_requests', queries=4)
+def seed_renewal_requests(size):
+    budget_renewal_requests(size)
+    return {'user': budget_citizen('Inspectors').user}
+
+@query_budget('accept_renewal_request', queries=9, method='post')
+def seed_accept_renewal_request(size):
+    requests = budget_renewal_requests(size)
+    return {'user': budget_citizen('Inspectors').user, 'kwargs': {'id': requests[-1].id}}
+
+@query_budget('reject_renewal_request', queries=7, method='post')
+def seed_reject_renewal_request(size):
+    requests = budget_renewal_requests(size)
+    return {'user': budget_citizen('Inspectors').user, 'kwargs': {'id': requests[-1].id}, 'data': {'rejectionReason': 'budget'}}
+
+@query_budget('registration_requests', queries=5)
+def seed_registration_requests(size):
+    budget_registration_requests(size)
+    return {'user': budget_citizen('Inspectors').user}
+
+@query_budget('accept_registration_request', queries=9, method='post')
+def seed_accept_registration_request(size):
+    requests = budget_registration_requests(size)
+    return {'user': budget_citizen('Inspectors').user, 'kwargs': {'id': requests[0].id}}
+
+@query_budget('reject_registration_request', queries=9, method='post')
+def seed_reject_registration_request(size):
+    requests = budget_registration_requests(size)
+    return {'user': budget_citizen('Inspectors').user, 'kwargs': {'id': requests[0].id}, 'data': {'rejectionReason': 'budget'}}
+
+# the authentication and the user's account
+
+@query_budget('token_obtain_pair', queries=3, method='post')
+def seed_token_obtain_pair(size):
+    create_citizens_in_bulk(size)
+    citizen = budget_citizen(*[f'Group {i}' for i in range(size)])
+    return {'data': {'username': citizen.user.username, 'password': 'password'}}
+
+@query_budget('token_refresh', queries=3, method='post')
+def seed_token_refresh(size):
+    citizen = budget_citizen(*[f'Group {i}' for i in range(size)])
+    return {'data': {'refresh': str(ClaimsTokenObtainPairSerializer.get_token(citizen.user))}}
+
+@query_budget('user_profile', queries=6, method='post')
+def seed_user_profile(size):
+    create_citizens_in_bulk(size)
+    citizen = budget_citizen('Citizens')
+    return {'user': citizen.user, 'data': {'username': 'budget_renamed'}}
+
+@query_budget('change_password', queries=5, method='post')
+def seed_change_password(size):
+    citizen = budget_citizen(*[f'Group {i}' for i in range(size)])
+    return {'user': citizen.user, 'data': {'current_password': 'password', 'new_password': 'new password'}}
+
+@query_budget('user_groups', queries=0)
+def seed_user_groups(size):
+    return {'user': budget_citizen(*[f'Group {i}' for i in range(size)]).user}
+
+@query_budget('get_user', queries=0)
+def seed_get_user(size):
+    return {'user': budget_citizen('Citizens').user}
+
+# the notifications
+
+'''This function creates a citizen with the given number of notifications'''
+def budget_notifications(size):
+    citizen = budget_citizen('Citizens')
+    Notifications.objects.bulk_create([Notifications(citizen=citizen, message=f'notification {i}') for i in range(size)])
+    # bulk_create doesn't send the signal that counts the unread notifications
+    Citizens.objects.filter(pk=citizen.pk).update(unread_notifications_count=F('unread_notifications_count') + size)
+    return citizen
+
+@query_budget('get_notifications', queries=2)
+def seed_get_notifications(size):
+    return {'user': budget_notifications(size).user}
+
+@query_budget('notifications_inbox', queries=1)
+def seed_notifications_inbox(size):
+    return {'user': budget_notifications(size).user}
+
+@query_budget('unread_notifications_count', queries=1)
+def seed_unread_notifications_count(size):
+    return {'user': budget_notifications(size).user}
+
+@query_budget('mark_notifications_read', queries=5, method='post')
+def seed_mark_notifications_read(size):
+    return {'user': budget_notifications(size).user, 'format': 'json'}
+
+# the forums
+
+@query_budget('create_forum', queries=3, method='post')
+def seed_create_forum(size):
+    create_citizens_in_bulk(size)
+    return {'user': budget_citizen('Reps').user, 'data': {'title': 'budget', 'region': 'nation'}}
+
+@query_budget('get_forums', queries=1)
+def seed_get_forums(size):
+    citizen = budget_citizen('Citizens')
+    AddressesFactory(citizen=citizen, country='Country', city='City', street='Street')
+    Forums.objects.bulk_create([Forums(title=f'forum {i}', region='City' if i % 2 else 'nation') for i in range(size)])
+    return {'user': citizen.user}
+
+@query_budget('get_forum', queries=2)
+def seed_get_forum(size):
+    forum = Forums.objects.create(title='budget', region='nation')
+    forum.members.add(*create_citizens_in_bulk(size))
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'id': forum.id}}
+
+@query_budget('create_post', queries=6, method='post')
+def seed_create_post(size):
+    forum, post, comment = budget_thread(size)
+    return {'user': budget_citizen('Citizens').user, 'data': {'title': 'budget', 'content': 'budget', 'forum_id': forum.id}}
+
+@query_budget('get_posts', queries=4)
+def seed_get_posts(size):
+    authors = create_citizens_in_bulk(size)
+    forum = Forums.objects.create(title='budget', region='nation')
+    posts = Posts.objects.bulk_create([Posts(forum=forum, author=author, title='budget', content='budget', **author_snapshot(author)) for author in authors])
+    for post in posts:
+        post.likes.add(*authors[:3])
+    return {'user': authors[0].user, 'kwargs': {'forum_id': forum.id}}
+
+@query_budget('get_post', queries=3)
+def seed_get_post(size):
+    forum, post, comment = budget_thread(size)
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'id': post.id}}
+
+@query_budget('create_comment', queries=7, method='post')
+def seed_create_comment(size):
+    forum, post, comment = budget_thread(size)
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'post_id': post.id}, 'data': {'content': 'budget'}}
+
+@query_budget('get_comments', queries=4)
+def seed_get_comments(size):
+    authors = create_citizens_in_bulk(size)
+    forum, post, comment = budget_thread(1)
+    comments = Comments.objects.bulk_create([Comments(post=post, author=author, content='budget', **author_snapshot(author)) for author in authors])
+    for comment in comments:
+        comment.likes.add(*authors[:3])
+    return {'user': authors[0].user, 'kwargs': {'post_id': post.id}}
+
+@query_budget('update_post_likes', queries=8, method='post')
+def seed_update_post_likes(size):
+    forum, post, comment = budget_thread(size)
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'post_id': post.id}}
+
+@query_budget('update_comment_likes', queries=7, method='post')
+def seed_update_comment_likes(size):
+    forum, post, comment = budget_thread(size)
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'comment_id': comment.id}}
+
+@query_budget('search', queries=1)
+def seed_search(size):
+    forum, post, comment = budget_thread(1)
+    authors = create_citizens_in_bulk(size)
+    for author in authors:
+        Posts.objects.create(forum=forum, author=author, title='budget search', content='budget')
+    return {'user': authors[0].user, 'kwargs': {}, 'data': {'q': 'budget', 'forum_id': forum.id}}
+
+@query_budget('delete_comment', queries=7, method='post')
+def seed_delete_comment(size):
+    forum, post, comment = budget_thread(size)
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'id': comment.id}}
+
+@query_budget('delete_post', queries=13, method='post')
+def seed_delete_post(size):
+    forum, post, comment = budget_thread(size)
+    Comments.objects.bulk_create([Comments(post=post, author=comment.author, content='budget') for _ in range(size)])
+    return {'user': budget_citizen('Citizens').user, 'kwargs': {'id': post.id}}
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0017_alter_comments_options_alter_posts_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='posts',
+            index=models.Index(fields=['forum', '-likes_count', '-timestamp', '-id'], name='posts_forum_likes_time_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0018_posts_forum_likes_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comments',
+            index=models.Index(fields=['post', '-likes_count', 'timestamp', 'id'], name='comments_post_likes_time_idx'),
+        ),
+    ]
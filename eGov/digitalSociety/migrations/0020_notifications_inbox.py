@@ -0,0 +1,44 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+# the existing notifications are all unread, so the counter starts at the number of notifications of each citizen
+def set_unread_notifications_count(apps, schema_editor):
+    Citizens = apps.get_model('digitalSociety', 'Citizens')
+    Notifications = apps.get_model('digitalSociety', 'Notifications')
+    unread = Notifications.objects.filter(citizen=OuterRef('pk'), is_read=False).order_by().values('citizen').annotate(total=Count('id')).values('total')
+    Citizens.objects.update(unread_notifications_count=Coalesce(Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0019_comments_post_likes_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='citizens',
+            name='unread_notifications_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notifications',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='notifications',
+            name='is_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='notifications',
+            index=models.Index(fields=['citizen', '-created_at', '-id'], name='notifications_inbox_idx'),
+        ),
+        migrations.RunPython(set_unread_notifications_count, migrations.RunPython.noop),
+    ]
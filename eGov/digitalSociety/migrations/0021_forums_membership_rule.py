@@ -0,0 +1,23 @@
+# Generated by Django 4.2.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0020_notifications_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forums',
+            name='membership_rule',
+            field=models.CharField(choices=[('region', 'Region'), ('explicit', 'Explicit')], default='region', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='addresses',
+            index=models.Index(django.db.models.functions.text.Lower('city'), name='addresses_city_lower_idx'),
+        ),
+    ]
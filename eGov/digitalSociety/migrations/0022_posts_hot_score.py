@@ -0,0 +1,46 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:00
+
+import math
+from datetime import datetime, timezone
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# the HOT_SCORE_DECAY setting when this migration was written, copied so the backfill doesn't change with the setting
+HOT_SCORE_DECAY = 45000
+
+
+# the same score as forum.hot_score, computed here from the historical models
+def set_hot_scores(apps, schema_editor):
+    Posts = apps.get_model('digitalSociety', 'Posts')
+    epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    posts = Posts.objects.annotate(comments_total=Count('comments')).only('id', 'timestamp', 'likes_count')
+    batch = []
+    for post in posts.iterator(chunk_size=1000):
+        engagement = max(post.likes_count + post.comments_total, 0)
+        post.hot_score = math.log10(engagement + 1) + (post.timestamp - epoch).total_seconds() / HOT_SCORE_DECAY
+        batch.append(post)
+        if len(batch) == 1000:
+            Posts.objects.bulk_update(batch, ['hot_score'])
+            batch = []
+    Posts.objects.bulk_update(batch, ['hot_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0021_forums_membership_rule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='posts',
+            index=models.Index(fields=['forum', '-hot_score', '-id'], name='posts_forum_hot_idx'),
+        ),
+        migrations.RunPython(set_hot_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:00
+
+from django.db import migrations
+
+
+# the statements that create the index on each database that has a full text search, copied from search.py when
+# this migration was written so the migration doesn't change with it
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE {table} USING fts5(kind UNINDEXED, object_id UNINDEXED, post_id UNINDEXED, forum_id UNINDEXED, title, content, tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        "CREATE TABLE {table} (kind varchar(7) NOT NULL, object_id bigint NOT NULL, post_id bigint NOT NULL, forum_id bigint NOT NULL, "
+        "title text NOT NULL, content text NOT NULL, document tsvector NOT NULL, PRIMARY KEY (kind, object_id))",
+        "CREATE INDEX digitalsociety_search_document_idx ON {table} USING GIN (document)",
+        "CREATE INDEX digitalsociety_search_post_idx ON {table} (post_id)",
+    ],
+}
+
+INSERT_SQL = {
+    'sqlite': "INSERT INTO {table} (kind, object_id, post_id, forum_id, title, content) {select}",
+    'postgresql': (
+        "INSERT INTO {table} (kind, object_id, post_id, forum_id, title, content, document) "
+        "SELECT kind, object_id, post_id, forum_id, title, content, "
+        "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', content), 'B') "
+        "FROM ({select}) AS entries (kind, object_id, post_id, forum_id, title, content)"
+    ),
+}
+
+# the posts and the comments with the forum of their post
+BACKFILL_SELECTS = [
+    "SELECT 'post', id, id, forum_id, title, content FROM {posts}",
+    "SELECT 'comment', c.id, p.id, p.forum_id, '', c.content FROM {comments} c JOIN {posts} p ON p.id = c.post_id",
+]
+
+
+def quoted_tables(schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    return {'table': quote('digitalSociety_search'), 'posts': quote('digitalSociety_posts'), 'comments': quote('digitalSociety_comments')}
+
+
+# the index is created and filled with the posts and comments on the databases that have a full text search
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    tables = quoted_tables(schema_editor)
+    for statement in CREATE_SQL[vendor]:
+        schema_editor.execute(statement.format(**tables))
+    with schema_editor.connection.cursor() as cursor:
+        for select in BACKFILL_SELECTS:
+            cursor.execute(INSERT_SQL[vendor].format(table=tables['table'], select=select.format(**tables)))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute("DROP TABLE IF EXISTS {table}".format(**quoted_tables(schema_editor)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0022_posts_hot_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
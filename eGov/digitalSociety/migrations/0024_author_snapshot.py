@@ -0,0 +1,47 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+# copy the current username and picture of each author to their posts and comments
+def set_author_snapshots(apps, schema_editor):
+    Citizens = apps.get_model('digitalSociety', 'Citizens')
+    authors = Citizens.objects.filter(pk=OuterRef('author_id'))
+    for model_name in ['Posts', 'Comments']:
+        model = apps.get_model('digitalSociety', model_name)
+        model.objects.update(
+            author_username=Subquery(authors.values('user__username')[:1]),
+            author_picture=Subquery(authors.values('picture')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0023_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='author_username',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddField(
+            model_name='posts',
+            name='author_picture',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='comments',
+            name='author_username',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddField(
+            model_name='comments',
+            name='author_picture',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(set_author_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.13 on 2026-10-18 17:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# the counters start at the number of comments of each post and posts of each forum
+def set_counts(apps, schema_editor):
+    Forums = apps.get_model('digitalSociety', 'Forums')
+    Posts = apps.get_model('digitalSociety', 'Posts')
+    Comments = apps.get_model('digitalSociety', 'Comments')
+    comments = Comments.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('id')).values('total')
+    Posts.objects.update(comments_count=Coalesce(Subquery(comments), 0))
+    posts = Posts.objects.filter(forum=OuterRef('pk')).order_by().values('forum').annotate(total=Count('id')).values('total')
+    Forums.objects.update(posts_count=Coalesce(Subquery(posts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0024_author_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forums',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='posts',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0025_comments_and_posts_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='is_deleted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
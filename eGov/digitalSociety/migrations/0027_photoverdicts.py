@@ -0,0 +1,32 @@
+# Generated by Django 4.2.13 on 2026-10-18 19:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0026_posts_is_deleted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoVerdicts',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64)),
+                ('detector', models.CharField(max_length=30)),
+                ('is_valid', models.BooleanField()),
+                ('message', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'id'], name='photo_verdicts_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='photoverdicts',
+            constraint=models.UniqueConstraint(fields=('digest', 'detector'), name='photo_verdicts_digest_detector_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0027_photoverdicts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='renewalrequests',
+            name='status',
+            field=models.CharField(choices=[('Validating', 'Validating'), ('Pending', 'Pending'), ('Approved', 'Approved'), ('Rejected', 'Rejected')], default='Pending', max_length=30),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.13 on 2026-10-18 18:00
+
+from django.db import migrations
+
+
+# the databases that have the search index, see 0023_search_index
+VENDORS = ('sqlite', 'postgresql')
+
+
+# the soft deleted posts and their comments leave the index, like a rebuild that skips them would do
+def remove_deleted_posts(apps, schema_editor):
+    if schema_editor.connection.vendor not in VENDORS:
+        return
+    quote = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {table} WHERE post_id IN (SELECT id FROM {posts} WHERE is_deleted)".format(
+            table=quote('digitalSociety_search'), posts=quote('digitalSociety_posts'),
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitalSociety', '0028_alter_renewalrequests_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_deleted_posts, migrations.RunPython.noop),
+    ]
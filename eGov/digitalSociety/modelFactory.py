@@ -1,4 +1,6 @@
 import factory
+import itertools
+from datetime import date
 from django.core.files.base import ContentFile
 from .models import *
 from django.contrib.auth.models import User
@@ -118,4 +120,28 @@ class RegistrationRequestsFactory(factory.django.DjangoModelFactory):
     proof_document = factory.django.FileField()
     previous_owner_id = factory.Faker('ssn')
     status = factory.Faker('random_element', elements=('Pending', 'Approved', 'Rejected'))
-    rejection_reason = factory.Faker('text')
\ No newline at end of file
+    rejection_reason = factory.Faker('text')
+
+'''
+This helper function is used to seed a large number of citizens quickly for the query count tests.
+The users are inserted with bulk_create, so no password hashing is done for each one.
+'''
+bulk_sequence = itertools.count()
+
+def create_citizens_in_bulk(count):
+    # generate a unique suffix for every citizen so that repeated calls don't clash
+    suffixes = [next(bulk_sequence) for _ in range(count)]
+    users = User.objects.bulk_create([User(username=f'bulk_user_{suffix}') for suffix in suffixes])
+    citizens = [
+        Citizens(
+            user=user,
+            national_id=f'BULK{suffix}',
+            first_name='Bulk',
+            last_name=f'Citizen {suffix}',
+            date_of_birth=date(1990, 1, 1),
+            sex='M',
+            blood_type='O+',
+        )
+        for user, suffix in zip(users, suffixes)
+    ]
+    return Citizens.objects.bulk_create(citizens)
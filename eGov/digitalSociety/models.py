@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 def profile_picture_path(instance, filename):
@@ -27,6 +29,8 @@ class Citizens(models.Model):
         ('O-', 'O-'),
     ]
     blood_type = models.CharField(max_length=3, choices=BLOOD_TYPES)
+    # maintained by the notification signals so the unread badge doesn't need to count the notifications
+    unread_notifications_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -42,9 +46,20 @@ class Addresses(models.Model):
     STATE_CHOICES = [('Active', 'Active'), ('Inactive', 'Inactive'), ('Pending Request', 'Pending Request')]
     state = models.CharField(max_length=20, choices=STATE_CHOICES, default='Active')
 
+    class Meta:
+        indexes = [
+            # used to find the citizens of a city without matching the case
+            models.Index(Lower('city'), name='addresses_city_lower_idx'),
+        ]
+
     def __str__(self):
         return self.street + ', ' + self.city + ', ' + self.country
 
+    # the addresses in the city, compared in lower case so the lookup goes through the index
+    @classmethod
+    def in_city(cls, city):
+        return cls.objects.annotate(city_lower=Lower('city')).filter(city_lower=city.lower())
+
 def passport_picture_path(instance, filename):
     return f'passport_pictures/{instance.citizen.national_id}/{filename}'
 
@@ -122,15 +137,42 @@ class Vehicles(models.Model):
 class Notifications(models.Model):
     citizen = models.ForeignKey(Citizens, on_delete=models.CASCADE)
     message = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    is_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # used by the keyset pagination of the citizen's inbox
+            models.Index(fields=['citizen', '-created_at', '-id'], name='notifications_inbox_idx'),
+        ]
 
 class Forums(models.Model):
     title = models.CharField(max_length=30)
     region = models.CharField(max_length=30)
+    # the members of a region forum are the citizens of its region (all of them for 'nation') when they are looked up,
+    # the members of an explicit forum are the ones that were added to it
+    MEMBERSHIP_RULES = [('region', 'Region'), ('explicit', 'Explicit')]
+    membership_rule = models.CharField(max_length=10, choices=MEMBERSHIP_RULES, default='region')
     members = models.ManyToManyField(Citizens, related_name='forums')
+    # the number of posts of the forum, kept up to date by the receivers in signals.py
+    posts_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.title
 
+    # the forum's members, as a query that is evaluated when it is used
+    def member_citizens(self):
+        if self.membership_rule == 'explicit':
+            return self.members.all()
+        if self.region == 'nation':
+            return Citizens.objects.all()
+        return Citizens.objects.filter(pk__in=Addresses.in_city(self.region).values('citizen_id'))
+
+'''This manager hides the posts that were soft deleted and are waiting to be purged'''
+class PostsManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
 class Posts(models.Model):
     forum = models.ForeignKey(Forums, on_delete=models.CASCADE)
     author = models.ForeignKey(Citizens, on_delete=models.CASCADE)
@@ -139,11 +181,30 @@ class Posts(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     likes_count = models.PositiveIntegerField(default=0) 
     likes = models.ManyToManyField(Citizens, related_name='liked_posts', blank=True)
+    # the number of comments of the post, kept up to date by the receivers in signals.py
+    comments_count = models.PositiveIntegerField(default=0)
+    # set when the post is deleted in the background, the post is hidden until its rows are purged (see forum.py)
+    is_deleted = models.BooleanField(default=False)
+    # the ranking of the hot sort, it grows with the likes and comments and newer posts start higher (see forum.py)
+    hot_score = models.FloatField(default=0)
+    # a copy of the author's username and picture so the listings don't join the authors (see forum.py)
+    author_username = models.CharField(max_length=150, blank=True, default='')
+    author_picture = models.CharField(max_length=100, blank=True, default='')
+
+    objects = PostsManager()
+    # all the posts, with the soft deleted ones, used by the admin and the purge
+    all_objects = models.Manager()
 
     # order by most recent or most liked (upvotes)
     class Meta:
         ordering = ['-likes_count', '-timestamp'] 
         # copilot ^_^
+        indexes = [
+            # used by the keyset pagination of a forum's posts
+            models.Index(fields=['forum', '-likes_count', '-timestamp', '-id'], name='posts_forum_likes_time_idx'),
+            # used by the hot sort of a forum's posts
+            models.Index(fields=['forum', '-hot_score', '-id'], name='posts_forum_hot_idx'),
+        ]
 
 class Comments(models.Model):
     post = models.ForeignKey(Posts, on_delete=models.CASCADE, related_name='comments')
@@ -152,10 +213,17 @@ class Comments(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     likes_count = models.PositiveIntegerField(default=0) 
     likes = models.ManyToManyField(Citizens, related_name='liked_comments', blank=True)
+    # a copy of the author's username and picture so the listings don't join the authors (see forum.py)
+    author_username = models.CharField(max_length=150, blank=True, default='')
+    author_picture = models.CharField(max_length=100, blank=True, default='')
 
     # order by most recent or most liked (upvotes)
     class Meta:
         ordering = ['-likes_count', 'timestamp'] 
+        indexes = [
+            # used by the keyset pagination of a post's comments
+            models.Index(fields=['post', '-likes_count', 'timestamp', 'id'], name='comments_post_likes_time_idx'),
+        ]
 
 class RenewalRequests(models.Model):
     citizen = models.ForeignKey(Citizens, on_delete=models.CASCADE)
@@ -164,7 +232,8 @@ class RenewalRequests(models.Model):
     picture = models.ImageField(upload_to=request_picture_path) # this is for the new doc
     reason = models.TextField()
     proof_document = models.FileField(upload_to=proof_document_path)
-    STATUS_CHOICES = [('Pending', 'Pending'), ('Approved', 'Approved'), ('Rejected', 'Rejected')] 
+    # a request is Validating while its photo is validated in the background, then it is Pending or Rejected
+    STATUS_CHOICES = [('Validating', 'Validating'), ('Pending', 'Pending'), ('Approved', 'Approved'), ('Rejected', 'Rejected')] 
     status = models.CharField(max_length=30, choices=STATUS_CHOICES, default="Pending")
     submitted_at = models.DateTimeField(auto_now_add=True)
     reviewed_at = models.DateTimeField(null=True, blank=True)
@@ -185,3 +254,23 @@ class RegistrationRequests(models.Model):
     submitted_at = models.DateTimeField(auto_now_add=True)
     reviewed_at = models.DateTimeField(null=True, blank=True)
     rejection_reason = models.TextField(null=True, blank=True, default="not rejected")
+
+'''
+The verdicts of the photo validation, by the SHA-256 of the photo's bytes and the face detector that checked it,
+so a photo that is submitted again isn't validated again (see services.py)
+'''
+class PhotoVerdicts(models.Model):
+    digest = models.CharField(max_length=64)
+    detector = models.CharField(max_length=30)
+    is_valid = models.BooleanField()
+    message = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['digest', 'detector'], name='photo_verdicts_digest_detector_uniq'),
+        ]
+        indexes = [
+            # used to purge the expired and the oldest verdicts
+            models.Index(fields=['created_at', 'id'], name='photo_verdicts_created_idx'),
+        ]
@@ -0,0 +1,145 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+'''
+This pagination class pages through a queryset with keyset (cursor) pagination. The cursor is an opaque token
+holding the ordering values of the last row that was sent, and the next page continues right after those values
+through the index instead of skipping rows with OFFSET, so every page costs the same as the first one.
+Since the cursor holds values rather than a position, it stays valid while rows are liked, added or deleted.
+'''
+class KeysetPagination(BasePagination):
+    # the ordering must end with a unique field so that every row has a distinct position
+    ordering = ('-id',)
+    page_size = 20
+    max_page_size = 100
+    # the name of the setting that overrides the default page size
+    page_size_setting = None
+    # when False, the full list is sent unless the client asks for a page
+    always_paginate = False
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # only paginate when the client asks for it, so the clients that expect the full list keep working
+        requested = self.cursor_query_param in request.query_params or self.page_size_query_param in request.query_params
+        if not self.always_paginate and not requested:
+            return None
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.get_cursor_filter(self.decode_cursor(cursor)))
+        # fetch one extra row to know if there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        default = getattr(settings, self.page_size_setting, self.page_size) if self.page_size_setting else self.page_size
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, default))
+        except ValueError:
+            return default
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        return Response({'next_cursor': self.get_next_cursor(), 'results': data})
+
+    # the fields used in the ordering, without the direction
+    def get_fields(self):
+        return [self.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+
+    '''
+    Build the condition for the rows that come after the cursor in the ordering.
+    For (a, b, c) that is: a after a0, or a = a0 and b after b0, or a = a0 and b = b0 and c after c0.
+    '''
+    def get_cursor_filter(self, values):
+        condition = Q()
+        equal = Q()
+        for ordering, field, value in zip(self.ordering, self.get_fields(), values):
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field.attname}__{lookup}': value})
+            equal &= Q(**{field.attname: value})
+        return condition
+
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [field.value_to_string(last) for field in self.get_fields()]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            fields = self.get_fields()
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except (ValueError, TypeError, binascii.Error, DjangoValidationError):
+            raise NotFound('Invalid cursor.')
+
+'''This pagination class pages through a forum's posts, most liked first and then most recent first'''
+class PostsPagination(KeysetPagination):
+    ordering = ('-likes_count', '-timestamp', '-id')
+    page_size_setting = 'FORUM_POSTS_PAGE_SIZE'
+
+'''This pagination class pages through a forum's posts by their hot score, it reads the top posts from the forum's hot score index'''
+class HotPostsPagination(KeysetPagination):
+    ordering = ('-hot_score', '-id')
+    page_size_setting = 'FORUM_POSTS_PAGE_SIZE'
+    always_paginate = True
+
+'''This pagination class pages through a post's comments, most liked first and then oldest first'''
+class CommentsPagination(KeysetPagination):
+    ordering = ('-likes_count', 'timestamp', 'id')
+    page_size_setting = 'FORUM_COMMENTS_PAGE_SIZE'
+
+'''This pagination class pages through a citizen's notifications, most recent first'''
+class NotificationsPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    page_size_setting = 'NOTIFICATIONS_PAGE_SIZE'
+    always_paginate = True
+
+'''
+This pagination class pages through the matches of a full text search, best first. The matches aren't rows of a
+model, so the cursor holds the (score, kind, id) position of the last match that was sent and the search backend
+continues after it.
+'''
+class SearchPagination(KeysetPagination):
+    page_size_setting = 'SEARCH_PAGE_SIZE'
+
+    def paginate_search(self, backend, terms, request, forum_id=None):
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        after = self.decode_cursor(cursor) if cursor else None
+        # fetch one extra match to know if there is a next page
+        matches = backend.search(terms, forum_id=forum_id, after=after, limit=self.page_size + 1)
+        self.has_next = len(matches) > self.page_size
+        self.page = matches[:self.page_size]
+        return self.page
+
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [last['score'], last['kind'], last['id']]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            score, kind, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(score, (int, float)) or kind not in ('post', 'comment') or not isinstance(object_id, int):
+                raise ValueError
+            return [score, kind, object_id]
+        except (ValueError, TypeError, binascii.Error):
+            raise NotFound('Invalid cursor.')
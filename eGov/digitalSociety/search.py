@@ -0,0 +1,161 @@
+import re
+from django.db import connection, transaction
+from .models import *
+
+'''
+In this file, the full text search of the forums is defined. The posts and comments are copied to a search index
+table that is kept up to date by the signal receivers in signals.py and can be rebuilt with the rebuild_search_index
+command. The index is a FTS5 virtual table on SQLite and a table with a GIN indexed tsvector on PostgreSQL, so the
+search goes through the index instead of scanning the posts and comments with LIKE.
+'''
+
+SEARCH_TABLE = 'digitalSociety_search'
+
+# the words of the query, everything else is dropped so the query can't use the index's query syntax
+SEARCH_TERM = re.compile(r'\w+')
+
+'''This function returns the words of a search query, it's empty when there is nothing to search for'''
+def search_terms(query):
+    return SEARCH_TERM.findall(query or '')
+
+'''
+This class is the interface of a search index. Each entry is a post or a comment with the post and the forum it
+belongs to, so a post's entries can be removed and filtered by forum without joining the posts. The backends only
+differ in how they store the text and rank the matches, the score is lower for the better matches on both.
+'''
+class SearchBackend:
+    # the statements that create and drop the index, run by the migration
+    create_sql = []
+    drop_sql = []
+    # the statement that inserts the rows selected by the query passed to it, the columns of the select are
+    # (kind, object_id, post_id, forum_id, title, content)
+    insert_sql = ''
+
+    def __init__(self):
+        self.table = connection.ops.quote_name(SEARCH_TABLE)
+        self.posts = connection.ops.quote_name(Posts._meta.db_table)
+        self.comments = connection.ops.quote_name(Comments._meta.db_table)
+
+    def create(self, schema_editor):
+        for statement in self.create_sql:
+            schema_editor.execute(statement.format(table=self.table))
+
+    def drop(self, schema_editor):
+        for statement in self.drop_sql:
+            schema_editor.execute(statement.format(table=self.table))
+
+    def insert(self, cursor, select, params):
+        cursor.execute(self.insert_sql.format(table=self.table, select=select), params)
+
+    '''This function indexes a post that was created, or indexes it again after it was changed'''
+    def index_post(self, post, created):
+        with connection.cursor() as cursor:
+            if not created:
+                cursor.execute(f"DELETE FROM {self.table} WHERE kind = 'post' AND object_id = %s", [post.pk])
+                # the post may have been moved to another forum
+                cursor.execute(f"UPDATE {self.table} SET forum_id = %s WHERE post_id = %s AND forum_id <> %s", [post.forum_id, post.pk, post.forum_id])
+            self.insert(cursor, "SELECT 'post', %s, %s, %s, %s, %s", [post.pk, post.pk, post.forum_id, post.title, post.content])
+
+    '''This function indexes a comment that was created, or indexes it again after it was changed, the forum is read from its post'''
+    def index_comment(self, comment, created):
+        with connection.cursor() as cursor:
+            if not created:
+                cursor.execute(f"DELETE FROM {self.table} WHERE kind = 'comment' AND object_id = %s", [comment.pk])
+            self.insert(cursor, f"SELECT 'comment', %s, id, forum_id, '', %s FROM {self.posts} WHERE id = %s", [comment.pk, comment.content, comment.post_id])
+
+    def remove_comment(self, comment_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE kind = 'comment' AND object_id = %s", [comment_id])
+
+    '''This function removes a post and all its comments from the index with one query'''
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE post_id = %s", [post_id])
+
+    '''This function indexes all the posts and comments again and returns the number of indexed posts and comments'''
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            self.insert(cursor, f"SELECT 'post', id, id, forum_id, title, content FROM {self.posts} WHERE NOT is_deleted", [])
+            posts = cursor.rowcount
+            self.insert(cursor, f"SELECT 'comment', c.id, p.id, p.forum_id, '', c.content FROM {self.comments} c JOIN {self.posts} p ON p.id = c.post_id WHERE NOT p.is_deleted", [])
+            comments = cursor.rowcount
+        return {'posts': posts, 'comments': comments}
+
+    '''
+    This function returns the entries that match all the terms, best first, as dicts. The entries are ordered by
+    (score, kind, object_id) and after is the position of the last entry of the previous page, so the pages are
+    read through the index like the keyset pagination of the listings.
+    '''
+    def search(self, terms, forum_id=None, after=None, limit=20):
+        conditions, params = [], []
+        if forum_id is not None:
+            conditions.append('forum_id = %s')
+            params.append(forum_id)
+        if after is not None:
+            score, kind, object_id = after
+            conditions.append('(score > %s OR (score = %s AND (kind > %s OR (kind = %s AND object_id > %s))))')
+            params += [score, score, kind, kind, object_id]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        sql = f"SELECT kind, object_id, post_id, forum_id, title, content, score FROM ({self.match_sql()}) matches {where} ORDER BY score, kind, object_id LIMIT %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.match_query(terms), *params, limit])
+            columns = ['kind', 'id', 'post_id', 'forum_id', 'title', 'content', 'score']
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # the select of the entries that match the query with their score
+    def match_sql(self):
+        raise NotImplementedError
+
+    # the query of the terms in the index's syntax
+    def match_query(self, terms):
+        raise NotImplementedError
+
+'''This backend stores the index in a FTS5 virtual table and ranks the matches with bm25, a title match weighs 5 times a content match'''
+class SQLiteSearchBackend(SearchBackend):
+    create_sql = [
+        "CREATE VIRTUAL TABLE {table} USING fts5(kind UNINDEXED, object_id UNINDEXED, post_id UNINDEXED, forum_id UNINDEXED, title, content, tokenize = 'unicode61 remove_diacritics 2')",
+    ]
+    drop_sql = ["DROP TABLE IF EXISTS {table}"]
+    insert_sql = "INSERT INTO {table} (kind, object_id, post_id, forum_id, title, content) {select}"
+
+    def match_sql(self):
+        return f"SELECT kind, object_id, post_id, forum_id, title, content, bm25({self.table}, 0, 0, 0, 0, 5.0, 1.0) AS score FROM {self.table} WHERE {self.table} MATCH %s"
+
+    def match_query(self, terms):
+        # every term must appear, the last one may be the start of a word that is still being typed
+        return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+'''This backend stores the index with a tsvector weighing the title above the content, in a GIN index, and ranks the matches with ts_rank'''
+class PostgresSearchBackend(SearchBackend):
+    create_sql = [
+        "CREATE TABLE {table} (kind varchar(7) NOT NULL, object_id bigint NOT NULL, post_id bigint NOT NULL, forum_id bigint NOT NULL, "
+        "title text NOT NULL, content text NOT NULL, document tsvector NOT NULL, PRIMARY KEY (kind, object_id))",
+        "CREATE INDEX digitalsociety_search_document_idx ON {table} USING GIN (document)",
+        "CREATE INDEX digitalsociety_search_post_idx ON {table} (post_id)",
+    ]
+    drop_sql = ["DROP TABLE IF EXISTS {table}"]
+    insert_sql = (
+        "INSERT INTO {table} (kind, object_id, post_id, forum_id, title, content, document) "
+        "SELECT kind, object_id, post_id, forum_id, title, content, "
+        "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', content), 'B') "
+        "FROM ({select}) AS entries (kind, object_id, post_id, forum_id, title, content)"
+    )
+
+    def match_sql(self):
+        return f"SELECT kind, object_id, post_id, forum_id, title, content, -ts_rank(document, query) AS score FROM {self.table}, to_tsquery('simple', %s) query WHERE document @@ query"
+
+    def match_query(self, terms):
+        # every term must appear, the last one may be the start of a word that is still being typed
+        return ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+
+# the search backend of each database vendor
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+'''This function returns the search backend of the database, or None when the database has no full text search'''
+def get_search_backend():
+    backend = BACKENDS.get(connection.vendor)
+    return backend() if backend is not None else None
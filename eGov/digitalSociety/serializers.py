@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import *
 from django.conf import settings
+from .loaders import RegistrationDocumentsLoader, liked_ids
 
 '''This serializer is used to as a related field in the citizen serializer to include the username in the response'''
 class UserSerializer(serializers.ModelSerializer):
@@ -14,37 +15,84 @@ class CitizensSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     class Meta:
         model = Citizens
-        fields = '__all__'
+        # the unread counter is sent by its own endpoint
+        exclude = ['unread_notifications_count']
 
 '''This serializer will be used to send the notifications for the users'''
 class NotificationsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notifications
-        fields = '__all__'
+        fields = ['id', 'citizen', 'message']
+
+'''This serializer will be used to send the notifications of the inbox with their date and read state'''
+class NotificationsInboxSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notifications
+        fields = ['id', 'message', 'created_at', 'is_read']
 
 '''This serializer will be used to send the forums to the frontend'''
 class ForumsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Forums
-        fields = '__all__'
+        # the members of a region forum aren't stored, they are found from the addresses when they are needed
+        exclude = ['members']
+
+'''
+This list serializer is used when many posts or comments are serialized at once. It finds the ones the user
+liked in the whole page with one query and shares them with the child serializer for the liked_by_me field.
+'''
+class LikedByMeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        request = self.context.get('request')
+        if request is not None:
+            self.context['liked_ids'] = liked_ids(self.child.Meta.model, items, request.user)
+        return super().to_representation(items)
+
+'''This function tells if the user of the request liked the post or comment, it is False when there is no request'''
+def is_liked_by_me(serializer, obj):
+    liked = serializer.context.get('liked_ids')
+    if liked is None:
+        request = serializer.context.get('request')
+        # a single object is checked with its own query
+        liked = liked_ids(type(obj), [obj], request.user) if request is not None else set()
+    return obj.pk in liked
+
+'''
+These functions read the author's username and picture of a post or comment from its snapshot, so the listings
+don't load the authors. The rows that were created in bulk and not backfilled yet fall back to the author.
+'''
+def author_username(obj):
+    return obj.author_username or obj.author.user.username
+
+def author_picture_url(obj):
+    if not obj.author_username:
+        return obj.author.picture.url
+    return Citizens._meta.get_field('picture').storage.url(obj.author_picture)
 
 '''This serialzier will be used to send the posts to the frontend'''
 class PostsSerializer(serializers.ModelSerializer):
     # retireve the author's username & profile picture as related fields
     author = serializers.SerializerMethodField()
     picture = serializers.SerializerMethodField()
+    liked_by_me = serializers.SerializerMethodField()
 
     class Meta:
         model = Posts
-        fields = '__all__'
+        # the author's snapshot is sent as the author and picture fields, the deleted posts aren't sent and the hot score is only used for the ranking
+        exclude = ['author_username', 'author_picture', 'is_deleted', 'hot_score']
         extra_fields = ['author']
+        list_serializer_class = LikedByMeListSerializer
     
     def get_author(self, obj):
-        return obj.author.user.username
+        return author_username(obj)
+
+    def get_liked_by_me(self, obj):
+        return is_liked_by_me(self, obj)
     
     def get_picture(self, obj):
         # prepend the base url to the picture url
-        picture = obj.author.picture.url
+        picture = author_picture_url(obj)
         picture = f"{settings.BASE_URL}{picture}"
         return picture
     
@@ -60,17 +108,23 @@ class CommentsSerializer(serializers.ModelSerializer):
     # retireve the author's username & profile picture as related fields
     author = serializers.SerializerMethodField()
     picture = serializers.SerializerMethodField()
+    liked_by_me = serializers.SerializerMethodField()
 
     class Meta:
         model = Comments
-        fields = '__all__'
+        # the author's snapshot is sent as the author and picture fields
+        exclude = ['author_username', 'author_picture']
+        list_serializer_class = LikedByMeListSerializer
     
     def get_author(self, obj):
-        return obj.author.user.username
+        return author_username(obj)
+
+    def get_liked_by_me(self, obj):
+        return is_liked_by_me(self, obj)
     
     def get_picture(self, obj):
         # prepend the base url to the picture url
-        picture = obj.author.picture.url
+        picture = author_picture_url(obj)
         picture = f"{settings.BASE_URL}{picture}"
         return picture
     
@@ -235,6 +289,26 @@ class VehicleRegistrationSerializer(serializers.Serializer):
     proof_document = serializers.FileField()
     previous_owner_id = serializers.CharField(max_length=30)
 
+'''This serializer will be used to collect the new forum from the form, the members are only given for an explicit forum'''
+class ForumCreationSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=30)
+    region = serializers.CharField(max_length=30)
+    membership_rule = serializers.ChoiceField(choices=Forums.MEMBERSHIP_RULES, default='region')
+    # the national ids of the members
+    members = serializers.ListField(child=serializers.CharField(max_length=30), required=False, default=list)
+
+    def validate(self, data):
+        if data['membership_rule'] != 'explicit':
+            data['members'] = []
+            return data
+        # look the members up with one query and reject the ids that don't belong to a citizen
+        members = set(data['members'])
+        unknown = members - set(Citizens.objects.filter(pk__in=members).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError({'members': [f'Unknown national ids: {", ".join(sorted(unknown))}']})
+        data['members'] = sorted(members)
+        return data
+
 '''The following 2 serializers will be used to add the passport and driving license to the renewal requests serializer as related fields'''
 class PassportsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -318,6 +392,38 @@ class VehiclesSerializer(serializers.ModelSerializer):
         model = Vehicles
         fields = '__all__'
 
+'''This image field sends the picture URL prefixed with the base URL of the backend so the frontend can render it'''
+class BaseURLImageField(serializers.ImageField):
+    def to_representation(self, value):
+        url = super().to_representation(value)
+        return f"{settings.BASE_URL}{url}" if url else url
+
+'''The following serializers will be used to send the citizen's documents with full picture URLs to the documents page'''
+class CitizenDocumentSerializer(CitizensSerializer):
+    picture = BaseURLImageField(read_only=True)
+
+class PassportDocumentSerializer(PassportsSerializer):
+    picture = BaseURLImageField(read_only=True)
+
+class DrivingLicenseDocumentSerializer(DrivingLicenseSerializer):
+    picture = BaseURLImageField(read_only=True)
+
+class PropertyDocumentSerializer(PropertiesSerializer):
+    picture = BaseURLImageField(read_only=True)
+
+class VehicleDocumentSerializer(VehiclesSerializer):
+    picture = BaseURLImageField(read_only=True)
+
+'''
+This list serializer is used when many registration requests are serialized at once. It loads the pending
+documents for the whole page in one query per document type and shares them with the child serializer.
+'''
+class RegistrationRequestsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        registration_requests = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.context['registration_documents'] = RegistrationDocumentsLoader(registration_requests)
+        return super().to_representation(registration_requests)
+
 '''This serializer will be used to send the registration requests to the frontend'''
 class RegistrationRequestsSerializer(serializers.ModelSerializer):
     '''SerializerMethodField allows the defining of a method in the serializer that will be used to calculate the value for the field'''
@@ -331,28 +437,33 @@ class RegistrationRequestsSerializer(serializers.ModelSerializer):
     class Meta:
         model = RegistrationRequests
         fields = '__all__'
+        list_serializer_class = RegistrationRequestsListSerializer
+
+    '''
+    Retrieve the pending document of the given type for the request. The batch loader is used when the
+    request is part of a list, otherwise the document is queried directly. Requests of another type
+    return None without a query since their field is removed in to_representation anyway.
+    '''
+    def get_pending_document(self, obj, request_type, related_name, filters):
+        if obj.request_type != request_type:
+            return None
+        loader = self.context.get('registration_documents')
+        if loader is not None:
+            return loader.get(request_type, obj.citizen_id)
+        return getattr(obj.citizen, related_name).filter(**filters).first()
 
     # define custom methods for filtering related fields so that only the pending documents are included in the response
     def get_address_info(self, obj):
-        try:
-            pending_address = obj.citizen.addresses_set.get(state='Pending Request')
-            return AddressesSerializer(pending_address).data
-        except Addresses.DoesNotExist:
-            return None
+        pending_address = self.get_pending_document(obj, 'Address Registration', 'addresses_set', {'state': 'Pending Request'})
+        return AddressesSerializer(pending_address).data if pending_address else None
 
     def get_property_info(self, obj):
-        try:
-            property_under_transfer = obj.citizen.properties_set.get(is_under_transfer=True)
-            return PropertiesSerializer(property_under_transfer).data
-        except Properties.DoesNotExist:
-            return None
+        property_under_transfer = self.get_pending_document(obj, 'Property Registration', 'properties_set', {'is_under_transfer': True})
+        return PropertiesSerializer(property_under_transfer).data if property_under_transfer else None
     
     def get_vehicle_info(self, obj):
-        try:
-            vehicle_under_transfer = obj.citizen.vehicles_set.get(is_under_transfer=True)
-            return VehiclesSerializer(vehicle_under_transfer).data
-        except Vehicles.DoesNotExist:
-            return None
+        vehicle_under_transfer = self.get_pending_document(obj, 'Vehicle Registration', 'vehicles_set', {'is_under_transfer': True})
+        return VehiclesSerializer(vehicle_under_transfer).data if vehicle_under_transfer else None
     # copilot ^_^ 
 
     # only include the document info in the if the request type is of that document type.
@@ -1,10 +1,20 @@
 from PIL import Image
+import hashlib
 import io
 import os
+import threading
+import time
 import boto3
 import numpy as np
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import cached_property
 from dotenv import load_dotenv
+from .cache import TTLCache
+from .models import *
 
 # load environment variables from .env file
 load_dotenv()
@@ -13,39 +23,206 @@ load_dotenv()
 AWS_ACCESS_KEY = os.environ.get('AWS_ACCESS_KEY')
 AWS_SECRET_KEY = os.environ.get('AWS_SECRET_KEY')
 
-''' 
-This function will validate the uploaded images like the passport image by detecting faces 
-and checking if the image meets the requirements of a gov document. it will 
-return a boolean indicating whether the image is valid or not, and a message.
 '''
-def validate_uploaded_photo(picture):
+This class is the interface of the face detectors used to validate the uploaded photos. detect_faces takes the
+bytes of an image and returns the details of each face found in it, in the shape of Rekognition's FaceDetails:
+a BoundingBox with the Left, Top, Width and Height as ratios of the image's size, and a Pose with the Roll.
+'''
+class FaceDetector:
+    def detect_faces(self, image_bytes):
+        raise NotImplementedError
+
+'''
+This detector calls AWS Rekognition through one long lived client. Creating a client resolves the credentials,
+loads the service's model and sets up the endpoint, and its connection pool keeps the TLS connections open
+between the calls, so it is created once and shared. boto3 clients are thread safe once created, only their
+creation isn't, which is why it is done under a lock with a session of its own.
+'''
+class RekognitionFaceDetector(FaceDetector):
+    def __init__(self, region_name='eu-west-2', access_key=None, secret_key=None, max_connections=10):
+        self.region_name = region_name
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.max_connections = max_connections
+        self.lock = threading.Lock()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    session = boto3.session.Session()
+                    self._client = session.client('rekognition', region_name=self.region_name,
+                                                  aws_access_key_id=self.access_key,
+                                                  aws_secret_access_key=self.secret_key,
+                                                  config=Config(max_pool_connections=self.max_connections, retries={'mode': 'standard'}))
+        return self._client
+
+    def detect_faces(self, image_bytes):
+        # the default attributes include the bounding box and the pose, which is all the validation reads
+        response = self.client.detect_faces(Image={'Bytes': image_bytes}, Attributes=['DEFAULT'])
+        return response.get('FaceDetails', [])
+
+'''
+This detector runs in the process without any network, to run, load test and unit test the validation offline.
+It treats the part of the image that isn't background, the pixels darker than the threshold, as one face looking
+straight ahead, so a photo of a subject on a white background gives a face of its size and position.
+The faces can also be given, then they are returned for every image.
+'''
+class LocalFaceDetector(FaceDetector):
+    def __init__(self, faces=None, threshold=180):
+        self.faces = faces
+        self.threshold = threshold
+
+    def detect_faces(self, image_bytes):
+        if self.faces is not None:
+            return self.faces
+        img = Image.open(io.BytesIO(image_bytes)).convert('L')
+        # the box around the pixels that aren't background
+        box = img.point(lambda value: 255 if value < self.threshold else 0).getbbox()
+        if box is None:
+            return []
+        width, height = img.size
+        left, top, right, bottom = box
+        bounding_box = {'Left': left / width, 'Top': top / height, 'Width': (right - left) / width, 'Height': (bottom - top) / height}
+        return [{'BoundingBox': bounding_box, 'Pose': {'Roll': 0.0, 'Yaw': 0.0, 'Pitch': 0.0}, 'Confidence': 100.0}]
+
+# the face detectors that can be chosen with the FACE_DETECTOR setting
+FACE_DETECTORS = {
+    'rekognition': lambda: RekognitionFaceDetector(settings.FACE_DETECTOR_REGION, AWS_ACCESS_KEY, AWS_SECRET_KEY, settings.FACE_DETECTOR_MAX_CONNECTIONS),
+    'local': lambda: LocalFaceDetector(),
+}
+
+face_detectors = {}
+face_detectors_lock = threading.Lock()
+
+'''This function returns the face detector chosen by the FACE_DETECTOR setting, it is created once per process and shared'''
+def get_face_detector():
+    name = settings.FACE_DETECTOR
+    with face_detectors_lock:
+        if name not in face_detectors:
+            face_detectors[name] = FACE_DETECTORS[name]()
+        return face_detectors[name]
+
+'''
+This class keeps the number of runs, the number of rejections and the total time of each tier of the photo
+validation, so the cost of every tier and the remote calls saved by the cheaper ones can be checked.
+'''
+class PhotoValidationStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tiers = {}
+
+    def record(self, tier, ms, rejected):
+        with self.lock:
+            stats = self.tiers.setdefault(tier, {'runs': 0, 'rejections': 0, 'ms': 0.0})
+            stats['runs'] += 1
+            stats['rejections'] += int(rejected)
+            stats['ms'] += ms
+
+    def stats(self):
+        with self.lock:
+            return {tier: dict(stats) for tier, stats in self.tiers.items()}
+
+    def reset_stats(self):
+        with self.lock:
+            self.tiers.clear()
+
+photo_validation_stats = PhotoValidationStats()
+
+'''
+This class holds an uploaded photo while it goes through the tiers. Opening it only reads the header, and the
+image is decoded once, when a tier first reads its pixels, at a resolution bounded by PHOTO_VALIDATION_MAX_SIDE.
+JPEG photos are decoded in draft mode, where the decoder itself scales them down by 2, 4 or 8, so the full
+resolution pixels of a phone photo are never held in memory. The local checks read the decoded pixels and the
+face detector gets them encoded again as a small JPEG instead of the original file.
+'''
+class UploadedPhoto:
+    def __init__(self, picture, detector, max_side=None):
+        self.detector = detector
+        self.max_side = max_side or settings.PHOTO_VALIDATION_MAX_SIDE
+        # opening the image only reads its header, from the start of the file in case it was read before
+        picture.seek(0)
+        self.image = Image.open(picture)
+        # the size of the original image, the decoded one is smaller
+        self.size = self.image.size
+        # whether the verdict only depends on the photo, it doesn't when the face detector couldn't be called
+        self.cacheable = True
+
+    @cached_property
+    def decoded(self):
+        # let the JPEG decoder scale the image down to the smallest size that is still above the bound
+        self.image.draft('RGB', (self.max_side, self.max_side))
+        decoded = self.image.convert('RGB')
+        decoded.thumbnail((self.max_side, self.max_side))
+        return decoded
+
+    # the ratio of the decoded image's size to the original size
+    @cached_property
+    def scale(self):
+        return self.decoded.size[0] / self.size[0]
+
+    # the image sent to the face detector
+    @cached_property
+    def payload(self):
+        buffer = io.BytesIO()
+        self.decoded.save(buffer, format='JPEG', quality=90)
+        return buffer.getvalue()
+
+'''This tier checks the resolution from the image's header, without decoding it'''
+def check_resolution(photo):
+    img_width, img_height = photo.size
+    if img_width < 600 or img_height < 600:
+        return "Image resolution is too low."
+
+'''
+This function scores how white the background of an image is, as the share of the pixels of the two top corners
+and the middle of both sides, margin pixels wide, whose red, green and blue are all at least the threshold. Only
+these patches are cropped and converted to arrays, so the image is never copied into an array whole, and their
+pixels are counted by numpy in one pass.
+'''
+def background_uniformity(image, margin, white_threshold=180):
+    width, height = image.size
+    margin = min(margin, width, height)
+    middle = height // 2
+    patches = [
+        image.crop((0, 0, margin, margin)),
+        image.crop((width - margin, 0, width, margin)),
+        image.crop((0, middle - margin // 2, margin, middle + margin // 2)),
+        image.crop((width - margin, middle - margin // 2, width, middle + margin // 2)),
+    ]
+    # the darkest channel of each pixel, a pixel is white when it is above the threshold
+    darkest = np.concatenate([np.asarray(patch.convert('RGB')).min(axis=-1).ravel() for patch in patches])
+    return np.count_nonzero(darkest >= white_threshold) / darkest.size
+
+'''This tier checks that the background of the image is white by checking the top corners and the midpoints of the left and right sides of the image'''
+def check_background(photo):
+    # the margin is 50 pixels of the original image, at the decoded image's resolution
+    test_margin = max(1, round(50 * photo.scale))
+    # every pixel of the patches must be white or nearly white
+    if background_uniformity(photo.decoded, test_margin) < 1:
+        return "The background of the image is not white."
+
+'''This tier detects the face with the face detector and checks its count, size, position and pose'''
+def check_face(photo):
     try:
-        # convert the uploaded image to a byte array
-        image_stream = io.BytesIO(picture.read())
-
-        # initialize the Rekognition client
-        rekognition = boto3.client('rekognition', region_name='eu-west-2',
-                                   aws_access_key_id=AWS_ACCESS_KEY,
-                                   aws_secret_access_key=AWS_SECRET_KEY)
-
-        # call rekognition to detect faces in the image
-        response = rekognition.detect_faces(
-            Image={'Bytes': image_stream.getvalue()},
-            Attributes=['ALL']
-        )
+        # call the face detector to detect faces in the image
+        detected_faces = photo.detector.detect_faces(photo.payload)
     except (NoCredentialsError, PartialCredentialsError) as e:
-        return False, f"Error with AWS credentials: {str(e)}"
+        photo.cacheable = False
+        return f"Error with AWS credentials: {str(e)}"
     except Exception as e:
-        return False, f"Error detecting faces: {str(e)}"
+        photo.cacheable = False
+        return f"Error detecting faces: {str(e)}"
     
     ''' check if faces are detected '''
-    detected_faces = response.get('FaceDetails', [])
     if not detected_faces:
-        return False, "No faces detected in the image."
+        return "No faces detected in the image."
 
     ''' check image has one face only '''
     if len(detected_faces) > 1:
-        return False, "Multiple faces detected in the image."
+        return "Multiple faces detected in the image."
 
     # extract face rectangle and quality attributes
     face_details = detected_faces[0]
@@ -54,9 +231,8 @@ def validate_uploaded_photo(picture):
     face_width = face_rect['Width'] 
     face_height = face_rect['Height']
 
-    # open the image using PIL
-    img = Image.open(picture)
-    img_width, img_height = img.size
+    # the box is a ratio of the image's size, so it applies to the original size
+    img_width, img_height = photo.size
 
     # convert Left, Top, Width & Height from normalized values to pixel coordinates
     left_pixels = face_rect['Left'] * img_width
@@ -71,44 +247,161 @@ def validate_uploaded_photo(picture):
 
     '''check if the face size is appropriate'''
     if face_width_pixels < 0.3 * img_width or face_width_pixels > 0.7 * img_width:
-        return False, "Face size is not within the required range. It should be between 30% and 70% of the image width."
+        return "Face size is not within the required range. It should be between 30% and 70% of the image width."
 
     '''check if the face is centered'''
     if abs(face_center_x - img_width / 2) > 0.1 * img_width or abs(face_center_y - img_height / 2) > 0.1 * img_height:
-        return False, "Face must be centered in the image."
+        return "Face must be centered in the image."
 
     '''check if the head is straight (head pose roll) '''
     head_pose = face_details['Pose']
     if head_pose['Roll'] > 10 or head_pose['Roll'] < -10:
-        return False, "Head is tilted in the image."
-
-    '''check if the background of the image is white by checking the top corners and the midpoints of the left and right sides of the image'''
-    # convert the image to numpy array for efficient processing 
-    img_array = np.array(img) 
-    # define the number of pixels to consider from each corner
-    test_margin = 50  
-    # define the threshold that the pixels must be above to pass
-    white_threshold = 180
-    # get the midpoint of the image
-    midpoint_vertical = img_height // 2
-    # get the start and end of the vertical slice
-    midpoint_vertical_start = midpoint_vertical - test_margin // 2
-    midpoint_vertical_end = midpoint_vertical + test_margin // 2
-
-    # define slices for the test points
-    top_left = img_array[:test_margin, :test_margin]
-    top_right = img_array[:test_margin, -test_margin:]
-    left_midpoint = img_array[midpoint_vertical_start:midpoint_vertical_end, :test_margin]
-    right_midpoint = img_array[midpoint_vertical_start:midpoint_vertical_end, -test_margin:]
-
-    # check if all pixels in each corner are white or nearly white
-    corners = [top_left, top_right, left_midpoint, right_midpoint]
-    for corner in corners:
-        if np.any(corner < white_threshold): 
-            return False, "The background of the image is not white."
-
-    '''check the image quality - resolution '''
-    if img_width < 600 or img_height < 600:
-        return False, "Image resolution is too low."
+        return "Head is tilted in the image."
+
+# the tiers of the validation, cheapest first: the header, the pixels and then the remote face detection
+PHOTO_VALIDATION_TIERS = [
+    ('resolution', check_resolution),
+    ('background', check_background),
+    ('face', check_face),
+]
+
+'''This function returns the SHA-256 of the photo's bytes, read in chunks so the photo isn't copied in memory'''
+def photo_digest(picture):
+    picture.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: picture.read(64 * 1024), b''):
+        digest.update(chunk)
+    picture.seek(0)
+    return digest.hexdigest()
+
+'''
+This class caches the verdicts of the photo validation by the SHA-256 of the photo, since the citizens often submit
+the same photo again after fixing another field of the form. The verdicts are read from the process's LRU first and
+then from the PhotoVerdicts table, which is shared by the processes, and they are kept per face detector since two
+detectors may disagree on the same photo. Both expire after PHOTO_VERDICT_TTL seconds, the LRU keeps the
+PHOTO_VERDICT_CACHE_MAXSIZE most recently used verdicts and purge() trims the table to PHOTO_VERDICT_MAX_ROWS.
+The verdicts are also kept per version of the validation rules, so the ones given under older rules aren't used.
+'''
+class PhotoVerdictCache:
+    def __init__(self, maxsize, ttl, rules_version):
+        self.ttl = ttl
+        self.rules_version = rules_version
+        self.recent = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+        self.table_hits = 0
+
+    # the detector and the version of the rules that gave the verdicts, as they are stored in the table
+    def key(self, detector):
+        return f'{detector}:v{self.rules_version}'
+
+    '''This function returns the (is_valid, message) verdict of the photo, or None when it isn't cached'''
+    def get(self, detector, digest):
+        detector = self.key(detector)
+        now = timezone.now()
+        found, entry = self.recent.lookup((detector, digest))
+        # the entries loaded from the table expire with their row
+        if found and entry[2] > now:
+            return entry[:2]
+        row = PhotoVerdicts.objects.filter(digest=digest, detector=detector, created_at__gt=now - timedelta(seconds=self.ttl)).values_list('is_valid', 'message', 'created_at').first()
+        if row is None:
+            return None
+        with self.lock:
+            self.table_hits += 1
+        is_valid, message, created_at = row
+        self.recent.set((detector, digest), (is_valid, message, created_at + timedelta(seconds=self.ttl)))
+        return is_valid, message
+
+    def set(self, detector, digest, verdict):
+        detector = self.key(detector)
+        is_valid, message = verdict
+        now = timezone.now()
+        self.recent.set((detector, digest), (is_valid, message, now + timedelta(seconds=self.ttl)))
+        PhotoVerdicts.objects.update_or_create(digest=digest, detector=detector, defaults={'is_valid': is_valid, 'message': message, 'created_at': now})
+
+    '''This function deletes the expired verdicts and the oldest ones above max_rows from the table and returns how many were deleted'''
+    def purge(self, max_rows=None):
+        max_rows = settings.PHOTO_VERDICT_MAX_ROWS if max_rows is None else max_rows
+        deleted, _ = PhotoVerdicts.objects.filter(created_at__lte=timezone.now() - timedelta(seconds=self.ttl)).delete()
+        # the newest row that is over the limit, it and everything older is deleted
+        oldest_kept = PhotoVerdicts.objects.order_by('-created_at', '-id').values_list('created_at', 'id')[max_rows:max_rows + 1].first()
+        if oldest_kept is not None:
+            created_at, pk = oldest_kept
+            over, _ = PhotoVerdicts.objects.filter(models.Q(created_at__lt=created_at) | models.Q(created_at=created_at, id__lte=pk)).delete()
+            deleted += over
+        return deleted
+
+    def clear(self):
+        self.recent.clear()
 
-    return True, "Image is valid."
\ No newline at end of file
+    def stats(self):
+        with self.lock:
+            return {**self.recent.stats(), 'table_hits': self.table_hits}
+
+    def reset_stats(self):
+        self.recent.reset_stats()
+        with self.lock:
+            self.table_hits = 0
+
+# the version of the photo validation rules, it is raised whenever a tier changes what it accepts
+PHOTO_VALIDATION_RULES_VERSION = 2
+
+photo_verdicts = PhotoVerdictCache(maxsize=settings.PHOTO_VERDICT_CACHE_MAXSIZE, ttl=settings.PHOTO_VERDICT_TTL, rules_version=PHOTO_VALIDATION_RULES_VERSION)
+
+'''This function runs the tiers of the validation on the photo, the first tier that rejects it stops the validation'''
+def run_photo_tiers(photo):
+    for tier, check in PHOTO_VALIDATION_TIERS:
+        start = time.perf_counter()
+        error = check(photo)
+        photo_validation_stats.record(tier, (time.perf_counter() - start) * 1000, rejected=error is not None)
+        if error is not None:
+            return False, error
+    return True, "Image is valid."
+
+''' 
+This function will validate the uploaded images like the passport image by detecting faces 
+and checking if the image meets the requirements of a gov document. it will 
+return a boolean indicating whether the image is valid or not, and a message.
+The checks run in tiers from the cheapest to the most expensive, and the first tier that rejects the image
+stops the validation, so a photo that is too small or not on a white background never reaches the face detector.
+The faces are detected by the configured face detector, unless another one is given. The verdicts of the
+configured detector are cached by the photo's SHA-256, so a photo that was already validated is returned its
+verdict without being decoded again.
+'''
+def validate_uploaded_photo(picture, detector=None):
+    # the verdicts of a detector given by the caller aren't cached, it may not be the one of the cached verdicts
+    cached = detector is None
+    if cached:
+        detector_name, digest = settings.FACE_DETECTOR, photo_digest(picture)
+        verdict = photo_verdicts.get(detector_name, digest)
+        if verdict is not None:
+            return verdict
+    try:
+        photo = UploadedPhoto(picture, detector or get_face_detector())
+    except Exception as e:
+        return False, f"Error reading the image: {str(e)}"
+    verdict = run_photo_tiers(photo)
+    if cached and photo.cacheable:
+        photo_verdicts.set(detector_name, digest, verdict)
+    return verdict
+
+'''
+This function validates the photo of a renewal request that was stored as Validating, in the background. A valid
+photo makes the request Pending, for the admins to review, and an invalid one rejects it with the reason, and the
+citizen is notified either way. The request is only moved if it is still Validating, so running it again, like the
+validate_renewal_photos command does for the tasks lost by a restart, is harmless.
+'''
+def validate_renewal_request(request_id):
+    renewal_request = RenewalRequests.objects.filter(pk=request_id, status='Validating').first()
+    if renewal_request is None:
+        return
+    with renewal_request.picture.open('rb') as picture:
+        is_valid, message = validate_uploaded_photo(picture)
+    document = renewal_request.request_type.lower()
+    if is_valid:
+        moved = RenewalRequests.objects.filter(pk=request_id, status='Validating').update(status='Pending')
+        notification = f"Your {document} renewal request has been submitted."
+    else:
+        moved = RenewalRequests.objects.filter(pk=request_id, status='Validating').update(status='Rejected', rejection_reason=message, reviewed_at=timezone.now())
+        notification = f"Your {document} renewal request has been rejected: {message}"
+    if moved:
+        Notifications.objects.create(citizen_id=renewal_request.citizen_id, message=notification)
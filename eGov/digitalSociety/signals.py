@@ -0,0 +1,126 @@
+from django.db.models import F
+from django.contrib.auth.models import Group
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import *
+from .cache import user_groups_cache
+from .search import get_search_backend
+from .forum import author_snapshot
+
+'''
+In this file, the signal receivers of the app are defined. They keep the denormalized data in sync
+when the models are changed from anywhere in the code. They are connected in apps.py.
+'''
+
+'''This receiver counts a new unread notification in the citizen's unread counter'''
+@receiver(post_save, sender=Notifications)
+def count_unread_notification(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        Citizens.objects.filter(pk=instance.citizen_id).update(unread_notifications_count=F('unread_notifications_count') + 1)
+
+'''This receiver removes a deleted unread notification from the citizen's unread counter'''
+@receiver(post_delete, sender=Notifications)
+def uncount_unread_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        Citizens.objects.filter(pk=instance.citizen_id, unread_notifications_count__gt=0).update(unread_notifications_count=F('unread_notifications_count') - 1)
+
+'''This receiver removes the cached groups of the users whose groups were changed from either side of the relation'''
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_changed_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups was changed
+        user_groups_cache.delete(instance.pk)
+    elif pk_set is None:
+        # group.user_set was cleared, so the users that were in it aren't known anymore
+        user_groups_cache.clear()
+    else:
+        # group.user_set was changed
+        for user_id in pk_set:
+            user_groups_cache.delete(user_id)
+
+'''This receiver removes the cached groups of a new or deleted user, since the ids can be reused'''
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_groups(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        user_groups_cache.delete(instance.pk)
+
+'''This receiver clears the cached groups when a group is renamed or deleted, since any user could be in it'''
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    if not kwargs.get('created', False):
+        user_groups_cache.clear()
+
+'''This receiver indexes a post for the full text search when it is created or changed'''
+@receiver(post_save, sender=Posts)
+def index_post(sender, instance, created, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index_post(instance, created)
+
+'''This receiver indexes a comment for the full text search when it is created or changed'''
+@receiver(post_save, sender=Comments)
+def index_comment(sender, instance, created, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index_comment(instance, created)
+
+'''This receiver removes a deleted post and its comments from the search index'''
+@receiver(post_delete, sender=Posts)
+def unindex_post(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove_post(instance.pk)
+
+'''This function tells if the rows are deleted because the object or queryset the delete was called on is one of the models'''
+def deleted_with(origin, *models):
+    return isinstance(origin, models) or getattr(origin, 'model', None) in models
+
+'''This receiver removes a deleted comment from the search index'''
+@receiver(post_delete, sender=Comments)
+def unindex_comment(sender, instance, origin=None, **kwargs):
+    # the comments deleted with their post are removed by the post's receiver with one query
+    if deleted_with(origin, Posts):
+        return
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove_comment(instance.pk)
+
+'''This receiver copies the author's username and picture to a new post or comment'''
+@receiver(pre_save, sender=Posts)
+@receiver(pre_save, sender=Comments)
+def snapshot_author(sender, instance, **kwargs):
+    if instance._state.adding and not instance.author_username:
+        for field, value in author_snapshot(instance.author).items():
+            setattr(instance, field, value)
+
+'''This receiver counts a new comment in its post's comments counter'''
+@receiver(post_save, sender=Comments)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        Posts.objects.filter(pk=instance.post_id).update(comments_count=F('comments_count') + 1)
+
+'''This receiver removes a deleted comment from its post's comments counter'''
+@receiver(post_delete, sender=Comments)
+def uncount_comment(sender, instance, origin=None, **kwargs):
+    # the post is being deleted with its comments, so there is no counter to update
+    if deleted_with(origin, Posts, Forums):
+        return
+    Posts.objects.filter(pk=instance.post_id, comments_count__gt=0).update(comments_count=F('comments_count') - 1)
+
+'''This receiver counts a new post in its forum's posts counter'''
+@receiver(post_save, sender=Posts)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        Forums.objects.filter(pk=instance.forum_id).update(posts_count=F('posts_count') + 1)
+
+'''This receiver removes a deleted post from its forum's posts counter'''
+@receiver(post_delete, sender=Posts)
+def uncount_post(sender, instance, origin=None, **kwargs):
+    # the forum is being deleted with its posts, so there is no counter to update
+    if deleted_with(origin, Forums):
+        return
+    Forums.objects.filter(pk=instance.forum_id, posts_count__gt=0).update(posts_count=F('posts_count') - 1)
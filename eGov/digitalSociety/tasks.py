@@ -0,0 +1,36 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+
+'''
+In this file, the background tasks of the app are run. A task is handed to a small pool of threads in the process
+once the transaction of the request commits, so the response doesn't wait for it and the task sees the committed
+rows. The tasks must be safe to lose: what they write can always be redone by a management command. When
+BACKGROUND_TASKS_EAGER is set, the tasks run right away in the caller, which is what the tests use.
+'''
+
+logger = logging.getLogger(__name__)
+
+executor = None
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_TASK_WORKERS, thread_name_prefix='background-task')
+    return executor
+
+'''This function runs a task in a thread of the pool and closes the thread's connection once the task is done'''
+def run_task(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        logger.exception('The background task %s failed', function.__name__)
+    finally:
+        connection.close()
+
+'''This function runs the function in the background once the current transaction commits'''
+def run_in_background(function, *args, **kwargs):
+    if settings.BACKGROUND_TASKS_EAGER:
+        return function(*args, **kwargs)
+    transaction.on_commit(lambda: get_executor().submit(run_task, function, args, kwargs))
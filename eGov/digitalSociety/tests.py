@@ -1,20 +1,37 @@
-from django.test import TestCase, override_settings # to override the settings for testing
+from django.test import TestCase, TransactionTestCase, override_settings # to override the settings for testing
+from django.test.utils import CaptureQueriesContext # to read the queries run by a request
 import tempfile # to create temporary files that store the uploaded files
 from rest_framework.test import APIClient # to test the API views
-from django.db import IntegrityError # to catch the IntegrityError when creating a duplicate object
+from django.db import IntegrityError, OperationalError, connection # to catch the database errors
 import factory # to create factories for the models
 from django.contrib.auth.models import Group # to create a group for the user
 from django.urls import reverse # to make requests to the views
 from datetime import datetime, timedelta # to create dates for the models
-from rest_framework_simplejwt.tokens import RefreshToken # to create JWT tokens for the users
+from django.utils import timezone # to create timezone aware dates
+from rest_framework_simplejwt.tokens import RefreshToken, AccessToken # to create and read JWT tokens for the users
 from django.core.files.uploadedfile import SimpleUploadedFile # to create a SimpleUploadedFile for the uploaded files
 from django.core.files.storage import default_storage # to access the media folder
+from django.core.management import call_command, CommandError # to run the management commands
+import io # to capture the output of the management commands
 import os # to access the file system
 import shutil # to copy files
+import threading # to run requests at the same time
+import time # to wait between the retries
 from django.conf import settings # to access the media root path from settings
 from .models import *
 from .modelFactory import *
 from .views import *
+from .cache import TTLCache, user_groups_cache, user_in_group
+from .authentication import ClaimsUser, ClaimsTokenObtainPairSerializer
+from .management.querybudgets import QUERY_BUDGETS, EXCLUDED_ENDPOINTS, BUDGET_SIZES, SAVEPOINT_STATEMENT, run_query_budget
+from .management.benchmarks import format_table, sample_photo
+from .services import RekognitionFaceDetector, LocalFaceDetector, get_face_detector, photo_validation_stats, photo_verdicts, background_uniformity, PHOTO_VALIDATION_RULES_VERSION
+from botocore.stub import Stubber, ANY # to answer the Rekognition calls without the network
+from PIL import Image # to create the test photos
+from .urls import urlpatterns
+from django.db import transaction
+from .forum import toggle_like, like_counter_buffer, reconcile_counters, refresh_hot_scores, update_hot_score, hot_time_score, author_snapshot, refresh_author_snapshots, purge_post
+from .search import get_search_backend
 
 '''This helper function is used to copy the test files to the temp media folder'''
 def setup_test_files(temp_media_root, files):
@@ -200,6 +217,48 @@ class UserDocumentsTest(TestCase):
         self.assertEqual(response.data, valid_data)
     # copilot ^_^
 
+class UserDocumentsQueryCountTest(TestCase):
+    '''Agenda: test the documents view loads the citizen and all of their documents in three queries'''
+    def setUp(self):
+        # set up a testing client and authenticate a citizen
+        self.client = APIClient()
+        self.user = UserFactory(username='testuser')
+        self.citizen = CitizensFactory(user=self.user)
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_query_count_is_pinned(self):
+        # create several documents of every type
+        PassportsFactory(citizen=self.citizen)
+        DrivingLicensesFactory(citizen=self.citizen)
+        addresses = AddressesFactory.create_batch(3, citizen=self.citizen)
+        PropertiesFactory.create_batch(2, citizen=self.citizen)
+        VehiclesFactory.create_batch(2, citizen=self.citizen)
+        # ensure the view runs one query for the authenticated user and three for the documents
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('user_documents'))
+        self.assertEqual(response.status_code, 200)
+        # ensure the joined addresses aren't repeated and keep their order
+        self.assertEqual([address['id'] for address in response.data['addresses']], [address.id for address in addresses])
+        self.assertEqual(len(response.data['properties']), 2)
+        self.assertEqual(len(response.data['vehicles']), 2)
+
+    def test_citizen_without_documents(self):
+        # ensure the missing documents are sent as None
+        response = self.client.get(reverse('user_documents'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['citizen']['national_id'], self.citizen.national_id)
+        self.assertEqual(response.data['citizen']['user'], {'username': 'testuser'})
+        for document in ['passport', 'license', 'properties', 'vehicles', 'addresses']:
+            self.assertIsNone(response.data[document])
+
+    def test_user_without_citizen(self):
+        # ensure a user that isn't a citizen gets an error
+        token = str(RefreshToken.for_user(UserFactory()).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(reverse('user_documents'))
+        self.assertEqual(response.status_code, 400)
+
 class UserProfileTest(BaseTestCase):
     def setUp(self):
         # set up a testing client
@@ -625,6 +684,75 @@ class DrivingLicensesValidationTest(BaseTestCase):
         response = self.client.post(reverse('license_info_validation'), invalid_data, format='multipart')
         self.assertEqual(response.status_code, 400)
     
+@override_settings(PHOTO_VALIDATION_ASYNC=True, FACE_DETECTOR='local')
+class AsyncPhotoValidationTest(BaseTestCase):
+    '''Agenda: test that the renewal requests are stored as Validating and their photos are validated in the background'''
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory(username='user')
+        self.citizen = CitizensFactory(user=self.user)
+        self.user.groups.add(Group.objects.create(name='Citizens'))
+        self.passport = PassportsFactory(citizen=self.citizen, passport_number='P0123456', issue_date='2020-01-01', expiry_date='2025-01-01')
+        self.driving_license = DrivingLicensesFactory(issue_date='2020-01-01', expiry_date='2030-01-01', citizen=self.citizen, license_number='P0123456')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        photo_verdicts.clear()
+
+    def submit_passport(self, data):
+        picture = SimpleUploadedFile("TestImage.jpg", data, content_type='image/jpeg')
+        return self.client.post(reverse('passport_info_validation'), {
+            'passport_number': self.passport.passport_number,
+            'issue_date': self.passport.issue_date,
+            'expiry_date': self.passport.expiry_date,
+            'picture': picture,
+        }, format='multipart')
+
+    def test_valid_photo_moves_the_request_to_pending(self):
+        # ensure the request is stored as Validating and the response doesn't wait for the validation
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.submit_passport(sample_photo())
+        self.assertEqual(response.status_code, 202)
+        renewal_request = RenewalRequests.objects.get(citizen=self.citizen)
+        self.assertEqual(renewal_request.status, 'Validating')
+        self.assertEqual(len(callbacks), 1)
+        # ensure a second request is refused while the first one is being validated
+        self.assertEqual(self.submit_passport(sample_photo()).status_code, 400)
+        # ensure the validation makes the request pending and notifies the citizen
+        validate_renewal_request(renewal_request.pk)
+        renewal_request.refresh_from_db()
+        self.assertEqual(renewal_request.status, 'Pending')
+        self.assertTrue(Notifications.objects.filter(citizen=self.citizen, message="Your passport renewal request has been submitted.").exists())
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_invalid_photo_rejects_the_request(self):
+        data = {
+            'license_number': self.driving_license.license_number,
+            'issue_date': self.driving_license.issue_date,
+            'expiry_date': self.driving_license.expiry_date,
+            'nationality': self.driving_license.nationality,
+            'license_class': self.driving_license.license_class,
+            'emergency_contact': self.driving_license.emergency_contact,
+            'picture': SimpleUploadedFile("TestImage.jpg", sample_photo(400), content_type='image/jpeg'),
+        }
+        response = self.client.post(reverse('license_info_validation'), data, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        # ensure the request is rejected with the reason and the citizen is notified
+        renewal_request = RenewalRequests.objects.get(citizen=self.citizen)
+        self.assertEqual((renewal_request.status, renewal_request.rejection_reason), ('Rejected', "Image resolution is too low."))
+        self.assertIsNotNone(renewal_request.reviewed_at)
+        self.assertTrue(Notifications.objects.filter(citizen=self.citizen, message="Your driver's license renewal request has been rejected: Image resolution is too low.").exists())
+
+    def test_command_validates_the_lost_requests(self):
+        # the background validation of the request is lost, like after a restart
+        with self.captureOnCommitCallbacks(execute=False):
+            self.submit_passport(sample_photo())
+        out = io.StringIO()
+        call_command('validate_renewal_photos', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "1 requests validated")
+        self.assertEqual(RenewalRequests.objects.get(citizen=self.citizen).status, 'Pending')
+        # ensure running it again doesn't notify the citizen twice
+        validate_renewal_request(RenewalRequests.objects.get(citizen=self.citizen).pk)
+        self.assertEqual(Notifications.objects.filter(citizen=self.citizen).count(), 1)
+
 class AddressRegistrationTest(BaseTestCase):
     '''Agenda: test the view allows the authenticated user in the citizens group to register an address correctly'''
     def setUp(self):
@@ -952,6 +1080,54 @@ class RenewalRequestsAPIViewTest(BaseTestCase):
             self.assertNotEqual(request['status'], 'Rejected')
             self.assertNotEqual(request['status'], 'Approved')   
 
+class RenewalRequestsQueryCountTest(TestCase):
+    '''Agenda: test the renewal requests view loads the citizens and their documents in a fixed number of queries'''
+    def setUp(self):
+        # set up the test client
+        self.client = APIClient()
+
+    def seed_pending_requests(self, count):
+        # create citizens in bulk and give each of them a passport, a license and a pending renewal request
+        citizens = create_citizens_in_bulk(count)
+        today = datetime.now().date()
+        Passports.objects.bulk_create([
+            Passports(citizen=citizen, passport_number=f'P{citizen.national_id}', issue_date=today, expiry_date=today, picture='passport.jpg')
+            for citizen in citizens
+        ])
+        DrivingLicenses.objects.bulk_create([
+            DrivingLicenses(citizen=citizen, license_number=f'L{citizen.national_id}', issue_date=today, expiry_date=today, emergency_contact='123', license_class='B', picture='license.jpg')
+            for citizen in citizens
+        ])
+        # alternate between passport and license requests
+        RenewalRequests.objects.bulk_create([
+            RenewalRequests(citizen=citizen, request_type='Passport' if i % 2 == 0 else "Driver's License", picture='new.jpg', reason='test', proof_document='proof.pdf', status='Pending')
+            for i, citizen in enumerate(citizens)
+        ])
+
+    def test_query_count_is_flat(self):
+        # ensure the query count stays the same as the number of pending requests grows to 10, 100 and 1000
+        seeded = 0
+        for total in [10, 100, 1000]:
+            self.seed_pending_requests(total - seeded)
+            seeded = total
+            with self.subTest(total=total):
+                # one query for the requests & citizens, one for the passports and one for the licenses
+                with self.assertNumQueries(3):
+                    response = self.client.get(reverse('renewal_requests'))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()), total)
+
+    def test_prefetched_documents_match_the_citizen(self):
+        # ensure each request still includes the document that belongs to its own citizen
+        self.seed_pending_requests(4)
+        response = self.client.get(reverse('renewal_requests'))
+        for request in response.json():
+            national_id = request['citizen_info']['national_id']
+            if request['request_type'] == 'Passport':
+                self.assertEqual(request['passport_info'][0]['passport_number'], f'P{national_id}')
+            else:
+                self.assertEqual(request['license_info'][0]['license_number'], f'L{national_id}')
+
 @override_settings(MEDIA_ROOT=tempfile.mkdtemp()) # this will store and clean up the uploaded files in a temporary folder
 class AcceptRenewalRequestTest(BaseTestCase):
     '''Agenda: test the view allows inspectors to accept the renewal requests'''
@@ -1116,6 +1292,61 @@ class RegistrationRequestsAPIViewTest(TestCase):
             self.assertNotEqual(request['status'], 'Rejected')
             self.assertNotEqual(request['status'], 'Approved')
 
+class RegistrationRequestsQueryCountTest(TestCase):
+    '''Agenda: test the registration requests view batch loads the pending documents of the listed requests'''
+    def setUp(self):
+        # set up the test client
+        self.client = APIClient()
+
+    def seed_pending_requests(self, count):
+        # create citizens in bulk and give each of them a pending document with the matching registration request
+        citizens = create_citizens_in_bulk(count)
+        requests = []
+        for i, citizen in enumerate(citizens):
+            if i % 3 == 0:
+                Addresses.objects.create(citizen=citizen, country='UK', city='London', street='Main', building_number=1, floor_number=1, apartment_number=i, state='Pending Request')
+                request_type = 'Address Registration'
+            elif i % 3 == 1:
+                Properties.objects.create(citizen=citizen, property_id=f'PROP{i}', location='London', property_type='Land', description='test', picture='property.jpg', is_under_transfer=True)
+                request_type = 'Property Registration'
+            else:
+                Vehicles.objects.create(citizen=citizen, serial_number=i, model='test', manufacturer='test', year=2020, vehicle_type='Van', picture='vehicle.jpg', plate_number=f'PLATE{citizen.national_id}', is_under_transfer=True)
+                request_type = 'Vehicle Registration'
+            requests.append(RegistrationRequests(citizen=citizen, request_type=request_type, proof_document='proof.pdf', status='Pending'))
+        RegistrationRequests.objects.bulk_create(requests)
+
+    def test_query_count_is_flat(self):
+        # ensure the view runs one query for the requests & citizens and one for each document type at any size
+        seeded = 0
+        for total in [9, 90]:
+            self.seed_pending_requests(total - seeded)
+            seeded = total
+            with self.subTest(total=total):
+                with self.assertNumQueries(4):
+                    response = self.client.get(reverse('registration_requests'))
+                self.assertEqual(len(response.json()), total)
+
+    def test_only_listed_document_types_are_loaded(self):
+        # ensure a page with address requests only doesn't query the properties or vehicles
+        citizen = CitizensFactory()
+        address = AddressesFactory(citizen=citizen, state='Pending Request')
+        RegistrationRequestsFactory(citizen=citizen, request_type='Address Registration', status='Pending')
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('registration_requests'))
+        self.assertEqual(response.json()[0]['address_info']['id'], address.id)
+
+    def test_batched_documents_match_the_citizen(self):
+        # ensure each request includes the pending document of its own citizen
+        self.seed_pending_requests(6)
+        for request in self.client.get(reverse('registration_requests')).json():
+            citizen_id = request['citizen_info']['national_id']
+            if request['request_type'] == 'Address Registration':
+                self.assertEqual(request['address_info']['citizen'], citizen_id)
+            elif request['request_type'] == 'Property Registration':
+                self.assertEqual(request['property_info']['citizen'], citizen_id)
+            else:
+                self.assertEqual(request['vehicle_info']['citizen'], citizen_id)
+
 @override_settings(MEDIA_ROOT=tempfile.mkdtemp()) # this will store and clean up the uploaded files in a temporary folder
 class AcceptRegistrationRequestTest(BaseTestCase):
     '''Agenda: test the view allows inspectors to accept the registration requests'''
@@ -1387,6 +1618,489 @@ class GetContentViewsTest(TestCase):
         response_data = response.json()
         self.assertEqual(len(response_data), 1)
 
+class ForumListingQueryCountTest(TestCase):
+    '''Agenda: test the posts and comments listings don't run extra queries for every distinct author'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+
+    def seed_page(self, distinct_authors, rows=30):
+        # create a page of posts and a page of comments on the first post written by the given number of authors
+        authors = create_citizens_in_bulk(distinct_authors)
+        posts = Posts.objects.bulk_create([
+            Posts(forum=self.forum, author=authors[i % distinct_authors], title=f'post {i}', content='test', **author_snapshot(authors[i % distinct_authors])) for i in range(rows)
+        ])
+        Comments.objects.bulk_create([
+            Comments(post=posts[0], author=authors[i % distinct_authors], content='test', **author_snapshot(authors[i % distinct_authors])) for i in range(rows)
+        ])
+        # like the first post so the likes are included in the page
+        posts[0].likes.add(*authors)
+        return posts[0]
+
+    def test_posts_query_count_does_not_depend_on_authors(self):
+        # ensure one author and thirty authors cost the same: the user, the forum, the posts, the likes and the user's likes
+        for distinct_authors in [1, 30]:
+            with self.subTest(distinct_authors=distinct_authors):
+                Posts.objects.all().delete()
+                self.seed_page(distinct_authors)
+                with self.assertNumQueries(5):
+                    response = self.client.get(reverse('get_posts', args=[self.forum.id]))
+                self.assertEqual(len(response.json()), 30)
+
+    def test_comments_query_count_does_not_depend_on_authors(self):
+        # ensure one author and thirty authors cost the same: the user, the post, the comments, the likes and the user's likes
+        for distinct_authors in [1, 30]:
+            with self.subTest(distinct_authors=distinct_authors):
+                Posts.objects.all().delete()
+                post = self.seed_page(distinct_authors)
+                with self.assertNumQueries(5):
+                    response = self.client.get(reverse('get_comments', args=[post.id]))
+                self.assertEqual(len(response.json()), 30)
+
+    def test_liked_by_me_flags(self):
+        post = self.seed_page(3, rows=3)
+        # the citizen likes the first post and its first comment
+        post.likes.add(self.citizen)
+        comment = Comments.objects.filter(post=post).first()
+        comment.likes.add(self.citizen)
+        # ensure only the liked post and comment are flagged in the listings and in the single post
+        posts = self.client.get(reverse('get_posts', args=[self.forum.id])).json()
+        self.assertEqual({p['id'] for p in posts if p['liked_by_me']}, {post.id})
+        comments = self.client.get(reverse('get_comments', args=[post.id])).json()
+        self.assertEqual({c['id'] for c in comments if c['liked_by_me']}, {comment.id})
+        self.assertTrue(self.client.get(reverse('get_post', args=[post.id])).json()['liked_by_me'])
+        self.assertFalse(self.client.get(reverse('get_post', args=[post.id + 1])).json()['liked_by_me'])
+
+    def test_author_data_is_joined_correctly(self):
+        # ensure the joined author data matches the author of each post
+        post = self.seed_page(3, rows=3)
+        response = self.client.get(reverse('get_post', args=[post.id]))
+        self.assertEqual(response.json()['author'], post.author.user.username)
+        self.assertEqual(response.json()['picture'], settings.BASE_URL + post.author.picture.url)
+        self.assertEqual(len(response.json()['likes']), 3)
+
+class PostsPaginationTest(TestCase):
+    '''Agenda: test the keyset pagination of a forum's posts'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        # create 25 posts with a few likes counts so there are ties in the ordering
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+        Posts.objects.bulk_create([
+            Posts(forum=self.forum, author=self.citizen, title=f'post {i}', content='test', likes_count=i % 3, **author_snapshot(self.citizen)) for i in range(25)
+        ])
+        self.expected_ids = list(Posts.objects.filter(forum=self.forum).order_by('-likes_count', '-timestamp', '-id').values_list('id', flat=True))
+
+    def get_page(self, cursor=None, page_size=10):
+        params = {'page_size': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get(reverse('get_posts', args=[self.forum.id]), params)
+
+    def test_pages_follow_the_posts_ordering(self):
+        # ensure paging through the forum returns every post once in the ranking order
+        ids, cursor, pages = [], None, 0
+        while True:
+            data = self.get_page(cursor).json()
+            ids += [post['id'] for post in data['results']]
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, self.expected_ids)
+
+    def test_later_pages_cost_the_same_as_the_first(self):
+        # ensure the first and the last page both run the user, forum, posts, likes and user's likes queries only
+        with self.assertNumQueries(5):
+            first = self.get_page().json()
+        second = self.get_page(first['next_cursor']).json()
+        with self.assertNumQueries(5):
+            self.get_page(second['next_cursor'])
+
+    def test_cursor_is_stable_while_likes_change(self):
+        # like the last post of the first page and a post of the second page after the first page was sent
+        first = self.get_page().json()
+        Posts.objects.filter(id=first['results'][-1]['id']).update(likes_count=10)
+        Posts.objects.filter(id=self.expected_ids[15]).update(likes_count=10)
+        # ensure the cursor still works and continues after the position of the first page
+        response = self.get_page(first['next_cursor'])
+        self.assertEqual(response.status_code, 200)
+        first_ids = {post['id'] for post in first['results']}
+        second_ids = [post['id'] for post in response.json()['results']]
+        self.assertFalse(first_ids & set(second_ids))
+        self.assertEqual(second_ids, [id for id in self.expected_ids[10:21] if id != self.expected_ids[15]][:10])
+
+    def test_invalid_cursor(self):
+        # ensure a tampered cursor is rejected
+        response = self.get_page('not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_full_list_without_pagination_parameters(self):
+        # ensure the clients that don't ask for a page still receive the full list
+        response = self.client.get(reverse('get_posts', args=[self.forum.id]))
+        self.assertEqual(len(response.json()), 25)
+
+class CommentsPaginationTest(TestCase):
+    '''Agenda: test the keyset pagination of a post's comments'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+
+    def create_thread(self, size):
+        post = Posts.objects.create(forum=self.forum, author=self.citizen, title="test post", content="test")
+        Comments.objects.bulk_create([
+            Comments(post=post, author=self.citizen, content=f'comment {i}', likes_count=i % 4, **author_snapshot(self.citizen)) for i in range(size)
+        ])
+        return post
+
+    def test_first_page_of_a_huge_thread_costs_the_same_as_a_small_one(self):
+        # ensure the first page of 1000 comments runs the same queries and sends the same number of rows as 5 comments
+        for size, expected_rows in [(5, 5), (1000, 20)]:
+            with self.subTest(size=size):
+                post = self.create_thread(size)
+                with self.assertNumQueries(5):
+                    response = self.client.get(reverse('get_comments', args=[post.id]), {'page_size': 20})
+                self.assertEqual(len(response.json()['results']), expected_rows)
+
+    @override_settings(FORUM_COMMENTS_PAGE_SIZE=7)
+    def test_page_size_is_configurable(self):
+        post = self.create_thread(30)
+        # ensure the setting is used as the default page size of the thread
+        first = self.client.get(reverse('get_comments', args=[post.id]), {'cursor': ''}).json()
+        self.assertEqual(len(first['results']), 7)
+        # ensure the client can ask for another page size, but not one above the maximum
+        self.assertEqual(len(self.client.get(reverse('get_comments', args=[post.id]), {'page_size': 12}).json()['results']), 12)
+        self.assertEqual(len(self.client.get(reverse('get_comments', args=[post.id]), {'page_size': 1000}).json()['results']), 30)
+
+    def test_pages_follow_the_comments_ordering(self):
+        # ensure paging through the thread returns every comment once, most liked first and then oldest first
+        post = self.create_thread(45)
+        expected_ids = list(Comments.objects.filter(post=post).order_by('-likes_count', 'timestamp', 'id').values_list('id', flat=True))
+        ids, params = [], {'page_size': 20}
+        while True:
+            data = self.client.get(reverse('get_comments', args=[post.id]), params).json()
+            ids += [comment['id'] for comment in data['results']]
+            if data['next_cursor'] is None:
+                break
+            params['cursor'] = data['next_cursor']
+        self.assertEqual(ids, expected_ids)
+
+class NotificationsInboxTest(TestCase):
+    '''Agenda: test the paginated inbox and the maintained unread counter'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.citizen = CitizensFactory(user=self.user)
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        # create notifications a minute apart so the newest one is the last one
+        now = timezone.now()
+        self.notifications = [
+            Notifications.objects.create(citizen=self.citizen, message=f'notification {i}', created_at=now + timedelta(minutes=i))
+            for i in range(5)
+        ]
+
+    def get_unread_count(self):
+        return self.client.get(reverse('unread_notifications_count')).json()['unread_count']
+
+    def test_unread_count_reads_the_counter(self):
+        # ensure the counter was kept in sync when the notifications were created
+        self.citizen.refresh_from_db()
+        self.assertEqual(self.citizen.unread_notifications_count, 5)
+        # ensure the endpoint only runs the user query and reads the counter with another one
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_unread_count(), 5)
+
+    def test_inbox_is_paginated_newest_first(self):
+        response = self.client.get(reverse('notifications_inbox'), {'page_size': 3}).json()
+        # ensure the newest notifications come first with their read state
+        self.assertEqual([n['message'] for n in response['results']], ['notification 4', 'notification 3', 'notification 2'])
+        self.assertFalse(response['results'][0]['is_read'])
+        # ensure the next page continues from the cursor
+        response = self.client.get(reverse('notifications_inbox'), {'page_size': 3, 'cursor': response['next_cursor']}).json()
+        self.assertEqual([n['message'] for n in response['results']], ['notification 1', 'notification 0'])
+        self.assertIsNone(response['next_cursor'])
+
+    def test_mark_notifications_read(self):
+        # ensure marking some of the notifications as read takes them off the counter
+        ids = [self.notifications[0].id, self.notifications[1].id]
+        response = self.client.post(reverse('mark_notifications_read'), {'ids': ids}, format='json')
+        self.assertEqual(response.json()['unread_count'], 3)
+        # ensure marking the same notifications again doesn't change the counter
+        self.client.post(reverse('mark_notifications_read'), {'ids': ids}, format='json')
+        self.assertEqual(self.get_unread_count(), 3)
+        # ensure the unread filter leaves out the read notifications
+        unread = self.client.get(reverse('notifications_inbox'), {'unread': 'true'}).json()['results']
+        self.assertEqual(len(unread), 3)
+        # ensure all the notifications are marked as read when no ids are given
+        self.client.post(reverse('mark_notifications_read'), {}, format='json')
+        self.assertEqual(self.get_unread_count(), 0)
+
+    def test_mark_notifications_read_rejects_malformed_ids(self):
+        # ensure ids that aren't a list of ids are refused without marking anything
+        for ids in [5, '12', [1, 'a'], {'id': 1}]:
+            response = self.client.post(reverse('mark_notifications_read'), {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_unread_count(), 5)
+
+    def test_reconcile_fixes_the_unread_counter(self):
+        # the notifications created in bulk skip the signal that counts them
+        Notifications.objects.bulk_create([Notifications(citizen=self.citizen, message='bulk') for _ in range(2)])
+        self.assertEqual(reconcile_counters()['Citizens.unread_notifications_count'], 1)
+        self.assertEqual(self.get_unread_count(), 7)
+
+    def test_deleting_unread_notification_updates_the_counter(self):
+        # ensure only unread notifications are taken off the counter when deleted
+        self.notifications[0].delete()
+        self.assertEqual(self.get_unread_count(), 4)
+        Notifications.objects.filter(id=self.notifications[1].id).update(is_read=True)
+        Citizens.objects.filter(pk=self.citizen.pk).update(unread_notifications_count=3)
+        Notifications.objects.get(id=self.notifications[1].id).delete()
+        self.assertEqual(self.get_unread_count(), 3)
+
+class GroupCacheTest(TestCase):
+    '''Agenda: test that the users' groups are cached and dropped from the cache when they change'''
+    def setUp(self):
+        # set up the test client and authenticate a user in the Reps group
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.group = Group.objects.create(name='Reps')
+        self.user.groups.add(self.group)
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        user_groups_cache.clear()
+        user_groups_cache.reset_stats()
+
+    def get_groups(self):
+        return self.client.get(reverse('user_groups')).json()['groups']
+
+    def test_groups_are_cached(self):
+        # ensure the first request loads the groups and the second one only runs the user query
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_groups(), ['Reps'])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_groups(), ['Reps'])
+        # ensure the lookups were counted
+        stats = user_groups_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+
+    def test_adding_and_removing_groups_invalidates_the_cache(self):
+        self.get_groups()
+        # ensure a group added from the user's side is seen on the next request
+        self.user.groups.add(Group.objects.create(name='Inspectors'))
+        self.assertEqual(sorted(self.get_groups()), ['Inspectors', 'Reps'])
+        # ensure a user removed from the group's side is seen on the next request
+        self.group.user_set.remove(self.user)
+        self.assertEqual(self.get_groups(), ['Inspectors'])
+        # ensure clearing the groups is seen on the next request
+        self.user.groups.clear()
+        self.assertEqual(self.get_groups(), [])
+
+    def test_group_required_uses_the_cache(self):
+        user_in_group(self.user, 'Reps')
+        # ensure the check doesn't query the database once the groups are cached
+        with self.assertNumQueries(0):
+            self.assertTrue(user_in_group(self.user, 'Reps'))
+            self.assertFalse(user_in_group(self.user, 'Inspectors'))
+
+    def test_cache_entries_expire_and_get_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # ensure the least recently used entry is evicted when the cache is full
+        cache.lookup('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.lookup('b'), (False, None))
+        self.assertEqual(cache.lookup('a'), (True, 1))
+        # ensure expired entries are treated as misses
+        cache.ttl = 0
+        cache.set('a', 1)
+        self.assertEqual(cache.lookup('a'), (False, None))
+
+class StatelessAuthenticationTest(TestCase):
+    '''Agenda: test that the tokens carry the claims and the views that opt in don't load the user'''
+    def setUp(self):
+        # set up the test client and a citizen in the Citizens group
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.citizen = CitizensFactory(user=self.user)
+        self.user.groups.add(Group.objects.create(name='Citizens'))
+        # log in to get the tokens with the claims
+        self.tokens = self.client.post(reverse('token_obtain_pair'), {'username': self.user.username, 'password': 'password'}).json()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def test_tokens_carry_the_claims(self):
+        token = AccessToken(self.tokens['access'])
+        self.assertEqual(token['username'], self.user.username)
+        self.assertEqual(token['national_id'], self.citizen.national_id)
+        self.assertEqual(token['groups'], ['Citizens'])
+        self.assertTrue(token['is_active'])
+
+    def test_views_run_no_authentication_queries(self):
+        # ensure the username and the groups are read from the claims
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('get_user')).json(), {'username': self.user.username})
+            self.assertEqual(self.client.get(reverse('user_groups')).json(), {'groups': ['Citizens']})
+        # ensure only the counter is queried
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('unread_notifications_count')).json(), {'unread_count': 0})
+
+    def test_tokens_without_the_claims_still_work(self):
+        # ensure the user of a token issued without the claims is loaded from the database
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('get_user')).json(), {'username': self.user.username})
+
+    def test_claims_user_loads_the_user_when_needed(self):
+        user = ClaimsUser(AccessToken(self.tokens['access']))
+        # ensure the citizen is loaded by its national id and the password check loads the full user once
+        with self.assertNumQueries(2):
+            self.assertEqual(user.citizen, self.citizen)
+            self.assertTrue(user.check_password('password'))
+            self.assertEqual(user.user.email, self.user.email)
+        # ensure the attributes that aren't claims don't load the user behind the view's back
+        with self.assertNumQueries(0), self.assertRaises(AttributeError):
+            user.email
+        # ensure the groups are read from the claims' names
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Citizens'])
+        self.assertTrue(user.groups.filter(name='Citizens').exists())
+
+    def test_inactive_users_are_refused(self):
+        # ensure a token issued to an inactive user is refused without loading the user
+        self.user.is_active = False
+        self.user.save()
+        token = str(ClaimsTokenObtainPairSerializer.get_token(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get(reverse('get_user')).status_code, 401)
+
+    def test_documents_read_the_username_from_the_claims(self):
+        # ensure the documents page doesn't load the user for the username
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user_documents'))
+        self.assertEqual(response.json()['citizen']['user'], {'username': self.user.username})
+        self.assertFalse(any('auth_user' in query['sql'] for query in queries.captured_queries))
+
+    def test_refresh_reads_the_claims_again(self):
+        # ensure a group added after logging in is in the next access token
+        self.user.groups.add(Group.objects.create(name='Reps'))
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']}).json()
+        self.assertEqual(sorted(AccessToken(response['access'])['groups']), ['Citizens', 'Reps'])
+        # ensure inactive users can't refresh their tokens
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+class QueryBudgetTest(TestCase):
+    '''Agenda: test that every endpoint stays within its query budget at every data size'''
+    def test_every_endpoint_has_a_budget(self):
+        # ensure a new endpoint can't be added without a budget or a reason to exclude it
+        names = {pattern.name for pattern in urlpatterns}
+        self.assertEqual(names - set(QUERY_BUDGETS) - set(EXCLUDED_ENDPOINTS), set())
+
+    def test_endpoints_stay_within_their_budgets(self):
+        rows = []
+        for name in QUERY_BUDGETS:
+            for size in BUDGET_SIZES:
+                with self.subTest(endpoint=name, size=size):
+                    # seed each size from scratch and roll it back
+                    with transaction.atomic():
+                        row = run_query_budget(name, size)
+                        transaction.set_rollback(True)
+                    rows.append(row)
+                    # ensure the seeded data makes the endpoint succeed and it didn't go over its budget
+                    self.assertLess(row['status'], 300)
+                    self.assertLessEqual(row['queries'], row['budget'])
+        # print the table when it's asked for
+        if os.environ.get('QUERY_BUDGET_REPORT'):
+            print('\n' + format_table(rows))
+
+class ForumMembershipTest(TestCase):
+    '''Agenda: test that the forums' members are found from their rule instead of being added one by one'''
+    def setUp(self):
+        # set up the test client and authenticate a rep
+        self.client = APIClient()
+        self.rep = CitizensFactory()
+        self.rep.user.groups.add(Group.objects.create(name='Reps'))
+        token = str(RefreshToken.for_user(self.rep.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        # a citizen living in Beirut and another one living in Tripoli
+        self.beirut = AddressesFactory(city='Beirut', state='Active').citizen
+        self.tripoli = AddressesFactory(city='Tripoli', state='Active').citizen
+
+    def get_forum_titles(self, citizen):
+        token = str(RefreshToken.for_user(citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return {forum['title'] for forum in self.client.get(reverse('get_forums')).json()}
+
+    def test_creating_a_forum_does_not_depend_on_the_population(self):
+        create_citizens_in_bulk(100)
+        # ensure the forum is created with the user, group and insert queries only and no member rows are added
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('create_forum'), {'title': 'nation forum', 'region': 'nation'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        forum = Forums.objects.get(title='nation forum')
+        self.assertFalse(forum.members.exists())
+        # ensure every citizen is a member of the nation forum
+        self.assertEqual(forum.member_citizens().count(), Citizens.objects.count())
+
+    def test_city_forum_members(self):
+        self.client.post(reverse('create_forum'), {'title': 'beirut forum', 'region': 'beirut'}, format='json')
+        # ensure the members are the citizens of the city whatever the case of the region
+        self.assertEqual(list(Forums.objects.get(title='beirut forum').member_citizens()), [self.beirut])
+
+    def test_city_lookup_uses_the_index(self):
+        # ensure the database looks the city up through the lower case index
+        self.assertIn('addresses_city_lower_idx', Addresses.in_city('Beirut').values('citizen_id').explain())
+
+    def test_explicit_forum_members(self):
+        data = {'title': 'ad hoc forum', 'region': 'nation', 'membership_rule': 'explicit', 'members': [self.tripoli.pk]}
+        self.client.post(reverse('create_forum'), data, format='json')
+        # ensure only the added citizens are members
+        self.assertEqual(list(Forums.objects.get(title='ad hoc forum').member_citizens()), [self.tripoli])
+        # ensure an unknown rule is rejected
+        response = self.client.post(reverse('create_forum'), {'title': 'x', 'region': 'nation', 'membership_rule': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_forum_rejects_invalid_data(self):
+        invalid = [
+            {'region': 'nation'},
+            {'title': 'x' * 31, 'region': 'nation'},
+            {'title': 'ad hoc forum', 'region': 'nation', 'membership_rule': 'explicit', 'members': self.tripoli.pk},
+            {'title': 'ad hoc forum', 'region': 'nation', 'membership_rule': 'explicit', 'members': [self.tripoli.pk, 'unknown']},
+        ]
+        # ensure the malformed data and the unknown members are refused without creating a forum
+        for data in invalid:
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(reverse('create_forum'), data, format='json').status_code, 400)
+        self.assertFalse(Forums.objects.exists())
+
+    def test_forums_visibility(self):
+        Forums.objects.create(title='nation forum', region='nation')
+        Forums.objects.create(title='beirut forum', region='Beirut')
+        Forums.objects.create(title='tripoli forum', region='TRIPOLI')
+        ad_hoc = Forums.objects.create(title='ad hoc forum', region='nation', membership_rule='explicit')
+        ad_hoc.members.add(self.tripoli)
+        # ensure each citizen sees the nation forum, the forum of their city and the explicit forums they were added to
+        self.assertEqual(self.get_forum_titles(self.beirut), {'nation forum', 'beirut forum'})
+        self.assertEqual(self.get_forum_titles(self.tripoli), {'nation forum', 'tripoli forum', 'ad hoc forum'})
+        # ensure the reps see every forum
+        self.assertEqual(self.get_forum_titles(self.rep), {'nation forum', 'beirut forum', 'tripoli forum', 'ad hoc forum'})
+
 class CreateContentaViewsTest(TestCase):
     '''Agenda: Test the create views for the townhall and ensure they work as expected'''
     def setUp(self):
@@ -1432,7 +2146,7 @@ class CreateContentaViewsTest(TestCase):
         response = self.client.post(reverse('create_forum'), self.forum_data, format='json')
         self.assertEqual(response.status_code, 200)
         # ensure that both users are in the forum since the region is nation
-        self.assertEqual(Forums.objects.get(title='test forum').members.count(), 2)
+        self.assertEqual(Forums.objects.get(title='test forum').member_citizens().count(), 2)
     
     def test_create_post(self):
         # get the JWT token for the user and pass it in the request header
@@ -1484,6 +2198,409 @@ class ContentLikeViewsTest(TestCase):
         response = self.client.post(reverse('update_comment_likes', args=[self.comment.id]))
         self.assertEqual(response.status_code, 200)
 
+class LikeToggleTest(TestCase):
+    '''Agenda: test that toggling a like doesn't load the other likes and keeps the count right'''
+    def setUp(self):
+        self.citizen = CitizensFactory()
+        self.forum = Forums.objects.create(region='nation', title='test forum')
+        self.post = Posts.objects.create(forum=self.forum, author=self.citizen, title='test post', content='test')
+        self.comment = Comments.objects.create(post=self.post, author=self.citizen, content='test')
+
+    def test_toggle_adds_and_removes_the_like(self):
+        for obj in [self.post, self.comment]:
+            # ensure the first toggle likes the object and the second one takes the like back
+            self.assertEqual(toggle_like(obj, self.citizen.pk), (True, 1))
+            self.assertTrue(obj.likes.filter(pk=self.citizen.pk).exists())
+            self.assertEqual(toggle_like(obj, self.citizen.pk), (False, 0))
+            self.assertFalse(obj.likes.exists())
+
+    def test_toggle_cost_does_not_depend_on_the_likes(self):
+        likers = create_citizens_in_bulk(200)
+        self.post.likes.add(*likers)
+        Posts.objects.filter(pk=self.post.pk).update(likes_count=200)
+        # ensure a toggle only runs the delete, the insert, the update of the count and the hot score and the read of the count
+        # the other 4 queries are the savepoints of the transactions, which are nested in the test's transaction
+        with self.assertNumQueries(9):
+            self.assertEqual(toggle_like(self.post, self.citizen.pk), (True, 201))
+
+    def test_stale_instances_do_not_lose_likes(self):
+        # ensure two toggles working on copies loaded before either of them ran are both counted
+        first, second = Posts.objects.get(pk=self.post.pk), Posts.objects.get(pk=self.post.pk)
+        other = CitizensFactory()
+        toggle_like(first, self.citizen.pk)
+        self.assertEqual(toggle_like(second, other.pk), (True, 2))
+
+@override_settings(LIKES_WRITE_BEHIND=True, LIKES_FLUSH_INTERVAL=0)
+class LikeCounterBufferTest(TestCase):
+    '''Agenda: test that the buffered likes counts are written in batches and that drifted counters are reconciled'''
+    def setUp(self):
+        self.citizen = CitizensFactory()
+        self.forum = Forums.objects.create(region='nation', title='test forum')
+        self.posts = [Posts.objects.create(forum=self.forum, author=self.citizen, title=f'post {i}', content='test') for i in range(3)]
+        like_counter_buffer.flush()
+
+    def test_likes_are_buffered_and_flushed_in_one_update(self):
+        likers = create_citizens_in_bulk(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            for post in self.posts:
+                for citizen in likers:
+                    toggle_like(post, citizen.pk)
+        # ensure the likes table was changed but the counts weren't written yet
+        self.assertEqual(Posts.objects.get(pk=self.posts[0].pk).likes_count, 0)
+        self.assertEqual(like_counter_buffer.pending(Posts, self.posts[0].pk), 5)
+        # ensure the flush writes the counts of all the posts with one update, then reads and updates their hot scores once
+        with self.assertNumQueries(3):
+            self.assertEqual(like_counter_buffer.flush(), 3)
+        self.assertEqual([post.likes_count for post in Posts.objects.filter(forum=self.forum)], [5, 5, 5])
+
+    def test_toggle_returns_the_buffered_count(self):
+        other = CitizensFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_like(self.posts[0], self.citizen.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(toggle_like(self.posts[0], other.pk), (True, 2))
+
+    def test_reconcile_fixes_drifted_counters(self):
+        self.posts[0].likes.add(self.citizen)
+        # the count of the first post lost its like and the second one counts a like that isn't there
+        Posts.objects.filter(pk=self.posts[1].pk).update(likes_count=4)
+        fixed = reconcile_counters()
+        # ensure only the drifted posts were fixed
+        self.assertEqual(fixed['Posts.likes_count'], 2)
+        self.assertEqual(fixed['Comments.likes_count'], 0)
+        self.assertEqual(fixed['Posts.comments_count'], 0)
+        self.assertEqual([Posts.objects.get(pk=post.pk).likes_count for post in self.posts], [1, 0, 0])
+
+class ConcurrentLikesTest(TransactionTestCase):
+    '''Agenda: test that likes toggled at the same time from different threads are all counted'''
+    def test_concurrent_toggles(self):
+        author = CitizensFactory()
+        post = Posts.objects.create(forum=Forums.objects.create(region='nation', title='test forum'), author=author, title='test post', content='test')
+        likers = create_citizens_in_bulk(8)
+        barrier = threading.Barrier(len(likers))
+        errors = []
+
+        def like(citizen):
+            try:
+                barrier.wait()
+                # retry when the database is busy, each thread must get its like in
+                for attempt in range(50):
+                    try:
+                        return toggle_like(post, citizen.pk)
+                    except OperationalError:
+                        time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=like, args=[citizen]) for citizen in likers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # ensure every like was added and counted once
+        self.assertEqual(errors, [])
+        post.refresh_from_db()
+        self.assertEqual(post.likes.count(), len(likers))
+        self.assertEqual(post.likes_count, len(likers))
+
+class HotPostsTest(TestCase):
+    '''Agenda: test that the hot scores of the posts are kept up to date and that the hot sort reads them'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+
+    def create_post(self, title, age, likes_count=0):
+        post = Posts.objects.create(forum=self.forum, author=self.citizen, title=title, content='test')
+        Posts.objects.filter(pk=post.pk).update(timestamp=timezone.now() - age, likes_count=likes_count)
+        return post
+
+    def hot_ids(self, **params):
+        response = self.client.get(reverse('get_posts', args=[self.forum.id]), {'sort': 'hot', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_newer_posts_need_less_engagement(self):
+        old_popular = self.create_post('old popular', timedelta(days=1), likes_count=100)
+        old_quiet = self.create_post('old quiet', timedelta(days=1), likes_count=2)
+        new = self.create_post('new', timedelta(minutes=5))
+        refresh_hot_scores()
+        # ensure a new post outranks an old one with a few likes, but not one with a lot more
+        ids = [post['id'] for post in self.hot_ids()['results']]
+        self.assertEqual(ids, [old_popular.id, new.id, old_quiet.id])
+
+    def test_likes_and_comments_update_the_score(self):
+        post = self.create_post('post', timedelta(hours=1))
+        refresh_hot_scores()
+        initial = Posts.objects.get(pk=post.pk).hot_score
+        # ensure liking the post raises its score right away
+        self.client.post(reverse('update_post_likes', args=[post.id]))
+        liked = Posts.objects.get(pk=post.pk).hot_score
+        self.assertGreater(liked, initial)
+        # ensure commenting raises it again and deleting the comment takes it back
+        self.client.post(reverse('create_comment', args=[post.id]), {'content': 'test'})
+        commented = Posts.objects.get(pk=post.pk).hot_score
+        self.assertGreater(commented, liked)
+        self.client.post(reverse('delete_comment', args=[Comments.objects.get(post=post).id]))
+        self.assertAlmostEqual(Posts.objects.get(pk=post.pk).hot_score, liked)
+
+    def test_score_update_does_not_read_the_comments(self):
+        post = self.create_post('post', timedelta(hours=1))
+        Posts.objects.filter(pk=post.pk).update(comments_count=9)
+        # ensure the score is updated from the post's counters with one query, log10 of its 10 likes and comments is 1
+        with CaptureQueriesContext(connection) as queries:
+            update_hot_score(post)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('digitalSociety_comments', queries[0]['sql'])
+        self.assertAlmostEqual(Posts.objects.get(pk=post.pk).hot_score, 1 + hot_time_score(post.timestamp))
+
+    def test_created_posts_start_with_their_time_score(self):
+        # ensure a post created through the view doesn't wait for the batch job to be ranked
+        self.client.post(reverse('create_post'), {'title': 'post', 'content': 'test', 'forum_id': self.forum.id})
+        post = Posts.objects.get(forum=self.forum)
+        score = post.hot_score
+        refresh_hot_scores()
+        self.assertAlmostEqual(Posts.objects.get(pk=post.pk).hot_score, score, places=3)
+
+    def test_refresh_fixes_the_posts_in_batches(self):
+        Posts.objects.bulk_create([Posts(forum=self.forum, author=self.citizen, title=f'post {i}', content='test', likes_count=i) for i in range(7)])
+        # ensure every post created in bulk gets a score, with one read and one update per batch of 3
+        with self.assertNumQueries(6):
+            self.assertEqual(refresh_hot_scores(batch_size=3), 7)
+        self.assertFalse(Posts.objects.filter(hot_score=0).exists())
+        # ensure the command refreshes all the posts
+        out = io.StringIO()
+        call_command('refresh_hot_scores', stdout=out)
+        self.assertIn('7 posts updated', out.getvalue())
+
+    def test_hot_sort_pages_through_the_posts(self):
+        for i in range(25):
+            self.create_post(f'post {i}', timedelta(hours=i), likes_count=i % 4)
+        refresh_hot_scores()
+        expected = list(Posts.objects.filter(forum=self.forum).order_by('-hot_score', '-id').values_list('id', flat=True))
+        # ensure the hot sort is always paginated and the cursor walks the ranking without gaps
+        ids, cursor = [], None
+        while True:
+            data = self.hot_ids(**({'cursor': cursor} if cursor else {}))
+            ids += [post['id'] for post in data['results']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, expected)
+
+class ForumSearchTest(TestCase):
+    '''Agenda: test the full text search of the posts and comments and that its index follows the changes'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+        self.other_forum = Forums.objects.create(region="nation", title="other forum")
+        self.post = Posts.objects.create(forum=self.forum, author=self.citizen, title='Road repairs', content='The main road needs repairs')
+        self.comment = Comments.objects.create(post=self.post, author=self.citizen, content='The road near the school too')
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def found(self, q, **params):
+        return [(match['kind'], match['id']) for match in self.search(q, **params)['results']]
+
+    def test_posts_and_comments_are_found_and_ranked(self):
+        other = Posts.objects.create(forum=self.forum, author=self.citizen, title='Parks', content='a road to the park')
+        # ensure every word must match, and the last one may be the start of a word
+        self.assertEqual(self.found('school road'), [('comment', self.comment.id)])
+        self.assertEqual(self.found('repai'), [('post', self.post.id)])
+        # ensure a match in the title ranks above matches in the content only
+        self.assertEqual(self.found('road')[0], ('post', self.post.id))
+        self.assertEqual(set(self.found('road')), {('post', self.post.id), ('comment', self.comment.id), ('post', other.id)})
+
+    def test_search_is_filtered_by_forum(self):
+        other = Posts.objects.create(forum=self.other_forum, author=self.citizen, title='Road works', content='test')
+        self.assertEqual(self.found('road', forum_id=self.other_forum.id), [('post', other.id)])
+        self.assertEqual(len(self.found('road', forum_id=self.forum.id)), 2)
+
+    def test_index_follows_the_changes(self):
+        # ensure an edited post is found by its new words only
+        self.post.title = 'Bridge repairs'
+        self.post.content = 'The bridge needs repairs'
+        self.post.save()
+        self.assertEqual(self.found('bridge'), [('post', self.post.id)])
+        self.assertEqual(self.found('road'), [('comment', self.comment.id)])
+        # ensure the comments of a post moved to another forum follow it
+        self.post.forum = self.other_forum
+        self.post.save()
+        self.assertEqual(self.found('school', forum_id=self.other_forum.id), [('comment', self.comment.id)])
+        # ensure deleted comments and posts are removed, with the comments of the deleted posts
+        extra = Comments.objects.create(post=self.post, author=self.citizen, content='school bus')
+        extra.delete()
+        self.assertEqual(self.found('bus'), [])
+        self.post.delete()
+        self.assertEqual(self.found('school'), [])
+
+    def test_pages_follow_the_ranking(self):
+        for i in range(12):
+            Posts.objects.create(forum=self.forum, author=self.citizen, title=f'Budget {i}', content='budget ' * (i % 3 + 1))
+        expected = self.found('budget', page_size=100)
+        # ensure paging with the cursor returns every match once in the same order
+        found, cursor = [], None
+        while True:
+            data = self.search('budget', page_size=5, **({'cursor': cursor} if cursor else {}))
+            found += [(match['kind'], match['id']) for match in data['results']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(found), 12)
+        self.assertEqual(found, expected)
+
+    def test_invalid_searches(self):
+        # ensure a query without words, an invalid forum and an invalid cursor are rejected
+        self.assertEqual(self.client.get(reverse('search'), {'q': '"*'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'road', 'forum_id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'road', 'cursor': 'abc'}).status_code, 404)
+        # ensure the query syntax of the index can't be used
+        self.assertEqual(self.found('road OR NOT "school'), [])
+
+    def test_rebuild_indexes_everything(self):
+        Posts.objects.bulk_create([Posts(forum=self.forum, author=self.citizen, title='bulk', content='test') for _ in range(3)])
+        # ensure the posts created in bulk, without the signals, are found after the rebuild
+        self.assertEqual(self.found('bulk'), [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('4 posts and 1 comments indexed', out.getvalue())
+        self.assertEqual(len(self.found('bulk')), 3)
+
+class AuthorSnapshotTest(BaseTestCase):
+    '''Agenda: test that the posts and comments keep a copy of their author's username and picture up to date'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen with the token's claims
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        self.citizen.user.groups.add(Group.objects.create(name='Citizens'))
+        token = str(ClaimsTokenObtainPairSerializer.get_token(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+        self.post = Posts.objects.create(forum=self.forum, author=self.citizen, title='test post', content='test')
+        self.comment = Comments.objects.create(post=self.post, author=self.citizen, content='test')
+
+    def assertSnapshot(self, username, picture):
+        for obj in [Posts.objects.get(pk=self.post.pk), Comments.objects.get(pk=self.comment.pk)]:
+            self.assertEqual((obj.author_username, obj.author_picture), (username, picture))
+
+    def test_new_posts_and_comments_copy_their_author(self):
+        self.assertSnapshot(self.citizen.user.username, self.citizen.picture.name)
+
+    def test_listings_do_not_join_the_authors(self):
+        # ensure the posts and comments listings send the snapshot without reading the users or the citizens
+        for url in [reverse('get_posts', args=[self.forum.id]), reverse('get_comments', args=[self.post.id])]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.json()[0]['author'], self.citizen.user.username)
+            self.assertEqual(response.json()[0]['picture'], settings.BASE_URL + self.citizen.picture.url)
+            self.assertFalse(any('auth_user' in query['sql'] for query in queries.captured_queries))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_profile_changes_refresh_the_snapshot(self):
+        # ensure a new username and a new picture are copied to the citizen's posts and comments
+        self.client.post(reverse('user_profile'), {'username': 'renamed'})
+        self.assertSnapshot('renamed', self.citizen.picture.name)
+        image = SimpleUploadedFile('new_picture.jpg', b'test_image_content', content_type='image/jpeg')
+        self.client.post(reverse('user_profile'), {'profile_picture': image})
+        self.citizen.refresh_from_db()
+        self.assertSnapshot('renamed', self.citizen.picture.name)
+        self.assertTrue(self.citizen.picture.name.endswith('new_picture.jpg'))
+
+    def test_refresh_runs_after_the_response(self):
+        # ensure the refresh is handed to the background once the request's transaction commits
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('user_profile'), {'username': 'renamed'})
+        self.assertEqual(len(callbacks), 1)
+        self.assertSnapshot(self.citizen.user.username, self.citizen.picture.name)
+        # ensure the refresh only touches the citizen's rows
+        other = CitizensFactory()
+        Posts.objects.create(forum=self.forum, author=other, title='other post', content='test')
+        self.assertEqual(refresh_author_snapshots([self.citizen.pk]), {'Posts': 1, 'Comments': 1})
+        self.assertSnapshot('renamed', self.citizen.picture.name)
+
+    def test_checker_and_backfill(self):
+        # change the username without going through the profile, so the snapshot is stale
+        User.objects.filter(pk=self.citizen.user.pk).update(username='renamed')
+        with self.assertRaises(CommandError):
+            call_command('check_author_snapshots', stdout=io.StringIO())
+        # ensure the checker fixes the stale rows with --fix
+        out = io.StringIO()
+        call_command('check_author_snapshots', '--fix', stdout=out)
+        self.assertIn('Posts: 1 stale', out.getvalue())
+        self.assertSnapshot('renamed', self.citizen.picture.name)
+        call_command('check_author_snapshots', stdout=io.StringIO())
+        # ensure the backfill copies the authors to the rows created in bulk
+        Comments.objects.bulk_create([Comments(post=self.post, author=self.citizen, content='bulk') for _ in range(3)])
+        out = io.StringIO()
+        call_command('backfill_author_snapshots', '--batch-size', '2', stdout=out)
+        self.assertIn('Comments: 4 updated', out.getvalue())
+        self.assertFalse(Comments.objects.filter(author_username='').exists())
+
+class ContentCountersTest(TestCase):
+    '''Agenda: test that the comments count of the posts and the posts count of the forums follow the content'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+
+    def counts(self, post=None):
+        forum = Forums.objects.get(pk=self.forum.pk).posts_count
+        return (forum, Posts.objects.get(pk=post.pk).comments_count) if post else forum
+
+    def test_views_update_the_counters(self):
+        # ensure creating posts and comments counts them
+        for title in ['first', 'second']:
+            self.client.post(reverse('create_post'), {'title': title, 'content': 'test', 'forum_id': self.forum.id})
+        post = Posts.objects.get(title='first')
+        for _ in range(3):
+            self.client.post(reverse('create_comment', args=[post.id]), {'content': 'test'})
+        self.assertEqual(self.counts(post), (2, 3))
+        # ensure the counters are sent with the posts and the forums
+        self.assertEqual(self.client.get(reverse('get_post', args=[post.id])).json()['comments_count'], 3)
+        self.assertEqual(self.client.get(reverse('get_forum', args=[self.forum.id])).json()['posts_count'], 2)
+        # ensure deleting them uncounts them
+        self.client.post(reverse('delete_comment', args=[post.comments.first().id]))
+        self.assertEqual(self.counts(post), (2, 2))
+        self.client.post(reverse('delete_post', args=[post.id]))
+        self.assertEqual(self.counts(), 1)
+
+    def test_cascades_do_not_update_the_deleted_rows(self):
+        post = Posts.objects.create(forum=self.forum, author=self.citizen, title='test post', content='test')
+        for _ in range(5):
+            Comments.objects.create(post=post, author=self.citizen, content='test')
+        # ensure the comments deleted with their post don't each update the post's counter
+        with CaptureQueriesContext(connection) as queries:
+            post.delete()
+        self.assertEqual(sum('comments_count' in query['sql'] for query in queries.captured_queries), 0)
+        self.assertEqual(self.counts(), 0)
+
+    def test_reconcile_fixes_drifted_counters(self):
+        post = Posts.objects.create(forum=self.forum, author=self.citizen, title='test post', content='test')
+        Comments.objects.bulk_create([Comments(post=post, author=self.citizen, content='test') for _ in range(4)])
+        Forums.objects.filter(pk=self.forum.pk).update(posts_count=7)
+        # ensure the comments created in bulk are counted and the forum's counter is set back
+        fixed = reconcile_counters()
+        self.assertEqual((fixed['Posts.comments_count'], fixed['Forums.posts_count']), (1, 1))
+        self.assertEqual(self.counts(post), (1, 4))
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('Forums.posts_count: 0 fixed', out.getvalue())
+
 class DeleteContentViewsTest(TestCase):
     '''Agenda: Test the delete views for the townhall and ensure they work as expected'''
     def setUp(self):
@@ -1518,6 +2635,94 @@ class DeleteContentViewsTest(TestCase):
         response = self.client.post(reverse('delete_post', args=[self.post.id]))
         self.assertEqual(response.status_code, 200)
 
+class PostDeletionTest(TestCase):
+    '''Agenda: test that a post is deleted with its comments and likes in chunks, right away or after being hidden'''
+    def setUp(self):
+        # set up the test client and authenticate a citizen
+        self.client = APIClient()
+        self.citizen = CitizensFactory()
+        token = str(RefreshToken.for_user(self.citizen.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.forum = Forums.objects.create(region="nation", title="test forum")
+
+    def seed_post(self, comments, likers=5):
+        # create a post whose comments are all liked by the likers
+        post = Posts.objects.create(forum=self.forum, author=self.citizen, title='viral post', content='test')
+        citizens = create_citizens_in_bulk(likers)
+        post.likes.add(*citizens)
+        created = Comments.objects.bulk_create([Comments(post=post, author=self.citizen, content='test') for _ in range(comments)])
+        through = Comments.likes.through
+        through.objects.bulk_create([through(comments=comment, citizens=citizen) for comment in created for citizen in citizens])
+        return post
+
+    def assertPurged(self, post):
+        self.assertFalse(Posts.all_objects.filter(pk=post.pk).exists())
+        self.assertFalse(Comments.objects.filter(post_id=post.pk).exists())
+        self.assertFalse(Posts.likes.through.objects.filter(posts_id=post.pk).exists())
+        self.assertFalse(Comments.likes.through.objects.exists())
+        self.assertEqual(get_search_backend().search(['viral']), [])
+
+    def test_purge_deletes_the_rows_in_chunks(self):
+        post = self.seed_post(comments=25)
+        # ensure every row is deleted and counted with chunks of 10 rows
+        deleted = purge_post(post.pk, chunk_size=10)
+        self.assertEqual(deleted, {'comment likes': 125, 'comments': 25, 'post likes': 5, 'posts': 1})
+        self.assertPurged(post)
+        self.assertEqual(Forums.objects.get(pk=self.forum.pk).posts_count, 0)
+
+    def test_purge_cost_does_not_depend_on_the_rows(self):
+        # ensure a post with many comments and likes is deleted with as many statements as a small one, without loading them
+        statements = []
+        for comments in [1, 60]:
+            post = self.seed_post(comments)
+            with CaptureQueriesContext(connection) as queries:
+                purge_post(post.pk)
+            statements.append([query['sql'] for query in queries.captured_queries if not SAVEPOINT_STATEMENT.match(query['sql'])])
+        self.assertEqual(len(statements[0]), len(statements[1]))
+        self.assertFalse(any(sql.startswith('SELECT') and 'digitalSociety_comments' in sql.split('WHERE')[0] for sql in statements[1]))
+
+    @override_settings(POST_DELETE_ASYNC=True)
+    def test_soft_delete_hides_the_post_before_the_purge(self):
+        post = self.seed_post(comments=3)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('delete_post', args=[post.id]))
+        self.assertEqual(response.status_code, 200)
+        # ensure the post is hidden, uncounted and unsearchable while its rows are still there
+        self.assertEqual(self.client.get(reverse('get_post', args=[post.id])).status_code, 400)
+        self.assertEqual(self.client.get(reverse('get_posts', args=[self.forum.id])).json(), [])
+        self.assertEqual(Forums.objects.get(pk=self.forum.pk).posts_count, 0)
+        self.assertEqual(get_search_backend().search(['viral']), [])
+        self.assertEqual(Comments.objects.filter(post_id=post.pk).count(), 3)
+        # ensure the purge was handed to the background, and that the command purges what it left behind
+        self.assertEqual(len(callbacks), 1)
+        out = io.StringIO()
+        call_command('purge_deleted_posts', stdout=out)
+        self.assertIn('1 posts purged', out.getvalue())
+        self.assertPurged(post)
+        # ensure the counter isn't taken down twice
+        self.assertEqual(Forums.objects.get(pk=self.forum.pk).posts_count, 0)
+
+    @override_settings(POST_DELETE_ASYNC=True, BACKGROUND_TASKS_EAGER=True)
+    def test_soft_delete_runs_the_purge(self):
+        post = self.seed_post(comments=3)
+        self.client.post(reverse('delete_post', args=[post.id]))
+        self.assertPurged(post)
+
+    @override_settings(POST_DELETE_ASYNC=True)
+    def test_hidden_post_refuses_likes_and_comments(self):
+        post = self.seed_post(comments=1, likers=0)
+        comment = Comments.objects.get(post=post)
+        with self.captureOnCommitCallbacks():
+            self.client.post(reverse('delete_post', args=[post.id]))
+        # ensure nothing is added to the post while it waits for its purge
+        self.assertEqual(self.client.post(reverse('create_comment', args=[post.id]), {'content': 'late'}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('update_post_likes', args=[post.id])).status_code, 400)
+        self.assertEqual(self.client.post(reverse('update_comment_likes', args=[comment.id])).status_code, 400)
+        self.assertEqual(Comments.objects.filter(post_id=post.pk).count(), 1)
+        # ensure the purge deletes what was there
+        self.assertEqual(purge_post(post.pk), {'comment likes': 0, 'comments': 1, 'post likes': 0, 'posts': 1})
+        self.assertPurged(post)
+
 '''MODELS TESTS'''
 @override_settings(MEDIA_ROOT=tempfile.mkdtemp()) # this will store and clean up the uploaded files in a temporary folder
 class ModelCreationTests(BaseTestCase):
@@ -1849,7 +3054,7 @@ class ModelSerializersTest(BaseTestCase):
     def test_forum_serializer_contains_expected_fields(self):
         # ensure the serializer contains the expected fields
         data = self.forum_serializer.data
-        self.assertEqual(set(data.keys()), set(['id', 'title', 'region', 'members']))
+        self.assertEqual(set(data.keys()), set(['id', 'title', 'region', 'membership_rule', 'posts_count']))
         # ensure that the fields equal the model fields
         self.assertEqual(data['title'], self.forum.title)
         self.assertEqual(data['region'], self.forum.region)
@@ -1857,7 +3062,7 @@ class ModelSerializersTest(BaseTestCase):
     def test_post_serializer_contains_expected_fields(self):
         # ensure the serializer contains the expected fields
         data = self.post_serializer.data
-        self.assertEqual(set(data.keys()), set(['id', 'title', 'content', 'author', 'forum', 'picture', 'timestamp', 'likes', 'likes_count']))
+        self.assertEqual(set(data.keys()), set(['id', 'title', 'content', 'author', 'forum', 'picture', 'timestamp', 'likes', 'likes_count', 'comments_count', 'liked_by_me']))
         # ensure that the fields equal the model fields
         self.assertEqual(data['title'], self.post.title)
         self.assertEqual(data['content'], self.post.content)
@@ -1867,7 +3072,7 @@ class ModelSerializersTest(BaseTestCase):
     def test_comment_serializer_contains_expected_fields(self):
         # ensure the serializer contains the expected fields
         data = self.comment_serializer.data
-        self.assertEqual(set(data.keys()), set(['id', 'content', 'author', 'post', 'picture', 'timestamp', 'likes', 'likes_count']))
+        self.assertEqual(set(data.keys()), set(['id', 'content', 'author', 'post', 'picture', 'timestamp', 'likes', 'likes_count', 'liked_by_me']))
         # ensure that the fields equal the model fields
         self.assertEqual(data['content'], self.comment.content)
         self.assertEqual(data['author'], self.comment.author.user.username)
@@ -2254,3 +3459,195 @@ class RegistrationSerializersTest(BaseTestCase):
         self.assertIn('picture', serializer.errors)
         self.assertIn('proof_document', serializer.errors)
 
+'''SERVICES TESTS'''
+class FaceDetectorTest(TestCase):
+    '''Agenda: test the face detectors and the photo validation without the network'''
+    def photo(self, data=None):
+        return SimpleUploadedFile('photo.jpg', data or sample_photo(), content_type='image/jpeg')
+
+    def white_photo(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 800), 'white').save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def test_local_detector_validates_photos(self):
+        detector = LocalFaceDetector()
+        # ensure a centered subject on a white background is valid and an empty photo has no face
+        self.assertEqual(validate_uploaded_photo(self.photo(), detector), (True, "Image is valid."))
+        self.assertEqual(validate_uploaded_photo(self.photo(self.white_photo()), detector), (False, "No faces detected in the image."))
+        # ensure the given faces are returned for every photo
+        face = detector.detect_faces(sample_photo())[0]
+        self.assertEqual(validate_uploaded_photo(self.photo(), LocalFaceDetector(faces=[face, face])), (False, "Multiple faces detected in the image."))
+
+    def test_detector_is_chosen_by_the_setting_and_shared(self):
+        with override_settings(FACE_DETECTOR='local'):
+            self.assertIsInstance(get_face_detector(), LocalFaceDetector)
+            self.assertIs(get_face_detector(), get_face_detector())
+            self.assertTrue(validate_uploaded_photo(self.photo())[0])
+        self.assertIsInstance(get_face_detector(), RekognitionFaceDetector)
+
+    def test_rekognition_client_is_created_once(self):
+        detector = RekognitionFaceDetector(access_key='test', secret_key='test')
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(detector.client)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # ensure every thread got the same client
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        # ensure the calls go through it with the default attributes
+        face = LocalFaceDetector().detect_faces(sample_photo())[0]
+        with Stubber(detector.client) as stubber:
+            for _ in range(2):
+                stubber.add_response('detect_faces', {'FaceDetails': [face]}, {'Image': {'Bytes': ANY}, 'Attributes': ['DEFAULT']})
+            self.assertEqual(validate_uploaded_photo(self.photo(), detector), (True, "Image is valid."))
+            self.assertEqual(detector.detect_faces(sample_photo()), [face])
+
+class PhotoValidationTiersTest(TestCase):
+    '''Agenda: test that the photo validation stops at the first tier that rejects the photo and records every tier'''
+    def setUp(self):
+        # a local detector that counts its calls
+        self.detector = LocalFaceDetector()
+        self.detector.calls = 0
+        detect_faces = self.detector.detect_faces
+        def counted(image_bytes):
+            self.detector.calls += 1
+            return detect_faces(image_bytes)
+        self.detector.detect_faces = counted
+        photo_validation_stats.reset_stats()
+
+    def validate(self, data):
+        return validate_uploaded_photo(SimpleUploadedFile('photo.jpg', data, content_type='image/jpeg'), self.detector)
+
+    def grey_photo(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 800), (120, 120, 120)).save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def test_cheap_tiers_spare_the_detector(self):
+        # ensure a small photo is rejected from its header and a photo without a white background from its pixels
+        self.assertEqual(self.validate(sample_photo(400)), (False, "Image resolution is too low."))
+        self.assertEqual(self.validate(self.grey_photo()), (False, "The background of the image is not white."))
+        self.assertEqual(self.detector.calls, 0)
+        # ensure a valid photo goes through every tier
+        self.assertEqual(self.validate(sample_photo()), (True, "Image is valid."))
+        self.assertEqual(self.detector.calls, 1)
+        stats = photo_validation_stats.stats()
+        self.assertEqual({tier: (tier_stats['runs'], tier_stats['rejections']) for tier, tier_stats in stats.items()},
+                         {'resolution': (3, 1), 'background': (2, 1), 'face': (1, 0)})
+        self.assertTrue(all(tier_stats['ms'] >= 0 for tier_stats in stats.values()))
+
+    def test_unreadable_files_are_rejected(self):
+        valid, message = self.validate(b'not an image')
+        self.assertFalse(valid)
+        self.assertTrue(message.startswith("Error reading the image"))
+        self.assertEqual(photo_validation_stats.stats(), {})
+
+    def test_background_is_scored_in_the_corners_and_sides(self):
+        image = Image.new('RGB', (400, 400), 'white')
+        self.assertEqual(background_uniformity(image, 10), 1.0)
+        # ensure the bottom, where the shoulders are, isn't scored
+        image.paste((0, 0, 0), (0, 350, 400, 400))
+        self.assertEqual(background_uniformity(image, 10), 1.0)
+        # ensure a dark spot in a top corner lowers the score by its share of the four patches
+        image.paste((0, 0, 0), (0, 0, 5, 10))
+        self.assertAlmostEqual(background_uniformity(image, 10), 1 - 50 / 400)
+        self.assertEqual(self.validate(self.grey_photo()), (False, "The background of the image is not white."))
+
+    def test_every_channel_of_the_background_must_be_white(self):
+        # ensure a light blue background is rejected even though it is bright, its red channel is below the threshold
+        image = Image.new('RGB', (800, 800), (173, 216, 230))
+        self.assertEqual(background_uniformity(image, 50), 0.0)
+        data = io.BytesIO()
+        image.save(data, format='JPEG')
+        self.assertEqual(self.validate(data.getvalue()), (False, "The background of the image is not white."))
+
+    def test_large_photos_are_decoded_once_at_a_bounded_size(self):
+        self.detector.payloads = []
+        detect_faces = self.detector.detect_faces
+        def recorded(image_bytes):
+            self.detector.payloads.append(image_bytes)
+            return detect_faces(image_bytes)
+        self.detector.detect_faces = recorded
+        # ensure a large photo is valid and the detector gets a small re-encoded copy of it
+        data = sample_photo(3000)
+        with override_settings(PHOTO_VALIDATION_MAX_SIDE=800):
+            self.assertEqual(self.validate(data), (True, "Image is valid."))
+        payload = Image.open(io.BytesIO(self.detector.payloads[0]))
+        self.assertEqual(max(payload.size), 800)
+        self.assertLess(len(self.detector.payloads[0]), len(data))
+
+@override_settings(FACE_DETECTOR='local')
+class PhotoVerdictCacheTest(TestCase):
+    '''Agenda: test that the verdicts of the photo validation are cached by the photo's content'''
+    def setUp(self):
+        photo_verdicts.clear()
+        photo_verdicts.reset_stats()
+        photo_validation_stats.reset_stats()
+
+    def validate(self, data):
+        return validate_uploaded_photo(SimpleUploadedFile('photo.jpg', data, content_type='image/jpeg'))
+
+    # the number of photos that went through the tiers
+    def validations(self):
+        return photo_validation_stats.stats().get('resolution', {}).get('runs', 0)
+
+    def test_same_photo_is_validated_once(self):
+        data = sample_photo()
+        self.assertEqual(self.validate(data), (True, "Image is valid."))
+        # ensure a photo with the same content is answered from the cache without going through the tiers
+        self.assertEqual(self.validate(data), (True, "Image is valid."))
+        self.assertEqual(self.validations(), 1)
+        self.assertEqual(photo_verdicts.stats()['hits'], 1)
+        # ensure the rejections are cached too and another photo is validated
+        self.assertEqual(self.validate(sample_photo(400)), (False, "Image resolution is too low."))
+        self.assertEqual(self.validate(sample_photo(400)), (False, "Image resolution is too low."))
+        self.assertEqual(self.validations(), 2)
+        self.assertEqual(PhotoVerdicts.objects.filter(detector=f'local:v{PHOTO_VALIDATION_RULES_VERSION}').count(), 2)
+
+    def test_verdicts_of_older_rules_are_not_used(self):
+        data = sample_photo()
+        self.validate(data)
+        # ensure a verdict given under another version of the rules is validated again
+        photo_verdicts.clear()
+        PhotoVerdicts.objects.update(detector=f'local:v{PHOTO_VALIDATION_RULES_VERSION - 1}')
+        self.assertEqual(self.validate(data), (True, "Image is valid."))
+        self.assertEqual(self.validations(), 2)
+        self.assertEqual(PhotoVerdicts.objects.count(), 2)
+
+    def test_verdicts_are_shared_through_the_table(self):
+        data = sample_photo()
+        self.validate(data)
+        # ensure another process, without the verdict in its own cache, reads it from the table
+        photo_verdicts.clear()
+        self.assertEqual(self.validate(data), (True, "Image is valid."))
+        self.assertEqual(self.validations(), 1)
+        self.assertEqual(photo_verdicts.stats()['table_hits'], 1)
+        # ensure an expired verdict is validated again
+        photo_verdicts.clear()
+        PhotoVerdicts.objects.update(created_at=timezone.now() - timedelta(seconds=settings.PHOTO_VERDICT_TTL + 1))
+        self.assertEqual(self.validate(data), (True, "Image is valid."))
+        self.assertEqual(self.validations(), 2)
+        # ensure the verdicts are kept per detector
+        self.assertIsNone(photo_verdicts.get('rekognition', PhotoVerdicts.objects.get().digest))
+
+    def test_detector_errors_are_not_cached(self):
+        with override_settings(FACE_DETECTOR='rekognition'):
+            with Stubber(get_face_detector().client) as stubber:
+                stubber.add_client_error('detect_faces', 'ThrottlingException')
+                valid, message = self.validate(sample_photo())
+        self.assertFalse(valid)
+        self.assertTrue(message.startswith("Error detecting faces"))
+        self.assertFalse(PhotoVerdicts.objects.exists())
+
+    def test_purge_deletes_expired_and_oldest_verdicts(self):
+        now = timezone.now()
+        for index in range(5):
+            PhotoVerdicts.objects.create(digest=f'{index:064x}', detector='local', is_valid=True, message="Image is valid.", created_at=now - timedelta(minutes=index))
+        PhotoVerdicts.objects.create(digest='f' * 64, detector='local', is_valid=True, message="Image is valid.", created_at=now - timedelta(seconds=settings.PHOTO_VERDICT_TTL + 1))
+        out = io.StringIO()
+        call_command('purge_photo_verdicts', '--max-rows', '3', stdout=out)
+        # ensure the expired verdict and the 2 oldest ones were deleted
+        self.assertEqual(out.getvalue().strip(), "3 verdicts deleted")
+        self.assertEqual(set(PhotoVerdicts.objects.values_list('digest', flat=True)), {f'{index:064x}' for index in range(3)})
@@ -1,6 +1,7 @@
 from django.urls import path
 from . import views
 from .views import RenewalRequestsAPIView, RegistrationRequestsAPIView, UserDocumentsAPIView, ForumsAPIView
+from .authentication import ClaimsTokenObtainPairSerializer, ClaimsTokenRefreshSerializer
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -21,9 +22,12 @@ urlpatterns = [
     path("api/registration_requests/", RegistrationRequestsAPIView.as_view(), name="registration_requests"),
     path("api/accept_registration_request/<int:id>/", views.accept_registration_request, name="accept_registration_request"),
     path("api/reject_registration_request/<int:id>/", views.reject_registration_request, name="reject_registration_request"),
-    path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
-    path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("api/token/", TokenObtainPairView.as_view(serializer_class=ClaimsTokenObtainPairSerializer), name="token_obtain_pair"),
+    path("api/token/refresh/", TokenRefreshView.as_view(serializer_class=ClaimsTokenRefreshSerializer), name="token_refresh"),
     path("api/get_notifications/", views.get_notifications, name="get_notifications"), 
+    path("api/notifications_inbox/", views.notifications_inbox, name="notifications_inbox"),
+    path("api/unread_notifications_count/", views.unread_notifications_count, name="unread_notifications_count"),
+    path("api/mark_notifications_read/", views.mark_notifications_read, name="mark_notifications_read"),
     path("api/user_documents/", UserDocumentsAPIView.as_view(), name="user_documents"),
     path("api/user_profile/", views.user_profile, name="user_profile"),
     path("api/change_password/", views.change_password, name="change_password"),
@@ -38,6 +42,7 @@ urlpatterns = [
     path("api/get_comments/<int:post_id>/", views.get_comments, name="get_comments"),
     path("api/update_post_likes/<int:post_id>/", views.update_post_likes, name="update_post_likes"),
     path("api/update_comment_likes/<int:comment_id>/", views.update_comment_likes, name="update_comment_likes"),
+    path("api/search/", views.search, name="search"),
     path("api/get_user/", views.get_user, name="get_user"),
     path("api/delete_comment/<int:id>/", views.delete_comment, name="delete_comment"),
     path("api/delete_post/<int:id>/", views.delete_post, name="delete_post"),
@@ -1,15 +1,26 @@
 from django.shortcuts import render
 from datetime import datetime, timedelta
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated
 from django.core.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework import status, generics
 from django.conf import settings
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest, Lower
 from rest_framework.exceptions import ValidationError
 from .serializers import *
 from .models import *
 from .services import *
+from .loaders import CitizenDocumentsLoader, with_listing_relations
+from .pagination import PostsPagination, HotPostsPagination, CommentsPagination, NotificationsPagination, SearchPagination
+from .cache import get_user_groups, user_in_group
+from .authentication import StatelessJWTAuthentication
+from .forum import toggle_like, hot_time_score, update_hot_score, refresh_author_snapshots, purge_post, soft_delete_post
+from .tasks import run_in_background
+from .search import get_search_backend, search_terms
 
 def index(request):
     return render(request, "index.html")
@@ -18,7 +29,8 @@ def index(request):
 def group_required(group_name):
     def decorator(view_func):
         def _wrapped_view(request, *args, **kwargs):
-            if not request.user.is_authenticated or not request.user.groups.filter(name=group_name).exists():
+            # the user's groups are cached, so this only queries the database on a cache miss
+            if not user_in_group(request.user, group_name):
                 raise PermissionDenied
             return view_func(request, *args, **kwargs)
         return _wrapped_view
@@ -28,9 +40,10 @@ def group_required(group_name):
 '''This view will return a list of groups the user is in'''
 @api_view(['GET']) # only allow GET requests
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
 def user_groups(request):
     if request.user.is_authenticated:
-        groups = request.user.groups.values_list('name', flat=True)
+        groups = get_user_groups(request.user)
         return Response({"groups" : list(groups)})
     else:
         return Response({"detail": "Not authenticated"})
@@ -38,6 +51,7 @@ def user_groups(request):
 '''This function will be used to send the user's notifications to the frontend'''
 @api_view(['GET']) # only allow GET requests
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
 def get_notifications(request):
     try:
         # retrieve the citizen
@@ -51,70 +65,74 @@ def get_notifications(request):
     # serialize the notifications and send them to the frontend
     return Response(NotificationsSerializer(notifications, many=True).data)
     
+'''This function will be used to send a page of the user's inbox, most recent notifications first'''
+@api_view(['GET']) # only allow GET requests
+@permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
+def notifications_inbox(request):
+    # only the notifications of the user's citizen are in the inbox, users that aren't citizens have none
+    notifications = Notifications.objects.filter(citizen__user_id=request.user.pk)
+    # the frontend can ask for the unread notifications only
+    if request.query_params.get('unread') == 'true':
+        notifications = notifications.filter(is_read=False)
+    paginator = NotificationsPagination()
+    page = paginator.paginate_queryset(notifications, request)
+    return paginator.get_paginated_response(NotificationsInboxSerializer(page, many=True).data)
+
+'''This function will be used to send the number of unread notifications for the notifications badge'''
+@api_view(['GET']) # only allow GET requests
+@permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
+def unread_notifications_count(request):
+    # read the maintained counter instead of counting the notifications
+    count = Citizens.objects.filter(user_id=request.user.pk).values_list('unread_notifications_count', flat=True).first()
+    return Response({"unread_count": count or 0}, status=status.HTTP_200_OK)
+
+'''This function will be used to mark the given notifications, or all of them if none are given, as read'''
+@api_view(['POST']) # only allow POST requests
+@permission_classes([IsAuthenticated]) # only authenticated users can access this view
+def mark_notifications_read(request):
+    citizen_id = Citizens.objects.filter(user_id=request.user.pk).values_list('pk', flat=True).first()
+    if citizen_id is None:
+        return Response({"message": "User not associated with a citizen profile"}, status=status.HTTP_400_BAD_REQUEST)
+    ids = request.data.get('ids')
+    # the ids must be a list of notification ids
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids)):
+        return Response({"message": "ids must be a list of notification ids."}, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        notifications = Notifications.objects.filter(citizen_id=citizen_id, is_read=False)
+        if ids:
+            notifications = notifications.filter(id__in=ids)
+        # only the notifications that were actually unread are taken off the counter
+        updated = notifications.update(is_read=True)
+        if updated:
+            Citizens.objects.filter(pk=citizen_id).update(
+                unread_notifications_count=Greatest(F('unread_notifications_count') - updated, 0)
+            )
+    count = Citizens.objects.filter(pk=citizen_id).values_list('unread_notifications_count', flat=True).first()
+    return Response({"message": "The notifications have been marked as read.", "unread_count": count}, status=status.HTTP_200_OK)
+
 '''This api view will retrieve the user's documents and send it to the frontend'''
 class UserDocumentsAPIView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated] # only authenticated users can access this view
+    authentication_classes = [StatelessJWTAuthentication] # authenticate from the token's claims without loading the user
 
     def get(self, request, *args, **kwargs):
-        user = request.user
-        response_data = {}
-        try: # retrieve the user's citizen and send it in the response data
-            citizen = user.citizen
-            response_data['citizen'] = CitizensSerializer(citizen).data
-            # update the picture URL to include the base URL
-            if response_data['citizen']['picture']:
-                response_data['citizen']['picture'] = settings.BASE_URL + response_data['citizen']['picture']
-        except Exception as e:
+        try: # load the user's citizen profile together with all of their documents
+            documents = CitizenDocumentsLoader(request.user)
+        except Citizens.DoesNotExist:
             return Response({'error': 'User not associated with a citizen profile'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # retrieve the user's documents
-        try:
-            # since the user can only have one passport and one license, we can use get() instead of filter()
-            try:
-                passport = Passports.objects.get(citizen=citizen)
-                # serialize the passport data and include it in the response
-                response_data['passport'] = PassportsSerializer(passport).data
-                # update the picture URL to include the base URL
-                if response_data['passport']['picture']:
-                    response_data['passport']['picture'] = settings.BASE_URL + response_data['passport']['picture']
-            except Passports.DoesNotExist:           
-                response_data['passport'] = None
-            
-            try:
-                license = DrivingLicenses.objects.get(citizen=citizen)
-                # serialize the license data and include it in the response
-                response_data['license'] = DrivingLicenseSerializer(license).data
-                # update the picture URL to include the base URL
-                if response_data['license']['picture']:
-                    response_data['license']['picture'] = settings.BASE_URL + response_data['license']['picture']
-            except DrivingLicenses.DoesNotExist:
-                response_data['license'] = None
-
-            properties = Properties.objects.filter(citizen=citizen)
-            vehicles = Vehicles.objects.filter(citizen=citizen)
-            addresses = Addresses.objects.filter(citizen=citizen)
-
-            # update the response to include the other documents
-            response_data.update({
-                'properties': PropertiesSerializer(properties, many=True).data if properties.exists() else None,
-                'vehicles': VehiclesSerializer(vehicles, many=True).data if vehicles.exists() else None,
-                'addresses': AddressesSerializer(addresses, many=True).data if addresses.exists() else None,
-            })
-            # update the picture URLs to include the base URL
-            try:
-                if response_data['properties']:
-                    for property in response_data['properties']:
-                        if property['picture']:
-                            property['picture'] = settings.BASE_URL + property['picture']
-                if response_data['vehicles']:
-                    for vehicle in response_data['vehicles']:
-                        if vehicle['picture']:
-                            vehicle['picture'] = settings.BASE_URL + vehicle['picture']
-            except Exception as e:
-                print(f"Error updating picture URLs: {e}")
-                raise
 
-            # copilot ^_^
+        try:
+            # serialize the documents, the document serializers include the base URL in the picture URLs
+            response_data = {
+                'citizen': CitizenDocumentSerializer(documents.citizen).data,
+                'passport': PassportDocumentSerializer(documents.passport).data if documents.passport else None,
+                'license': DrivingLicenseDocumentSerializer(documents.license).data if documents.license else None,
+                'properties': PropertyDocumentSerializer(documents.properties, many=True).data if documents.properties else None,
+                'vehicles': VehicleDocumentSerializer(documents.vehicles, many=True).data if documents.vehicles else None,
+                'addresses': AddressesSerializer(documents.addresses, many=True).data if documents.addresses else None,
+            }
             return Response(response_data)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -137,6 +155,7 @@ def user_profile(request):
         # notify the user that the username has been changed
         Notifications.objects.create(citizen=citizen, message=f"Your username has been changed to {new_username}")
     # update the username
+    username_changed = new_username != user.username
     user.username = new_username
     user.save()
 
@@ -146,6 +165,9 @@ def user_profile(request):
         citizen.save()
         # notify the user that the profile picture has been updated
         Notifications.objects.create(citizen=citizen, message="Your profile picture has been updated.")
+    if username_changed or 'profile_picture' in request.FILES:
+        # copy the new username and picture to the citizen's posts and comments without making the user wait
+        run_in_background(refresh_author_snapshots, [citizen.pk])
     return Response({"message": "The profile has been updated successfully."}, status=status.HTTP_200_OK)
 
 '''This function will be used to change the user's password'''
@@ -207,6 +229,16 @@ def address_info_validation(request):
             
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+'''
+This function stores a renewal request as Validating and validates its photo in the background, so the request
+doesn't wait for the face detector. It returns 202 and the citizen is notified once the photo is validated.
+'''
+def submit_renewal_request(renewal_request):
+    renewal_request.status = "Validating"
+    renewal_request.save()
+    run_in_background(validate_renewal_request, renewal_request.pk)
+    return Response({"message": "The request has been received and its photo is being validated."}, status=status.HTTP_202_ACCEPTED)
+
 '''This function will be used to validate the passport information from the form and to create a new renewal request'''
 @api_view(['POST'])
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
@@ -232,11 +264,11 @@ def passport_info_validation(request):
                 if not data['reason'] or not data['proof_document']:
                     return Response({"message": "You need to provide a reason and a proof document to renew your passport early."}, status=status.HTTP_400_BAD_REQUEST)
             
-            # check if the uploaded image is valid
-            is_valid, message = validate_uploaded_photo(data['picture'])
+            # check if the uploaded image is valid, in async mode it is validated once the request is stored
+            is_valid, message = (True, None) if settings.PHOTO_VALIDATION_ASYNC else validate_uploaded_photo(data['picture'])
             if is_valid:
                 # check if the user already has a request pending
-                if not RenewalRequests.objects.filter(citizen=passport.citizen, request_type="Passport", status="Pending").exists(): # copilot helped correct this 
+                if not RenewalRequests.objects.filter(citizen=passport.citizen, request_type="Passport", status__in=["Validating", "Pending"]).exists(): # copilot helped correct this 
                 # create a new renewal request
                     if not data['reason'] and not data['proof_document']:
                         renewal_request = RenewalRequests(
@@ -252,6 +284,8 @@ def passport_info_validation(request):
                             reason = data['reason'],
                             proof_document = data['proof_document']
                         )
+                    if settings.PHOTO_VALIDATION_ASYNC:
+                        return submit_renewal_request(renewal_request)
                     renewal_request.save()
                     # notify the user
                     Notifications.objects.create(citizen=passport.citizen, message="Your passport renewal request has been submitted.")
@@ -295,11 +329,11 @@ def license_info_validation(request):
                 if not data['reason'] or not data['proof_document']:
                     return Response({"message": "You need to provide a reason and a proof document to renew your license early."}, status=status.HTTP_400_BAD_REQUEST)
             
-            # check if the uploaded image is valid
-            is_valid, message = validate_uploaded_photo(data['picture'])
+            # check if the uploaded image is valid, in async mode it is validated once the request is stored
+            is_valid, message = (True, None) if settings.PHOTO_VALIDATION_ASYNC else validate_uploaded_photo(data['picture'])
             if is_valid:
                 # check if the user already has a request pending
-                if not RenewalRequests.objects.filter(citizen=driversLicense.citizen, request_type="Driver's License", status="Pending").exists():
+                if not RenewalRequests.objects.filter(citizen=driversLicense.citizen, request_type="Driver's License", status__in=["Validating", "Pending"]).exists():
                     # create a new renewal request
                     if not data['reason'] and not data['proof_document']:
                         renewal_request = RenewalRequests(
@@ -315,6 +349,8 @@ def license_info_validation(request):
                             reason = data['reason'],
                             proof_document = data['proof_document']
                         )
+                    if settings.PHOTO_VALIDATION_ASYNC:
+                        return submit_renewal_request(renewal_request)
                     renewal_request.save()
                     # notify the user
                     Notifications.objects.create(citizen=driversLicense.citizen, message="Your driver's license renewal request has been submitted.")
@@ -476,7 +512,11 @@ def register_vehicle(request):
 '''This function will be used to retrieve the pending renewal requests that will be displayed to the inspector'''
 class RenewalRequestsAPIView(generics.ListAPIView):
     serializer_class = RenewalRequestsSerializer
-    queryset = RenewalRequests.objects.filter(status='Pending')
+    # join the citizen and batch load the passports and licenses so the query count doesn't grow with the number of requests
+    queryset = RenewalRequests.objects.filter(status='Pending').select_related('citizen').prefetch_related(
+        'citizen__passports_set',
+        'citizen__drivinglicenses_set',
+    )
 
 '''This view will accept the renewal requests'''
 @api_view(['POST'])
@@ -548,7 +588,8 @@ def reject_renewal_request(request, id):
 '''This function will be used to retrieve the pending registration requests that will be displayed to the inspector'''
 class RegistrationRequestsAPIView(generics.ListAPIView):
     serializer_class = RegistrationRequestsSerializer
-    queryset = RegistrationRequests.objects.filter(status='Pending')
+    # join the citizen here, the pending documents are batch loaded by the list serializer
+    queryset = RegistrationRequests.objects.filter(status='Pending').select_related('citizen')
         
 '''This view will accept the registration requests'''
 @api_view(['POST'])
@@ -644,41 +685,41 @@ def reject_registration_request(request, id):
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
 @group_required('Reps') # only Rpes can access this view
 def create_forum(request):
-    # retrieve the request data
-    title = request.data.get('title')
-    region = request.data.get('region')
-    # create a forum instance
-    forum = Forums.objects.create(title=title, region=region)
-    # add members based on the region
-    if region == 'nation':
-        members = Citizens.objects.all()
-    else:
-        members = Citizens.objects.filter(addresses__city__iexact=region).distinct()
-    # add the members to the forum
-    forum.members.add(*members)
+    # create a serializer instance and pass the data from the request
+    serializer = ForumCreationSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    # create a forum instance, the members of a region forum are found from the addresses when they are needed
+    forum = Forums.objects.create(title=data['title'], region=data['region'], membership_rule=data['membership_rule'])
+    if data['members']:
+        # add the chosen citizens to the forum by their national ids, they were checked by the serializer
+        forum.members.add(*data['members'])
     return Response({"message": "The forum has been created successfully."}, status=status.HTTP_200_OK)
 
 '''This function will be used to send the forums to the frontend'''
 class ForumsAPIView(generics.ListAPIView):
     serializer_class = ForumsSerializer
     permission_classes = [IsAuthenticated]
+    authentication_classes = [StatelessJWTAuthentication] # authenticate from the token's claims without loading the user
 
     def get_queryset(self):
         # retrieve the user
         user = self.request.user
         # check if the user is in the Reps group
-        if user.groups.filter(name='Reps').exists():
-            return Forums.objects.all()
+        if user_in_group(user, 'Reps'):
+            forums = Forums.objects.all()
         else: # citizen
-            # retrieve the user's regions
-            user_regions = list(Addresses.objects.filter(citizen=user.citizen).values_list('city', flat=True))
-            if user_regions:
-                user_regions.append('nation') # copilot ^_^
-                # filter forums by user's region or nationwide
-                return Forums.objects.filter(region__in=user_regions) # copilot ^_^
-            else:
-                # if the user has no registered region, only show nationwide forums
-                return Forums.objects.filter(region='nation')
+            # the cities of the user's addresses and the explicit forums the user was added to, both as subqueries
+            user_cities = Addresses.objects.filter(citizen__user_id=user.pk).annotate(city_lower=Lower('city')).values('city_lower')
+            user_forums = Forums.members.through.objects.filter(citizens__user_id=user.pk).values('forums_id')
+            # filter forums by user's region or nationwide, and add the explicit forums the user is a member of
+            forums = Forums.objects.annotate(region_lower=Lower('region')).filter(
+                Q(membership_rule='region', region='nation') |
+                Q(membership_rule='region', region_lower__in=user_cities) |
+                Q(membership_rule='explicit', pk__in=user_forums)
+            )
+        return forums
 
 '''This function will retrieve a single forum based on it's ID'''
 @api_view(['GET'])
@@ -702,33 +743,43 @@ def create_post(request):
     # retrive the forum and citizen
     citizen = request.user.citizen 
     forum = Forums.objects.get(id=forum_id)
-    # create a new post instance
-    Posts.objects.create(title=title, content=content, author=citizen, forum=forum)
+    # create a new post instance, a new post has no likes or comments so its hot score is only its time score
+    # the forum's posts counter is updated in the same transaction
+    with transaction.atomic():
+        Posts.objects.create(title=title, content=content, author=citizen, forum=forum, hot_score=hot_time_score(timezone.now()))
     return Response({"message": "The post has been created successfully."}, status=status.HTTP_200_OK)
 
 '''This function will be used to send the posts to the frontend'''
 @api_view(['GET'])
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
 def get_posts(request, forum_id):
     try:
         # retrieve the forum
         forum = Forums.objects.get(id=forum_id)
-        # retrieve the forum's posts
-        posts = Posts.objects.filter(forum=forum)
+        # retrieve the forum's posts with their authors and likes loaded for the whole page
+        posts = with_listing_relations(Posts.objects.filter(forum=forum))
+        # send a single page of posts when the client asks for one with a cursor or a page size,
+        # the hot sort always sends the top page read from the forum's hot score index
+        paginator = HotPostsPagination() if request.query_params.get('sort') == 'hot' else PostsPagination()
+        page = paginator.paginate_queryset(posts, request)
+        if page is not None:
+            return paginator.get_paginated_response(PostsSerializer(page, many=True, context={'request': request}).data)
         # serialize the posts and send them to the frontend
-        return Response(PostsSerializer(posts, many=True).data, status=status.HTTP_200_OK)
+        return Response(PostsSerializer(posts, many=True, context={'request': request}).data, status=status.HTTP_200_OK)
     except Forums.DoesNotExist:
         return Response({"message": "The forum does not exist."}, status=status.HTTP_400_BAD_REQUEST)
 
 '''This function will retrieve a single post based on it's ID'''
 @api_view(['GET'])
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
 def get_post(request, id):
     try:
-        # retrieve the post
-        post = Posts.objects.get(id=id)
+        # retrieve the post with its author and likes
+        post = with_listing_relations(Posts.objects).get(id=id)
         # serialize the post data and send it to the frontend
-        serializer = PostsSerializer(post)        
+        serializer = PostsSerializer(post, context={'request': request})        
         return Response(serializer.data, status=status.HTTP_200_OK)
     except Posts.DoesNotExist:
         return Response({"message": "The post does not exist."}, status=status.HTTP_400_BAD_REQUEST)
@@ -743,8 +794,10 @@ def create_comment(request, post_id):
         # retrieve the content from the request
         content = request.data.get('content')
         citizen = request.user.citizen
-        # create a new comment instance
-        Comments.objects.create(content=content, post=post, author=citizen)
+        # create a new comment instance and rank the post again, with the post's comments counter in the same transaction
+        with transaction.atomic():
+            Comments.objects.create(content=content, post=post, author=citizen)
+            update_hot_score(post)
         return Response({"message": "The comment has been created successfully."}, status=status.HTTP_200_OK)
     except Posts.DoesNotExist:
         return Response({"message": "The post does not exist."}, status=status.HTTP_400_BAD_REQUEST)
@@ -752,14 +805,20 @@ def create_comment(request, post_id):
 '''This function will be used to send the comments to the frontend'''
 @api_view(['GET'])
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
 def get_comments(request, post_id):
     try:
         # retrieve the post
         post = Posts.objects.get(id=post_id)
-        # retrieve the post's comments
-        comments = Comments.objects.filter(post=post)
+        # retrieve the post's comments with their authors and likes loaded for the whole page
+        comments = with_listing_relations(Comments.objects.filter(post=post))
+        # send a single page of comments when the client asks for one with a cursor or a page size
+        paginator = CommentsPagination()
+        page = paginator.paginate_queryset(comments, request)
+        if page is not None:
+            return paginator.get_paginated_response(CommentsSerializer(page, many=True, context={'request': request}).data)
         # serialize the comments and send them to the frontend
-        return Response(CommentsSerializer(comments, many=True).data, status=status.HTTP_200_OK)
+        return Response(CommentsSerializer(comments, many=True, context={'request': request}).data, status=status.HTTP_200_OK)
     except Posts.DoesNotExist:
         return Response({"message": "The post does not exist."}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -772,18 +831,10 @@ def update_post_likes(request, post_id):
         post = Posts.objects.get(id=post_id)
         # retrieve the citizen
         citizen = request.user.citizen
-        # check if the citizen is already in the post's likes
-        if citizen in post.likes.all():
-            # remove the citizen from the likes
-            post.likes.remove(citizen)
-        else:
-            # add the citizen to the likes
-            post.likes.add(citizen)
-        # update the like count
-        post.likes_count = post.likes.count()
-        post.save()
+        # add or remove the citizen's like and update the like count without loading the other likes
+        liked, likes_count = toggle_like(post, citizen.pk)
         # send a response including the likes count so that it can be displayed in the frontend
-        return Response({"message": "The likes have been updated successfully.", "likes_count" : post.likes_count}, status=status.HTTP_200_OK)
+        return Response({"message": "The likes have been updated successfully.", "likes_count" : likes_count}, status=status.HTTP_200_OK)
     except Posts.DoesNotExist:
         return Response({"message": "The post does not exist."}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -792,28 +843,41 @@ def update_post_likes(request, post_id):
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
 def update_comment_likes(request, comment_id):
     try:
-        # retrieve the comment
-        comment = Comments.objects.get(id=comment_id)
+        # retrieve the comment, the comments of a deleted post can't be liked
+        comment = Comments.objects.get(id=comment_id, post__is_deleted=False)
         # retrieve the citizen
         citizen = request.user.citizen
-        # check if the citizen is already in the comment's likes
-        if citizen in comment.likes.all():
-            # remove the citizen from the likes
-            comment.likes.remove(citizen)
-        else:
-            # add the citizen to the likes
-            comment.likes.add(citizen)
-        # update the like count
-        comment.likes_count = comment.likes.count()
-        comment.save()
+        # add or remove the citizen's like and update the like count without loading the other likes
+        liked, likes_count = toggle_like(comment, citizen.pk)
         # send a response including the likes count so that it can be displayed in the frontend
-        return Response({"message": "The likes have been updated successfully.", "likes_count" : comment.likes_count}, status=status.HTTP_200_OK)
+        return Response({"message": "The likes have been updated successfully.", "likes_count" : likes_count}, status=status.HTTP_200_OK)
     except Comments.DoesNotExist:
         return Response({"message": "The comment does not exist."}, status=status.HTTP_400_BAD_REQUEST)
 
+'''This function will be used to search the posts and comments of the forums, it sends a page of the best matches'''
+@api_view(['GET'])
+@permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
+def search(request):
+    backend = get_search_backend()
+    if backend is None:
+        return Response({"message": "The search is not available."}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    # retrieve the words to search for and the forum to search in
+    terms = search_terms(request.query_params.get('q'))
+    if not terms:
+        return Response({"message": "Enter the words to search for."}, status=status.HTTP_400_BAD_REQUEST)
+    forum_id = request.query_params.get('forum_id')
+    if forum_id is not None and not forum_id.isdigit():
+        return Response({"message": "The forum does not exist."}, status=status.HTTP_400_BAD_REQUEST)
+    # search the index and send the page of matches to the frontend
+    paginator = SearchPagination()
+    matches = paginator.paginate_search(backend, terms, request, forum_id=int(forum_id) if forum_id else None)
+    return paginator.get_paginated_response(matches)
+
 '''This function will be used to send the username for the logged in user to the frontend'''
 @api_view(['GET'])
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
+@authentication_classes([StatelessJWTAuthentication]) # authenticate from the token's claims without loading the user
 def get_user(request):
     return Response({"username": request.user.username}, status=status.HTTP_200_OK)
 
@@ -822,9 +886,11 @@ def get_user(request):
 @permission_classes([IsAuthenticated]) # only authenticated users can access this view
 def delete_comment(request, id):
     try:
-        # retrieve and delete the comment
-        comment = Comments.objects.get(id=id)
-        comment.delete()
+        # retrieve and delete the comment, then rank its post again, with the post's comments counter in the same transaction
+        comment = Comments.objects.select_related('post').get(id=id)
+        with transaction.atomic():
+            comment.delete()
+            update_hot_score(comment.post)
         return Response({"message": "The comment has been deleted successfully."}, status=status.HTTP_200_OK)
     except Comments.DoesNotExist:
         return Response({"message": "The comment does not exist."}, status=status.HTTP_400_BAD_REQUEST)
@@ -834,9 +900,12 @@ def delete_comment(request, id):
 @permission_classes([IsAuthenticated]) # only authenticated users can access this
 def delete_post(request, id):
     try:
-        # retrieve and delete the post
+        # retrieve the post and delete it with its comments and likes in chunks, or hide it and delete them in the background
         post = Posts.objects.get(id=id)
-        post.delete()
+        if settings.POST_DELETE_ASYNC:
+            soft_delete_post(post)
+        else:
+            purge_post(post.pk)
         return Response({"message": "The post has been deleted successfully."}, status=status.HTTP_200_OK)
     except Posts.DoesNotExist:
         return Response({"message": "The post does not exist."}, status=status.HTTP_400_BAD_REQUEST)
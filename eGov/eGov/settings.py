@@ -156,4 +156,53 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
 # The base url for the backend that will be used to render the pictures in the frontend
-BASE_URL = 'http://127.0.0.1:8080'
\ No newline at end of file
+BASE_URL = 'http://127.0.0.1:8080'
+
+# The default number of posts and comments in a page when the forum listings are paginated
+FORUM_POSTS_PAGE_SIZE = 20
+FORUM_COMMENTS_PAGE_SIZE = 20
+
+# The number of notifications in a page of the inbox
+NOTIFICATIONS_PAGE_SIZE = 20
+
+# The number of matches in a page of the forums' search
+SEARCH_PAGE_SIZE = 20
+
+# The per process cache of the users' groups used by the permission checks (time to live in seconds)
+GROUP_CACHE_TTL = 300
+GROUP_CACHE_MAXSIZE = 10000
+
+# When enabled, the likes counts are buffered in each process and written in batches every LIKES_FLUSH_INTERVAL seconds
+# instead of on every like, the likes table stays the source of truth (0 only flushes when flush() is called)
+LIKES_WRITE_BEHIND = False
+LIKES_FLUSH_INTERVAL = 1
+
+# The number of seconds it takes a post to need 10 times more likes and comments to rank as high as a new post in the hot sort
+HOT_SCORE_DECAY = 45000
+
+# Run the background tasks right away in the caller instead of in the pool of threads, for the tests that check them
+BACKGROUND_TASKS_EAGER = False
+# The number of threads that run the background tasks in each process
+BACKGROUND_TASK_WORKERS = 2
+
+# The number of rows deleted by each statement when a post is purged with its comments and likes
+POST_DELETE_CHUNK_SIZE = 1000
+# Hide the deleted posts right away and purge their rows in the background instead of during the request
+POST_DELETE_ASYNC = False
+
+# The face detector that validates the uploaded photos: 'rekognition' calls AWS Rekognition, 'local' runs in the process without any network
+FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'rekognition')
+FACE_DETECTOR_REGION = 'eu-west-2'
+# The most connections the Rekognition client keeps open, one per thread that validates a photo at the same time
+FACE_DETECTOR_MAX_CONNECTIONS = 10
+# The longest side, in pixels, of the uploaded photos when they are decoded for the validation and sent to the face detector
+PHOTO_VALIDATION_MAX_SIDE = 1024
+
+# Store the renewal requests as Validating and validate their photos in the background instead of during the request
+PHOTO_VALIDATION_ASYNC = False
+
+# The verdicts of the photo validation are cached by the photo's SHA-256 for PHOTO_VERDICT_TTL seconds, in each process
+# for the PHOTO_VERDICT_CACHE_MAXSIZE most recent photos and in the database for the PHOTO_VERDICT_MAX_ROWS most recent ones
+PHOTO_VERDICT_TTL = 24 * 60 * 60
+PHOTO_VERDICT_CACHE_MAXSIZE = 1000
+PHOTO_VERDICT_MAX_ROWS = 100000